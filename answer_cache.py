@@ -0,0 +1,241 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import Optional, List
+
+import numpy as np
+from dotenv import load_dotenv
+
+from kb_version import get_kb_version
+
+load_dotenv()
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))  # cosine tối thiểu để dùng lại
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "86400"))              # giây
+ANSWER_CACHE_MAX = int(os.getenv("ANSWER_CACHE_MAX", "1000"))               # số câu trả lời tối đa
+ANSWER_CACHE_MIN_ANSWER_LEN = int(os.getenv("ANSWER_CACHE_MIN_ANSWER_LEN", "20"))
+ANSWER_CACHE_MAX_QUESTION_WORDS = int(os.getenv("ANSWER_CACHE_MAX_QUESTION_WORDS", "50"))
+# Tầng SQLite dùng chung giữa các worker (gunicorn): câu trả lời một worker sinh ra, worker khác dùng lại được
+ANSWER_CACHE_DB = os.getenv("ANSWER_CACHE_DB", "./answer_cache.sqlite3")  # "" = chỉ giữ trong RAM
+
+# Câu trả lời bắt đầu bằng các tiền tố này không được đưa vào cache
+_REJECT_PREFIXES = ("Lỗi", "Mình chưa có dữ liệu")
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+class SemanticAnswerCache:
+    """
+    Cache câu trả lời LLM theo độ tương đồng ngữ nghĩa của câu hỏi.
+    Mỗi entry gắn với phiên bản tri thức (kb_version) lúc sinh câu trả lời;
+    entry của phiên bản cũ bị bỏ ngay khi phiên bản thay đổi.
+    Có db_path thì mỗi entry còn được ghi vào SQLite; trước mỗi lần tra cứu cache nạp thêm
+    các entry mới (id lớn hơn lần trước) do tiến trình khác ghi.
+    """
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, ttl: int = ANSWER_CACHE_TTL,
+                 max_items: int = ANSWER_CACHE_MAX, enabled: bool = ANSWER_CACHE_ENABLED,
+                 db_path: Optional[str] = ANSWER_CACHE_DB):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_items = max_items
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._entries: List[dict] = []
+        self._matrix = None          # (n x dim) các vector câu hỏi đã chuẩn hóa
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.shared_loaded = 0   # số entry nạp từ tiến trình khác
+
+        self._db = None
+        self._last_id = 0
+        if db_path and enabled:
+            self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS answers (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kb_version INTEGER NOT NULL,
+                    question TEXT NOT NULL,
+                    answer TEXT NOT NULL,
+                    vec BLOB NOT NULL,
+                    created REAL NOT NULL
+                )
+            """)
+            self._db.commit()
+
+    @staticmethod
+    def _normalize(vec) -> Optional[np.ndarray]:
+        v = np.asarray(vec, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else None
+
+    def _keep(self, mask):
+        self._entries = [e for e, k in zip(self._entries, mask) if k]
+        self._matrix = self._matrix[np.asarray(mask, dtype=bool)] if self._entries else None
+
+    def _sync_version(self, kb_version: int) -> bool:
+        """Chuyển sang kb_version nếu mới hơn; False nếu kb_version đã cũ (không bao giờ lùi phiên bản,
+        trừ khi chính file kb_version bị đặt lại)"""
+        if self._version is not None and kb_version < self._version and kb_version != get_kb_version():
+            return False
+        if self._version != kb_version:
+            self._entries, self._matrix = [], None
+            self._version = kb_version
+            self._last_id = 0
+            if self._db is not None:
+                self._db_write("DELETE FROM answers WHERE kb_version < ?", (kb_version,))
+        self._pull()
+        return True
+
+    # ------------------------------
+    # Tầng SQLite dùng chung
+    # ------------------------------
+    def _db_write(self, sql: str, params=()):
+        try:
+            cur = self._db.execute(sql, params)
+            self._db.commit()
+            return cur
+        except sqlite3.Error as e:
+            # DB đang bị tiến trình khác khóa quá lâu: vẫn dùng được cache trong RAM
+            print(f"[⚠️] Không ghi được cache câu trả lời: {e}")
+            return None
+
+    def _append(self, entry: dict, q: np.ndarray):
+        if len(self._entries) >= self.max_items:
+            # Bỏ entry ít được dùng gần đây nhất
+            lru = min(range(len(self._entries)), key=lambda i: self._entries[i]["last_used"])
+            self._keep([i != lru for i in range(len(self._entries))])
+        self._entries.append(entry)
+        row = q.reshape(1, -1)
+        self._matrix = row if self._matrix is None else np.vstack([self._matrix, row])
+
+    def _pull(self):
+        """Nạp các entry mới của phiên bản hiện tại mà tiến trình khác đã ghi"""
+        if self._db is None:
+            return
+        try:
+            rows = self._db.execute(
+                "SELECT id, question, answer, vec, created FROM answers WHERE id > ? AND kb_version = ? "
+                "AND created > ? ORDER BY id", (self._last_id, self._version, time.time() - self.ttl)
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"[⚠️] Không đọc được cache câu trả lời: {e}")
+            return
+        known = {e.get("id") for e in self._entries}
+        for row_id, question, answer, blob, created in rows:
+            self._last_id = max(self._last_id, row_id)
+            if row_id in known:
+                continue
+            self._append({"id": row_id, "question": question, "answer": answer, "kb_version": self._version,
+                          "created": created, "last_used": created, "hits": 0},
+                         np.frombuffer(blob, dtype=np.float32))
+            self.shared_loaded += 1
+
+    # ------------------------------
+    # Tra cứu & nạp
+    # ------------------------------
+    def lookup(self, qvec, kb_version: int) -> Optional[str]:
+        if not self.enabled:
+            return None
+        q = self._normalize(qvec)
+        with self._lock:
+            if not self._sync_version(kb_version) or q is None or self._matrix is None:
+                self.misses += 1
+                return None
+
+            now = time.time()
+            expired = [now - e["created"] > self.ttl for e in self._entries]
+            if any(expired):
+                self._keep([not x for x in expired])
+                if self._matrix is None:
+                    self.misses += 1
+                    return None
+
+            scores = self._matrix @ q
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                entry = self._entries[best]
+                entry["last_used"] = now
+                entry["hits"] += 1
+                self.hits += 1
+                return entry["answer"]
+            self.misses += 1
+            return None
+
+    def admit(self, question: str, qvec, answer: str, kb_version: int) -> bool:
+        """Chính sách nạp: bỏ qua câu hỏi quá dài, câu trả lời quá ngắn hoặc là thông báo lỗi"""
+        if not self.enabled:
+            return False
+        answer = (answer or "").strip()
+        if (len(question.split()) > ANSWER_CACHE_MAX_QUESTION_WORDS
+                or len(answer) < ANSWER_CACHE_MIN_ANSWER_LEN
+                or answer.startswith(_REJECT_PREFIXES)):
+            self.rejected += 1
+            return False
+        q = self._normalize(qvec)
+        if q is None:
+            return False
+        # Tri thức đổi trong lúc sinh câu trả lời: câu trả lời dựa trên tài liệu cũ, không nạp
+        if kb_version != get_kb_version():
+            return False
+
+        with self._lock:
+            if not self._sync_version(kb_version):
+                return False
+            if self._matrix is not None and float(np.max(self._matrix @ q)) >= self.threshold:
+                return False  # đã có câu gần giống
+
+            now = time.time()
+            entry = {
+                "id": None,
+                "question": question,
+                "answer": answer,
+                "kb_version": kb_version,
+                "created": now,
+                "last_used": now,
+                "hits": 0
+            }
+            if self._db is not None:
+                cur = self._db_write(
+                    "INSERT INTO answers (kb_version, question, answer, vec, created) VALUES (?, ?, ?, ?, ?)",
+                    (kb_version, question, answer, q.astype(np.float32).tobytes(), now)
+                )
+                if cur is not None:
+                    entry["id"] = cur.lastrowid
+                    self._db_write("DELETE FROM answers WHERE id <= ?", (cur.lastrowid - self.max_items,))
+            self._append(entry, q)
+            return True
+
+    def invalidate(self):
+        """Xóa toàn bộ cache (gọi khi tri thức thay đổi); bảng SQLite được dọn khi phiên bản mới được dùng"""
+        with self._lock:
+            self._entries, self._matrix = [], None
+            self._last_id = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "kb_version": self._version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "rejected": self.rejected,
+            "shared_loaded": self.shared_loaded,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+def get_answer_cache() -> SemanticAnswerCache:
+    """Cache câu trả lời dùng chung trong cả tiến trình"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = SemanticAnswerCache()
+        return _shared
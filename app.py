@@ -1,11 +1,18 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
-import os, json, shutil, uuid, datetime
+# startup được import đầu tiên: mốc thời gian cho báo cáo khởi động
+from startup import get_startup_report, start_warmup, Lazy, WARMUP_ENABLED
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, Response, stream_with_context, g, send_file
+import os, json, time
 from dotenv import load_dotenv
 
 # --- Module chính ---
-from rag_chatbot import RAGChatbot
-from faq_service import FAQService
-from rag_system import add_or_update_file, delete_knowledge, chatbot_reload_callback
+# langchain, chromadb, unstructured chỉ được import khi dựng chatbot (thread warm-up hoặc request đầu tiên)
+from ingest_jobs import IngestJobQueue
+from process_roles import get_writer_role
+from session_store import SessionStore, DEFAULT_SESSION_NAME
+from conversation import ConversationMemory
+from concurrency import get_llm_limiter
+from slow_profiler import get_profiler
+import metrics
 
 load_dotenv()
 app = Flask(__name__)
@@ -17,56 +24,166 @@ OLD_DOCS_DIR = "./old_docs"
 CHROMA_DB_PATH = "./knowledge_base_ptit"
 EMBEDDING_MODEL = "text-embedding-3-small"
 
-# --- Khởi tạo chatbot ---
-rag_chatbot = RAGChatbot()
-faq_service = FAQService()
+startup = get_startup_report()
 
-def reload_chatbot():
-    global rag_chatbot
-    rag_chatbot = RAGChatbot()
-
-chatbot_reload_callback = reload_chatbot
+# Upload tài liệu được xử lý nền, request chỉ trả về job id.
+# Mọi thao tác ghi tri thức đi qua hàng đợi (SQLite) và chỉ tiến trình writer thực thi;
+# chạy một tiến trình (flask run / python app.py) thì tiến trình này luôn là writer.
+ingest_queue = IngestJobQueue()
+writer_role = get_writer_role()
+writer_role.on_elected(ingest_queue.start)
+writer_role.start()
 
 
 # ===========================================
 # 🧾 QUẢN LÝ SESSION
 # ===========================================
 
-def load_sessions():
-    if not os.path.exists(CHAT_HISTORY_FILE):
-        return []
-    try:
-        with open(CHAT_HISTORY_FILE, "r", encoding="utf-8") as f:
-            content = f.read().strip()
-            return json.loads(content) if content else []
-    except Exception:
-        return []
-
-def save_sessions(sessions):
-    clean = [s for s in sessions if s.get("messages")]
-    with open(CHAT_HISTORY_FILE, "w", encoding="utf-8") as f:
-        json.dump(clean, f, ensure_ascii=False, indent=2)
-
-def find_session(sid):
-    sessions = load_sessions()
-    if not sid:
-        return None, sessions
-    for s in sessions:
-        if s.get("id") == sid:
-            return s, sessions
-    return None, sessions
-
-def create_session(initial_name=None):
-    s = {
-        "id": str(uuid.uuid4()),
-        "name": initial_name or "Cuộc trò chuyện mới",
-        "created": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "messages": []
-    }
-    sessions = load_sessions()
-    sessions.append(s)
-    save_sessions(sessions)
-    return s, sessions
+SESSIONS_PER_PAGE = 30
+
+session_store = SessionStore()
+# Chuyển lịch sử cũ từ chat_history.json sang SQLite (chỉ chạy lần đầu)
+session_store.migrate_from_json(CHAT_HISTORY_FILE)
+# Tóm tắt + vài lượt gần nhất để viết lại câu hỏi nối tiếp ("còn học phí ngành đó?");
+# LLM tóm tắt được gắn khi chatbot được dựng
+conversation_memory = ConversationMemory(session_store, llm=None)
+
+
+# ===========================================
+# 🤖 CHATBOT (dựng trễ)
+# ===========================================
+
+def _build_chatbot():
+    from rag_chatbot import RAGChatbot
+    from faq_service import FAQService
+
+    # Khi tri thức thay đổi rag_system gọi bot.reload() (hot-swap)
+    bot = RAGChatbot(faq_service=FAQService()).watch_knowledge()
+    conversation_memory.llm = bot.rewrite_llm
+    return bot
+
+# Chatbot (embeddings, Chroma, ChatOpenAI, FAQ) được tạo một lần, ở thread warm-up hoặc request đầu tiên
+chatbot = Lazy("chatbot", _build_chatbot)
+
+def get_chatbot():
+    return chatbot.get()
+
+def _refresh_popular():
+    """Tri thức đổi -> sinh lại câu trả lời của các câu hỏi phổ biến (một job, chạy ở writer)"""
+    from popular_questions import get_popular_questions
+
+    if get_popular_questions().clusters:
+        ingest_queue.submit_popular("regenerate")
+
+def _start_background_services():
+    from rag_system import start_auto_update, start_knowledge_watcher, register_reload_callback, CHROMA_HOST
+    from popular_questions import POPULAR_AUTO_REFRESH
+
+    # Đồng bộ định kỳ thư mục tài liệu (KB_SYNC_DIR) nếu bật KB_AUTO_SYNC=1
+    if os.getenv("KB_AUTO_SYNC", "0") == "1":
+        writer_role.on_elected(start_auto_update)
+    if POPULAR_AUTO_REFRESH:
+        writer_role.on_elected(lambda: register_reload_callback(_refresh_popular))
+    if writer_role.election:
+        # Worker khác đổi tri thức -> reload chatbot của worker này
+        start_knowledge_watcher()
+        if not CHROMA_HOST:
+            print("[⚠️] Nhiều worker nhưng chưa đặt CHROMA_HOST: các worker mở chung thư mục Chroma, "
+                  "kết quả tìm kiếm có thể cũ tới khi khởi động lại")
+
+def _warm_indexes():
+    """Nạp trước những gì request đầu tiên phải chờ: BM25, segment vector của Chroma, tokenizer"""
+    from context_builder import count_tokens
+
+    bot = get_chatbot()
+    if bot.lexical_index is not None:
+        bot.lexical_index.search("học phí", k=1)
+    if hasattr(bot.vector_store, "warm"):
+        bot.vector_store.warm()  # vector_index: đọc trước ma trận memory-map
+    else:
+        got = bot.vector_store._collection.get(limit=1, include=["embeddings"])
+        if len(got["ids"]):
+            bot.vector_store.similarity_search_by_vector(list(got["embeddings"][0]), k=1)
+    count_tokens("khởi động")
+
+def start_turn(text, sid):
+    """Tìm hoặc tạo session, đọc lịch sử gần nhất (s["history"]) rồi lưu tin nhắn của người dùng"""
+    s = session_store.get_session(sid, with_messages=False)
+    if not s:
+        s = session_store.create_session(text[:40])
+        s["history"] = None
+    else:
+        s["history"] = conversation_memory.load(s["id"])
+    s["message_id"] = session_store.append_message(s["id"], "user", text)
+    return s
+
+def finish_turn(s, text, reply, query=None):
+    """Lưu câu trả lời của bot (và câu hỏi đã viết lại nếu có), đặt tên cho session mới
+    và cập nhật tóm tắt hội thoại ở nền"""
+    if query:
+        session_store.set_message_query(s["message_id"], query)
+    session_store.append_message(s["id"], "bot", reply)
+    if s.get("name") == DEFAULT_SESSION_NAME:
+        session_store.rename_session(s["id"], text[:40] + ("..." if len(text) > 40 else ""))
+    conversation_memory.after_turn(s["id"])
+
+def record_turn(result, persist_ms, path, sid, duration_ms, status=200):
+    """Đưa một lượt hỏi-đáp vào /metrics và log một dòng JSON"""
+    metrics.record_answer(result, {"persist": persist_ms})
+    metrics.log_request(
+        path=path, status=status, session_id=sid, duration_ms=round(duration_ms, 2),
+        source=result.get("source"), timings={**(result.get("timings") or {}), "persist": persist_ms},
+        usage=result.get("usage") or {}, context=result.get("context") or {}, query=result.get("query")
+    )
+
+# ===========================================
+# 📈 METRICS & TRACING
+# ===========================================
+
+profiler = get_profiler()
+# Các route gọi liên tục (poll, scrape) không ghi log từng request
+QUIET_PATHS = {"/metrics", "/jobs", "/ready"}
+
+def _collect_runtime_metrics():
+    bot = chatbot.peek()
+    stats = (("embedding", bot.embeddings.stats()), ("answer", bot.answer_cache.stats()),
+             ("popular", bot.popular.stats())) if bot else ()
+    for cache, st in stats:
+        metrics.CACHE_EVENTS.set(st["hits"], cache=cache, result="hit")
+        metrics.CACHE_EVENTS.set(st["misses"], cache=cache, result="miss")
+    llm = get_llm_limiter().stats()
+    metrics.LLM_IN_FLIGHT.set(llm["in_flight"])
+    metrics.LLM_WAITING.set(llm["waiting"])
+
+metrics.register_collector(_collect_runtime_metrics)
+
+@app.before_request
+def _begin_trace():
+    g.trace_start = time.perf_counter()
+    g.profile = profiler.begin()
+
+@app.after_request
+def _end_trace(response):
+    duration = time.perf_counter() - g.trace_start
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.HTTP_REQUESTS.inc(method=request.method, route=route, status=response.status_code)
+    metrics.HTTP_SECONDS.observe(duration, route=route)
+    profile_path = profiler.end(g.pop("profile", None), f"{request.method} {request.path}")
+    # /send, /send-stream tự ghi log kèm timings từng bước
+    if request.path not in QUIET_PATHS and not g.get("logged") and not response.is_streamed:
+        metrics.log_request(path=request.path, method=request.method, status=response.status_code,
+                            duration_ms=round(duration * 1000, 2), profile=profile_path)
+    return response
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """Readiness probe: 200 khi warm-up xong (chatbot, index đã nạp), 503 khi đang khởi động"""
+    report = startup.as_dict()
+    return jsonify({"ready": startup.ready, **report}), (200 if startup.ready else 503)
 
 # ===========================================
 # ROUTES
@@ -75,9 +192,17 @@ def create_session(initial_name=None):
 @app.route("/", methods=["GET"])
 def index():
     sid = request.args.get("session_id")
-    sessions = load_sessions()
-    current, _ = find_session(sid) if sid else (None, None)
-    return render_template("index.html", sessions=sessions, current=current)
+    try:
+        page = max(1, int(request.args.get("page", 1)))
+    except ValueError:
+        page = 1
+    sessions = session_store.list_sessions(limit=SESSIONS_PER_PAGE, offset=(page - 1) * SESSIONS_PER_PAGE)
+    total = session_store.count_sessions()
+    current = session_store.get_session(sid) if sid else None
+    return render_template(
+        "index.html", sessions=sessions, current=current,
+        page=page, has_next=page * SESSIONS_PER_PAGE < total
+    )
 
 @app.route("/send", methods=["POST"])
 def send():
@@ -87,63 +212,93 @@ def send():
     if not text:
         return jsonify({"error": "Tin nhắn trống."}), 400
 
-    # Tìm hoặc tạo session
-    s, sessions = find_session(sid)
-    if not s:
-        s, sessions = create_session(text[:40])
-
-    s.setdefault("messages", [])
-    s["messages"].append({
-        "role": "user",
-        "text": text,
-        "ts": datetime.datetime.now().isoformat()
-    })
+    t = time.perf_counter()
+    s = start_turn(text, sid)
+    persist_ms = (time.perf_counter() - t) * 1000
 
     try:
-        faq_reply = faq_service.check(text)
-        reply = faq_reply or rag_chatbot.get_answer(text)
+        # FAQ + RAG dùng chung một lần embedding câu hỏi
+        result = get_chatbot().ask(text, s["history"])
     except Exception as e:
-        reply = f"Lỗi khi xử lý: {e}"
+        result = {"answer": f"Lỗi khi xử lý: {e}", "source": "error", "timings": {}}
+    reply, timings = result["answer"], result["timings"]
 
-    s["messages"].append({
-        "role": "bot",
-        "text": reply,
-        "ts": datetime.datetime.now().isoformat()
-    })
-
-    if s.get("name") == "Cuộc trò chuyện mới":
-        s["name"] = text[:40] + ("..." if len(text) > 40 else "")
+    t = time.perf_counter()
+    finish_turn(s, text, reply, result.get("query"))
+    persist_ms = round(persist_ms + (time.perf_counter() - t) * 1000, 2)
 
-    save_sessions(sessions)
+    record_turn(result, persist_ms, "/send", s["id"], (time.perf_counter() - g.trace_start) * 1000)
+    g.logged = True
 
     return jsonify({
         "reply": reply,
         "session_id": s["id"],
+        "timings": timings,
+        "context": result.get("context") or {},
         "success": True
     })
 
+@app.route("/send-stream", methods=["POST"])
+def send_stream():
+    """Như /send nhưng trả về Server-Sent Events: token gửi ngay khi LLM sinh ra"""
+    text = (request.form.get("message") or "").strip()
+    sid = request.form.get("session_id")
+
+    if not text:
+        return jsonify({"error": "Tin nhắn trống."}), 400
+
+    start = time.perf_counter()
+
+    def sse(event):
+        return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    def generate():
+        # Lưu câu hỏi ngay trong generator: client ngắt trước khi stream bắt đầu thì không để lại
+        # tin nhắn người dùng không có câu trả lời
+        t = time.perf_counter()
+        s = start_turn(text, sid)
+        persist_ms = (time.perf_counter() - t) * 1000
+        parts, done = [], {"source": "aborted", "timings": {}}
+        try:
+            yield sse({"type": "session", "session_id": s["id"]})
+            for event in get_chatbot().stream_answer(text, s["history"]):
+                if event["type"] == "token":
+                    parts.append(event["text"])
+                elif event["type"] == "done":
+                    done = event
+                yield sse(event)
+        finally:
+            # Lưu session một lần khi stream kết thúc (kể cả khi client ngắt giữa chừng)
+            t = time.perf_counter()
+            finish_turn(s, text, done.get("answer") or "".join(parts), done.get("query"))
+            record_turn(done, round(persist_ms + (time.perf_counter() - t) * 1000, 2), "/send-stream",
+                        s["id"], (time.perf_counter() - start) * 1000)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.route("/rename-session", methods=["POST"])
 def rename_session():
     sid = request.form.get("session_id")
     new_name = (request.form.get("new_name") or "").strip()
-    s, sessions = find_session(sid)
-    if s and new_name:
-        s["name"] = new_name
-        save_sessions(sessions)
+    if sid and new_name:
+        session_store.rename_session(sid, new_name)
     return redirect(url_for("index", session_id=sid))
 
 
 @app.route("/delete-session", methods=["POST"])
 def delete_session():
     sid = request.form.get("session_id")
-    sessions = [s for s in load_sessions() if s.get("id") != sid]
-    save_sessions(sessions)
+    if sid:
+        session_store.delete_session(sid)
     return redirect(url_for("index"))
 
 @app.route("/new-session", methods=["POST"])
 def new_session():
-    s, sessions = create_session()
-    save_sessions(sessions)
+    s = session_store.create_session()
     return redirect(url_for("index", session_id=s["id"]))
 
 
@@ -156,6 +311,9 @@ from flask import session  # bạn đã import rồi nên giữ nguyên
 
 @app.route("/admin", methods=["GET", "POST"])
 def admin_page():
+    from popular_questions import get_popular_questions
+    from kb_snapshot import list_snapshots as list_bundles
+
     admin_password = os.getenv("ADMIN_PASSWORD")
 
     msg = request.args.get("msg")
@@ -169,7 +327,8 @@ def admin_page():
                 f for f in os.listdir(OLD_DOCS_DIR)
                 if os.path.isfile(os.path.join(OLD_DOCS_DIR, f))
             ]
-        return render_template("admin.html", auth=True, knowledge_files=knowledge_files, msg=msg, err=err)
+        return render_template("admin.html", auth=True, knowledge_files=knowledge_files, msg=msg, err=err,
+                               popular=get_popular_questions().stats(), snapshots=list_bundles())
 
     # Xử lý đăng nhập
     if request.method == "POST":
@@ -188,7 +347,8 @@ def admin_page():
                 f for f in os.listdir(OLD_DOCS_DIR)
                 if os.path.isfile(os.path.join(OLD_DOCS_DIR, f))
             ]
-        return render_template("admin.html", auth=True, knowledge_files=knowledge_files, msg=msg, err=err)
+        return render_template("admin.html", auth=True, knowledge_files=knowledge_files, msg=msg, err=err,
+                               popular=get_popular_questions().stats(), snapshots=list_bundles())
 
     # Mặc định: nếu chưa đăng nhập
     return render_template("admin.html", auth=False)
@@ -197,95 +357,227 @@ def admin_page():
 # --- Upload file tri thức ---
 @app.route("/upload", methods=["POST"])
 def upload_file():
-    file = request.files.get("file")
-    if not file or file.filename == "":
+    files = [f for f in request.files.getlist("file") if f and f.filename]
+    if not files:
         return redirect(url_for("admin_page", err="Chưa chọn file."))
 
-    file_name = file.filename
     os.makedirs("./temp_uploads", exist_ok=True)
-    temp_path = os.path.join("./temp_uploads", file_name)
-    file.save(temp_path)
-
-    # Gọi RAG system để kiểm tra trùng tên
-    result = add_or_update_file(temp_path, force_replace=False)
-    if result.get("exists"):
-        return render_template("confirm_replace.html", file_name=file_name)
-
-    msg = f"✅ Đã thêm file '{file_name}' thành công!!!!"
+    queued, existing = [], []
+    for file in files:
+        file_name = file.filename
+        temp_path = os.path.join("./temp_uploads", file_name)
+        file.save(temp_path)
+
+        # File trùng tên cần admin xác nhận ghi đè
+        if os.path.exists(os.path.join(OLD_DOCS_DIR, file_name)):
+            existing.append(file_name)
+        else:
+            queued.append(ingest_queue.submit(temp_path))
+
+    if existing:
+        return render_template("confirm_replace.html", file_names=existing, queued=queued)
+
+    names = ", ".join(j["file"] for j in queued)
+    msg = f"⏳ Đã đưa {len(queued)} file vào hàng đợi xử lý: {names}"
     return redirect(url_for("admin_page", msg=msg))
 
 
 # --- Xác nhận ghi đè file ---
 @app.route("/confirm-replace", methods=["POST"])
 def confirm_replace():
-    file_name = request.form.get("file_name")
+    file_names = request.form.getlist("file_name")
     decision = request.form.get("decision")
-    temp_path = os.path.join("./temp_uploads", file_name)
 
     if decision == "yes":
-        result = add_or_update_file(temp_path, force_replace=True)
-        msg = result.get("message", "Đã ghi đè tri thức.")
+        jobs = ingest_queue.submit_many(
+            [os.path.join("./temp_uploads", f) for f in file_names], force_replace=True
+        )
+        msg = f"⏳ Đang ghi đè {len(jobs)} file: " + ", ".join(j["file"] for j in jobs)
     else:
         msg = "❌ Đã hủy cập nhật."
 
     return redirect(url_for("admin_page", msg=msg))
 
 
+# --- Trạng thái job nạp tài liệu ---
+@app.route("/jobs", methods=["GET"])
+def list_jobs():
+    if not session.get("is_admin"):
+        return jsonify({"error": "Cần đăng nhập quản trị."}), 403
+    return jsonify({"jobs": ingest_queue.list()})
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    if not session.get("is_admin"):
+        return jsonify({"error": "Cần đăng nhập quản trị."}), 403
+    job = ingest_queue.get(job_id)
+    if not job:
+        return jsonify({"error": "Không tìm thấy job."}), 404
+    return jsonify(job)
+
+
 # --- Xóa tri thức ---
 @app.route("/delete-knowledge", methods=["POST"])
 def delete_knowledge_file():
     file_name = request.form.get("file_name")
-    success = delete_knowledge(file_name)
-    msg = f"Đã xóa {file_name}" if success else f"Lỗi khi xóa {file_name}"
-    return redirect(url_for("admin_page", msg=msg))
+    job = ingest_queue.submit_delete(file_name)
+    return redirect(url_for("admin_page", msg=f"⏳ Đang xóa {file_name} (job {job['id']})."))
 
 
 # --- Reset toàn bộ tri thức ---
 @app.route("/reset-knowledge", methods=["POST"])
 def reset_knowledge():
     try:
-        try:
-            if rag_chatbot:
-                rag_chatbot.close()
-        except Exception as e:
-            print("Không thể đóng DB:", e)
+        # Reset rồi xây lại từ old_docs trong nền (parse song song, embed theo batch)
+        job = ingest_queue.submit_reset(OLD_DOCS_DIR)
+        msg = f"⏳ Đang reset cơ sở tri thức và nạp lại từ old_docs (job {job['id']})..."
+    except Exception as e:
+        msg = f"Lỗi khi reset tri thức: {e}"
 
-        if os.path.exists(CHROMA_DB_PATH):
-            import stat
+    return redirect(url_for("admin_page", msg=msg))
 
-            def force_remove_readonly(func, path, exc_info):
-                os.chmod(path, stat.S_IWRITE)
-                os.remove(path)
 
-            shutil.rmtree(CHROMA_DB_PATH, onerror=force_remove_readonly)
+# --- Nạp hàng loạt một thư mục ---
+@app.route("/bulk-ingest", methods=["POST"])
+def bulk_ingest_route():
+    if not session.get("is_admin"):
+        return redirect(url_for("admin_page", err="Cần đăng nhập quản trị."))
+    directory = request.form.get("directory") or OLD_DOCS_DIR
+    if directory not in (OLD_DOCS_DIR, os.getenv("KB_SYNC_DIR", "./new_docs")):
+        return redirect(url_for("admin_page", err="Thư mục không hợp lệ."))
+    job = ingest_queue.submit_bulk(directory)
+    return redirect(url_for("admin_page", msg=f"⏳ Đang nạp hàng loạt {directory} (job {job['id']})."))
 
-        os.makedirs(CHROMA_DB_PATH, exist_ok=True)
 
-        reload_chatbot()
 
-        msg = "Đã reset lại cơ sở tri thức."
+# --- Đồng bộ thư mục tài liệu ngay ---
+@app.route("/sync-knowledge", methods=["POST"])
+def sync_knowledge():
+    if not session.get("is_admin"):
+        return redirect(url_for("admin_page", err="Cần đăng nhập quản trị."))
+    try:
+        job = ingest_queue.submit_sync()
+        return redirect(url_for("admin_page", msg=f"⏳ Đang đồng bộ thư mục tài liệu (job {job['id']})."))
     except Exception as e:
-        msg = f"Lỗi khi reset tri thức: {e}"
-
-    return redirect(url_for("admin_page", msg=msg))
-
-
+        return redirect(url_for("admin_page", err=f"Lỗi đồng bộ: {e}"))
 
 # --- Rebuild FAQ ---
 @app.route("/rebuild-faq", methods=["POST"])
 def rebuild_faq():
     try:
-        faq_service.rebuild()
+        get_chatbot().faq.rebuild()
         return redirect(url_for("admin_page", msg="Đã rebuild FAQ thành công."))
     except Exception as e:
         return redirect(url_for("admin_page", err=f"Lỗi rebuild FAQ: {e}"))
 
+# --- Câu hỏi phổ biến: phân cụm lịch sử + sinh sẵn câu trả lời ---
+@app.route("/mine-popular", methods=["POST"])
+def mine_popular():
+    if not session.get("is_admin"):
+        return redirect(url_for("admin_page", err="Cần đăng nhập quản trị."))
+    job = ingest_queue.submit_popular("mine")
+    return redirect(url_for("admin_page", msg=f"⏳ Đang phân tích câu hỏi phổ biến (job {job['id']})."))
+
+# --- Snapshot tri thức: export / tải về / khôi phục (không embed lại) ---
+@app.route("/snapshot-export", methods=["POST"])
+def snapshot_export():
+    if not session.get("is_admin"):
+        return redirect(url_for("admin_page", err="Cần đăng nhập quản trị."))
+    job = ingest_queue.submit_snapshot()
+    return redirect(url_for("admin_page", msg=f"⏳ Đang export snapshot tri thức (job {job['id']})."))
+
+@app.route("/snapshots", methods=["GET"])
+def list_snapshots():
+    from kb_snapshot import list_snapshots as list_bundles
+
+    if not session.get("is_admin"):
+        return jsonify({"error": "Cần đăng nhập quản trị."}), 403
+    return jsonify({"snapshots": list_bundles()})
+
+@app.route("/snapshots/<name>", methods=["GET"])
+def download_snapshot(name):
+    from kb_snapshot import snapshot_path
+
+    if not session.get("is_admin"):
+        return jsonify({"error": "Cần đăng nhập quản trị."}), 403
+    try:
+        path = snapshot_path(name)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not os.path.exists(path):
+        return jsonify({"error": "Không tìm thấy snapshot."}), 404
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=os.path.basename(path))
+
+@app.route("/snapshot-restore", methods=["POST"])
+def snapshot_restore():
+    import tempfile
+    from kb_snapshot import snapshot_path, read_manifest, SNAPSHOT_DIR
+
+    if not session.get("is_admin"):
+        return redirect(url_for("admin_page", err="Cần đăng nhập quản trị."))
+    upload = request.files.get("file")
+    tmp_path = None
+    try:
+        # Bundle tải lên được lưu vào SNAPSHOT_DIR; hoặc chọn bundle đã có theo tên
+        path = snapshot_path(upload.filename if upload and upload.filename else request.form.get("name"))
+        if upload and upload.filename:
+            if os.path.exists(path):
+                raise ValueError(f"đã có bundle tên {os.path.basename(path)}, hãy đổi tên file hoặc chọn bundle đó")
+            # Ghi ra file tạm, kiểm tra xong mới đặt tên thật; os.link không ghi đè nếu tên đã bị chiếm
+            os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix=".upload-", suffix=".tmp", dir=SNAPSHOT_DIR)
+            os.close(fd)
+            upload.save(tmp_path)
+            read_manifest(tmp_path)
+            try:
+                os.link(tmp_path, path)
+            except FileExistsError:
+                raise ValueError(f"đã có bundle tên {os.path.basename(path)}")
+        else:
+            read_manifest(path)
+    except Exception as e:
+        return redirect(url_for("admin_page", err=f"Snapshot không hợp lệ: {e}"))
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    job = ingest_queue.submit_restore(path)
+    return redirect(url_for("admin_page", msg=f"⏳ Đang khôi phục tri thức từ {os.path.basename(path)} (job {job['id']})."))
+
+# --- Thống kê cache embedding ---
+@app.route("/cache-stats", methods=["GET"])
+def cache_stats():
+    from llm_clients import breaker_stats
+    from parse_cache import get_parse_cache
+    from popular_questions import get_popular_questions
+
+    bot = get_chatbot()
+    return jsonify({
+        "generation": bot.generation,
+        "embeddings": bot.embeddings.stats(),
+        "answers": bot.answer_cache.stats(),
+        "popular": get_popular_questions().stats(),
+        "lexical": bot.lexical_index.stats() if bot.lexical_index else None,
+        "upstream": breaker_stats(),
+        "parse": get_parse_cache().stats(),
+        "vector_index": bot.vector_store.stats() if hasattr(bot.vector_store, "stats") else None,
+        "process": writer_role.stats()
+    })
+
 @app.route("/logout")
 def logout():
     session.pop("is_admin", None)
     return redirect(url_for("admin_page"))
 
 
+# ===========================================
+# KHỞI ĐỘNG
+# ===========================================
+startup.mark("import")
+# WARMUP=0: không dựng trước, chatbot được tạo ở request đầu tiên
+start_warmup([("services", _start_background_services)] +
+             ([("chatbot", get_chatbot), ("indexes", _warm_indexes)] if WARMUP_ENABLED else []))
+
+
 # ===========================================
 # CHẠY ỨNG DỤNG
 # ===========================================
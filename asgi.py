@@ -0,0 +1,119 @@
+"""
+Chế độ phục vụ bất đồng bộ (ASGI).
+
+POST /send được xử lý trên event loop bằng aembed_query / ainvoke,
+số lời gọi LLM đồng thời bị giới hạn bởi LLM_MAX_CONCURRENCY / LLM_MAX_QUEUE.
+Mọi route khác được chuyển cho ứng dụng Flask qua WsgiToAsgi.
+
+Chạy:  uvicorn asgi:app --host 0.0.0.0 --port 8000
+"""
+import io
+import json
+import time
+import asyncio
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.wrappers import Request
+
+import app as flask_app
+import metrics
+from concurrency import QueueFullError
+from http_clients import aclose_http_clients
+
+_flask_asgi = WsgiToAsgi(flask_app.app)
+
+
+async def _read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+def _parse_form(scope, body: bytes):
+    """Dùng werkzeug để đọc form (urlencoded hoặc multipart như FormData của trình duyệt)"""
+    headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "CONTENT_TYPE": headers.get("content-type", ""),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": io.BytesIO(body),
+        "SERVER_NAME": "asgi",
+        "SERVER_PORT": "0",
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+    }
+    return Request(environ).form
+
+
+async def _json_response(send, status: int, payload: dict):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json; charset=utf-8"),
+                    (b"content-length", str(len(body)).encode())]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_async(scope, receive, send):
+    form = _parse_form(scope, await _read_body(receive))
+    text = (form.get("message") or "").strip()
+    sid = form.get("session_id")
+
+    if not text:
+        await _json_response(send, 400, {"error": "Tin nhắn trống."})
+        return
+
+    start = time.perf_counter()
+    s = await asyncio.to_thread(flask_app.start_turn, text, sid)
+    persist_ms = (time.perf_counter() - start) * 1000
+
+    try:
+        # Chatbot chưa dựng xong (đang warm-up) -> chờ trong thread, không chặn event loop
+        bot = flask_app.chatbot.peek() or await asyncio.to_thread(flask_app.get_chatbot)
+        result = await bot.aask(text, s["history"])
+    except QueueFullError as e:
+        metrics.ANSWERS.inc(source="rejected")
+        metrics.HTTP_REQUESTS.inc(method="POST", route="/send", status=503)
+        await _json_response(send, 503, {"error": str(e), "session_id": s["id"]})
+        return
+    except Exception as e:
+        result = {"answer": f"Lỗi khi xử lý: {e}", "source": "error", "timings": {}}
+    reply, timings = result["answer"], result["timings"]
+
+    t = time.perf_counter()
+    await asyncio.to_thread(flask_app.finish_turn, s, text, reply, result.get("query"))
+    persist_ms = round(persist_ms + (time.perf_counter() - t) * 1000, 2)
+    duration = time.perf_counter() - start
+    flask_app.record_turn(result, persist_ms, "/send", s["id"], duration * 1000)
+    metrics.HTTP_REQUESTS.inc(method="POST", route="/send", status=200)
+    metrics.HTTP_SECONDS.observe(duration, route="/send")
+
+    await _json_response(send, 200, {
+        "reply": reply,
+        "session_id": s["id"],
+        "timings": timings,
+        "context": result.get("context") or {},
+        "success": True
+    })
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await aclose_http_clients()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == "/send":
+        await send_async(scope, receive, send)
+        return
+
+    await _flask_asgi(scope, receive, send)
@@ -0,0 +1,149 @@
+"""
+So sánh throughput của /send: Flask đồng bộ (thread pool) và ASGI bất đồng bộ (asgi.py),
+với server OpenAI giả lập chạy cục bộ.
+
+    python benchmarks/bench_async.py --requests 200 --concurrency 32 --chat-latency-ms 400
+
+Hai chế độ chạy cùng số request đồng thời (--concurrency; --sync-workers chỉ để thử riêng chế độ đồng bộ),
+nên chênh lệch throughput đến từ server chứ không phải từ client. Chroma được copy sang thư mục tạm.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_openai import start_stub_server
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    idx = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+def summarize(name, latencies, elapsed):
+    return {
+        "mode": name,
+        "requests": len(latencies),
+        "elapsed_sec": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1)
+    }
+
+
+def run_sync(flask_app, questions, workers):
+    def one(q):
+        client = flask_app.test_client()
+        start = time.perf_counter()
+        r = client.post("/send", data={"message": q})
+        assert r.status_code == 200, r.data
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    # Mỗi thread giữ chặt một worker trong suốt thời gian chờ OpenAI (như Flask/gunicorn đồng bộ)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        latencies = list(pool.map(one, questions))
+    return summarize("flask-sync", latencies, time.perf_counter() - start)
+
+
+async def run_async(asgi_app, questions, concurrency):
+    import httpx
+
+    sem = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=asgi_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one(q):
+            async with sem:
+                start = time.perf_counter()
+                r = await client.post("/send", data={"message": q})
+                assert r.status_code == 200, r.text
+                return time.perf_counter() - start
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(one(q) for q in questions))
+    return summarize("asgi-async", latencies, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Flask sync vs ASGI async")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--embed-latency-ms", type=float, default=30)
+    parser.add_argument("--chat-latency-ms", type=float, default=400)
+    parser.add_argument("--sync-workers", type=int, default=None,
+                        help="Số thread client của chế độ đồng bộ (mặc định bằng --concurrency)")
+    parser.add_argument("--llm-max-concurrency", type=int, default=64)
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    args = parser.parse_args()
+    if args.sync_workers is None:
+        args.sync_workers = args.concurrency
+
+    server, base_url = start_stub_server(embed_latency_ms=args.embed_latency_ms,
+                                         chat_latency_ms=args.chat_latency_ms)
+    tmp = tempfile.mkdtemp(prefix="ptit_bench_")
+    os.environ.update({
+        "OPENAI_BASE_URL": base_url,
+        "OPENAI_API_KEY": "stub",
+        "EMBED_CACHE_DB": "",
+        "EMBED_CHECK_CTX_LENGTH": "0",
+        "ANSWER_CACHE_ENABLED": "0",
+        "SESSION_DB": os.path.join(tmp, "sessions.sqlite3"),
+        "INGEST_JOBS_DB": os.path.join(tmp, "ingest_jobs.sqlite3"),
+        "POPULAR_STATS_DB": os.path.join(tmp, "popular_stats.sqlite3"),
+        "VECTOR_INDEX_DIR": os.path.join(tmp, "vector_index"),
+        "LLM_MAX_CONCURRENCY": str(args.llm_max_concurrency),
+        "LLM_MAX_QUEUE": str(args.requests),
+    })
+    os.chdir(ROOT)
+
+    # Mọi trạng thái ghi ra đĩa của benchmark nằm trong thư mục tạm (Chroma chạy trên bản copy),
+    # không đụng tới knowledge_base_ptit / index FAQ thật
+    import faq_service
+    import kb_version
+    import rag_system
+    faq_service.INDEX_FILE = os.path.join(tmp, "faq_index.npy")
+    faq_service.MANIFEST_FILE = os.path.join(tmp, "faq_index.json")
+    kb_version.KB_VERSION_FILE = os.path.join(tmp, "kb_version.json")
+    shutil.copytree(rag_system.CHROMA_DB_PATH, os.path.join(tmp, "chroma"))
+    rag_system.CHROMA_DB_PATH = os.path.join(tmp, "chroma")
+    rag_system.UPDATE_LOG_FILE = os.path.join(tmp, "update_log.json")
+
+    import app as flask_app
+    import asgi
+    # Không tính thời gian dựng chatbot (warm-up) vào thông lượng
+    flask_app.startup.wait()
+
+    questions = [f"Câu hỏi thử nghiệm số {i} về học phí và học bổng PTIT" for i in range(args.requests)]
+    results = [
+        run_sync(flask_app.app, questions, args.sync_workers),
+        asyncio.run(run_async(asgi.app, [q + " (async)" for q in questions], args.concurrency)),
+    ]
+    report = {
+        "config": vars(args),
+        "results": results,
+        "speedup": round(results[1]["throughput_rps"] / results[0]["throughput_rps"], 2)
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    server.shutdown()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+So sánh embed_query gọi trực tiếp (mỗi câu hỏi một request HTTP) và qua BatchingEmbeddings
+(gom các câu hỏi đồng thời thành một request embed_documents), với server OpenAI giả lập.
+
+    python benchmarks/bench_embed_batching.py --queries 2000 --concurrency 64 --embed-latency-ms 30
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_openai import start_stub_server, StubHandler
+from bench_async import summarize
+
+
+def run(name, embeddings, questions, concurrency):
+    def one(q):
+        start = time.perf_counter()
+        vec = embeddings.embed_query(q)
+        assert len(vec) > 0
+        return time.perf_counter() - start
+
+    before = dict(StubHandler.counters)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(one, questions))
+    result = summarize(name, latencies, time.perf_counter() - start)
+    result["http_requests"] = StubHandler.counters["embeddings"] - before["embeddings"]
+    result["embedded_texts"] = StubHandler.counters["embedding_inputs"] - before["embedding_inputs"]
+    if hasattr(embeddings, "stats"):
+        result["batching"] = embeddings.stats()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark gom batch embed_query")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duplicate-rate", type=float, default=0.2,
+                        help="Tỉ lệ câu hỏi lặp lại một câu phổ biến (giờ cao điểm)")
+    parser.add_argument("--embed-latency-ms", type=float, default=30)
+    parser.add_argument("--embed-item-latency-ms", type=float, default=0.2,
+                        help="Thời gian thêm cho mỗi text trong một request")
+    parser.add_argument("--window-ms", type=float, default=5)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(embed_latency_ms=args.embed_latency_ms)
+    StubHandler.config["embed_item_latency"] = args.embed_item_latency_ms / 1000
+    os.environ.update({"EMBED_BASE_URL": base_url, "EMBED_API_KEY": "stub", "HEDGE_AFTER_MS": "0"})
+
+    from llm_clients import make_embeddings
+    from embed_batcher import BatchingEmbeddings
+
+    popular = [f"Học phí ngành {i} năm nay là bao nhiêu?" for i in range(10)]
+    questions = [popular[i % len(popular)] if (i * 7919) % 100 < args.duplicate_rate * 100
+                 else f"Câu hỏi thử nghiệm số {i} về học bổng PTIT" for i in range(args.queries)]
+
+    base = make_embeddings("text-embedding-3-small", check_ctx_length=False)
+    results = [
+        run("direct", base, questions, args.concurrency),
+        run("batched", BatchingEmbeddings(base, window_ms=args.window_ms, max_batch=args.max_batch),
+            [q + " " for q in questions], args.concurrency),
+    ]
+    report = {
+        "config": vars(args),
+        "results": results,
+        "speedup": round(results[1]["throughput_rps"] / results[0]["throughput_rps"], 2)
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
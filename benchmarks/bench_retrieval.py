@@ -0,0 +1,286 @@
+"""
+Benchmark chất lượng truy xuất + độ trễ, chạy offline với server OpenAI giả lập.
+
+Bộ câu hỏi cố định (retrieval_questions.json) kèm file nguồn mong đợi; đo:
+  - recall@k và MRR theo file nguồn cho từng chế độ: vector, lexical (BM25), hybrid (RRF)
+  - FAQService.check: tỉ lệ khớp đúng / khớp nhầm
+  - get_answer đầy đủ: p50/p95/p99 từng bước (embed, faq, retrieve, generate, total) và throughput
+
+    python benchmarks/bench_retrieval.py --output results.json
+    python benchmarks/bench_retrieval.py --baseline results.json   # so sánh, exit 1 nếu tụt
+
+--corpus chroma (mặc định) lấy các đoạn có sẵn trong ./knowledge_base_ptit, embed lại bằng stub;
+--corpus new_docs parse lại new_docs/ bằng process_file (cần đủ dependency của unstructured).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_openai import start_stub_server
+from bench_async import percentile
+
+QUESTIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "retrieval_questions.json")
+STAGES = ("embed", "faq", "answer_cache", "retrieve", "context", "generate", "total")
+
+
+def latency_summary(values):
+    if not values:
+        return None
+    return {
+        "n": len(values),
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "mean": round(statistics.mean(values), 2)
+    }
+
+
+def rank_metrics(retrieved_files, expected_files):
+    """(recall@k theo file, reciprocal rank của đoạn đúng đầu tiên)"""
+    expected = set(expected_files)
+    recall = len(expected & set(retrieved_files)) / len(expected)
+    rr = next((1.0 / i for i, f in enumerate(retrieved_files, 1) if f in expected), 0.0)
+    return recall, rr
+
+
+def setup_environment(args, tmp):
+    os.environ.update({
+        "OPENAI_BASE_URL": args.base_url,
+        "OPENAI_API_KEY": "stub",
+        "EMBED_CACHE_DB": "",
+        "EMBED_CHECK_CTX_LENGTH": "0",
+        "ANSWER_CACHE_ENABLED": "0",
+        "ANSWER_CACHE_DB": "",
+        "POPULAR_STATS_DB": "",
+        "CHROMA_HOST": "",
+        "SESSION_DB": os.path.join(tmp, "sessions.sqlite3"),
+        "LLM_MAX_CONCURRENCY": "64",
+    })
+    os.chdir(ROOT)
+
+    # Mọi trạng thái ghi ra đĩa của benchmark nằm trong thư mục tạm, không đụng dữ liệu thật
+    import faq_service
+    import kb_version
+    import rag_system
+    faq_service.INDEX_FILE = os.path.join(tmp, "faq_index.npy")
+    faq_service.MANIFEST_FILE = os.path.join(tmp, "faq_index.json")
+    kb_version.KB_VERSION_FILE = os.path.join(tmp, "kb_version.json")
+    rag_system.CHROMA_DB_PATH = os.path.join(tmp, "chroma")
+    rag_system.OLD_DOCS_DIR = os.path.join(tmp, "old_docs")
+    rag_system.UPDATE_LOG_FILE = os.path.join(tmp, "update_log.json")
+
+
+def load_corpus(args):
+    """Nạp corpus vào Chroma tạm, trả về tập file_name có trong corpus"""
+    import rag_system
+
+    if args.corpus == "new_docs":
+        import bulk_ingest
+        bulk_ingest.OLD_DOCS_DIR = rag_system.OLD_DOCS_DIR
+        result = bulk_ingest.bulk_ingest(bulk_ingest.list_documents(args.docs_dir), copy_to_old_docs=False)
+        if result["failed"]:
+            print(f"[⚠️] Không parse được: {', '.join(result['failed'])}", file=sys.stderr)
+    else:
+        import chromadb
+        from langchain_core.documents import Document
+
+        source = chromadb.PersistentClient(path=args.source_db).get_collection("langchain")
+        data = source.get(include=["documents", "metadatas"])
+        docs = [Document(page_content=text, metadata=dict(meta or {}))
+                for text, meta in zip(data["documents"], data["metadatas"])]
+        ids = rag_system.assign_chunk_ids(docs)
+        store = rag_system.get_vector_store()
+        for i in range(0, len(docs), 500):
+            store.add_documents(docs[i:i + 500], ids=ids[i:i + 500])
+
+    meta = rag_system.get_vector_store().get(include=["metadatas"])["metadatas"]
+    return {m.get("file_name") for m in meta if m and m.get("file_name")}, len(meta)
+
+
+def bench_pipeline(chatbot, questions, concurrency, repeat):
+    """get_answer đầy đủ (cache embedding bị xóa giữa các vòng để mỗi vòng đều gọi API embed)"""
+    stage_ms = {s: [] for s in STAGES}
+    sources = {}
+    context = {"baseline_tokens": 0, "context_tokens": 0, "tokens_saved": 0}
+
+    def one(q):
+        return chatbot.ask(q)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        chatbot.embeddings._lru.clear()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for result in pool.map(one, questions):
+                sources[result["source"]] = sources.get(result["source"], 0) + 1
+                for key in context:
+                    context[key] += (result.get("context") or {}).get(key, 0)
+                for s in STAGES:
+                    if s in result["timings"]:
+                        stage_ms[s].append(result["timings"][s])
+    elapsed = time.perf_counter() - start
+    n = len(questions) * repeat
+    return {
+        "requests": n,
+        "concurrency": concurrency,
+        "elapsed_sec": round(elapsed, 3),
+        "throughput_rps": round(n / elapsed, 2),
+        "sources": sources,
+        "context_tokens_per_request": {k: round(v / n, 1) for k, v in context.items()},
+        "latency_ms": {s: latency_summary(v) for s, v in stage_ms.items() if v}
+    }
+
+
+def bench_retrieval(chatbot, items, k):
+    pipeline = chatbot.pipeline
+    modes = {
+        "vector": lambda q, v: pipeline.vector_store.similarity_search_by_vector(v, k=k),
+        "hybrid": lambda q, v: pipeline.retrieve(v, q),
+    }
+    if pipeline.lexical is not None:
+        modes["lexical"] = lambda q, v: pipeline.lexical.search(q, k=k)
+
+    scores = {m: {"recall": [], "rr": []} for m in modes}
+    latency = {m: [] for m in modes}
+    per_question = []
+    for item in items:
+        qvec = chatbot.embeddings.embed_query(item["question"])
+        row = {"question": item["question"]}
+        for mode, fn in modes.items():
+            t = time.perf_counter()
+            docs = fn(item["question"], qvec)
+            latency[mode].append((time.perf_counter() - t) * 1000)
+            files = [d.metadata.get("file_name") for d in docs]
+            recall, rr = rank_metrics(files, item["expected_files"])
+            scores[mode]["recall"].append(recall)
+            scores[mode]["rr"].append(rr)
+            row[mode] = round(rr, 3)
+        per_question.append(row)
+
+    return {
+        "k": k,
+        "questions": len(items),
+        "modes": {
+            m: {
+                f"recall@{k}": round(statistics.mean(s["recall"]), 4),
+                "mrr": round(statistics.mean(s["rr"]), 4),
+                "latency_ms": latency_summary(latency[m])
+            } for m, s in scores.items()
+        },
+        "per_question_rr": per_question
+    }
+
+
+def bench_faq(faq, items):
+    hits = correct = false_hits = 0
+    latency = []
+    for item in items:
+        t = time.perf_counter()
+        answer = faq.check(item["question"])
+        latency.append((time.perf_counter() - t) * 1000)
+        hit = answer is not None
+        hits += hit
+        correct += hit == item["expect_hit"]
+        false_hits += hit and not item["expect_hit"]
+    return {
+        "questions": len(items),
+        "accuracy": round(correct / len(items), 4) if items else None,
+        "false_hits": false_hits,
+        "hits": hits,
+        "latency_ms": latency_summary(latency)
+    }
+
+
+def compare(report, baseline, max_quality_drop, max_latency_increase):
+    """Liệt kê các chỉ số tụt so với lần chạy trước"""
+    regressions = []
+    for mode, cur in report["retrieval"]["modes"].items():
+        old = baseline.get("retrieval", {}).get("modes", {}).get(mode)
+        if not old:
+            continue
+        for metric in (f"recall@{report['retrieval']['k']}", "mrr"):
+            if metric in old and cur[metric] < old[metric] - max_quality_drop:
+                regressions.append(f"{mode} {metric}: {old[metric]} -> {cur[metric]}")
+
+    old_lat = baseline.get("pipeline", {}).get("latency_ms", {})
+    for stage, cur in report["pipeline"]["latency_ms"].items():
+        old = old_lat.get(stage)
+        if old and old["p95"] and cur["p95"] > old["p95"] * (1 + max_latency_increase):
+            regressions.append(f"p95 {stage}: {old['p95']}ms -> {cur['p95']}ms")
+
+    old_rps = baseline.get("pipeline", {}).get("throughput_rps")
+    cur_rps = report["pipeline"]["throughput_rps"]
+    if old_rps and cur_rps < old_rps * (1 - max_latency_increase):
+        regressions.append(f"throughput: {old_rps} -> {cur_rps} rps")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark truy xuất (recall@k, MRR) và độ trễ pipeline")
+    parser.add_argument("--questions", default=QUESTIONS_FILE)
+    parser.add_argument("--corpus", choices=["chroma", "new_docs"], default="chroma")
+    parser.add_argument("--source-db", default=os.path.join(ROOT, "knowledge_base_ptit"))
+    parser.add_argument("--docs-dir", default=os.path.join(ROOT, "new_docs"))
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3, help="Số vòng chạy get_answer trên cả bộ câu hỏi")
+    parser.add_argument("--embed-latency-ms", type=float, default=30)
+    parser.add_argument("--chat-latency-ms", type=float, default=200)
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    parser.add_argument("--baseline", help="File JSON của lần chạy trước để so sánh")
+    parser.add_argument("--max-quality-drop", type=float, default=0.02)
+    parser.add_argument("--max-latency-increase", type=float, default=0.25)
+    args = parser.parse_args()
+
+    server, args.base_url = start_stub_server(embed_latency_ms=args.embed_latency_ms,
+                                              chat_latency_ms=args.chat_latency_ms, token_latency_ms=0)
+    tmp = tempfile.mkdtemp(prefix="ptit_bench_")
+    setup_environment(args, tmp)
+
+    with open(args.questions, "r", encoding="utf-8") as f:
+        question_set = json.load(f)
+
+    from rag_chatbot import RAGChatbot
+
+    files, n_chunks = load_corpus(args)
+    items = [q for q in question_set["retrieval"] if set(q["expected_files"]) & files]
+    skipped = len(question_set["retrieval"]) - len(items)
+    chatbot = RAGChatbot()
+
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("base_url",)},
+        "question_set_version": question_set.get("version"),
+        "corpus": {"chunks": n_chunks, "files": sorted(files), "skipped_questions": skipped},
+        "pipeline": bench_pipeline(chatbot, [q["question"] for q in items], args.concurrency, args.repeat),
+        "retrieval": bench_retrieval(chatbot, items, args.k),
+        "faq": bench_faq(chatbot.faq, question_set.get("faq", [])),
+        "stub_calls": dict(server.RequestHandlerClass.counters),
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        report["regressions"] = compare(report, baseline, args.max_quality_drop, args.max_latency_increase)
+        exit_code = 1 if report["regressions"] else 0
+
+    summary = {k: v for k, v in report.items() if k != "retrieval"}
+    summary["retrieval"] = {k: v for k, v in report["retrieval"].items() if k != "per_question_rr"}
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    server.shutdown()
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+So sánh vector_index (int8 + chấm lại float32, và float32 thuần) với Chroma: độ trễ tìm kiếm,
+bộ nhớ tiến trình, dung lượng đĩa và recall@k so với tìm kiếm chính xác, trên dữ liệu tổng hợp
+(vector quanh các tâm cụm, giống phân bố embedding của tài liệu theo chủ đề).
+
+    python benchmarks/bench_vector_index.py --sizes 1000,100000,1000000 --chroma-max 100000
+
+Mỗi backend được đo trong một tiến trình riêng (spawn) để số liệu bộ nhớ không lẫn nhau.
+RssAnon: bộ nhớ cấp phát của tiến trình; RssFile: trang của file memory-map / thư viện đang nằm trong RAM
+(hệ điều hành thu hồi được khi thiếu bộ nhớ).
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing as mp
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_async import percentile
+
+BUILD_BATCH = 10000
+N_CLUSTERS = 256
+NOISE = 0.6  # độ lệch so với tâm cụm (tương đối), càng lớn các vector càng khó phân biệt
+
+
+def _centers(dim, seed=0):
+    rng = np.random.default_rng(seed)
+    c = rng.standard_normal((N_CLUSTERS, dim)).astype(np.float32)
+    return c / np.linalg.norm(c, axis=1, keepdims=True)
+
+
+def synthetic_batches(n, dim, seed=1):
+    """Sinh n vector theo từng batch (1M x 1536 float32 = 6 GB, không giữ hết trong RAM)"""
+    centers = _centers(dim)
+    rng = np.random.default_rng(seed)
+    for start in range(0, n, BUILD_BATCH):
+        size = min(BUILD_BATCH, n - start)
+        labels = rng.integers(0, N_CLUSTERS, size)
+        noise = rng.standard_normal((size, dim)).astype(np.float32) * (NOISE / np.sqrt(dim))
+        v = centers[labels] + noise
+        v /= np.linalg.norm(v, axis=1, keepdims=True)
+        ids = [f"c{i}" for i in range(start, start + size)]
+        metas = [{"file_name": f"file_{i % 50}.docx", "chunk_id": f"c{i}"} for i in range(start, start + size)]
+        yield ids, v, [f"đoạn {i}" for i in range(start, start + size)], metas
+
+
+def synthetic_queries(n_queries, dim, seed=2):
+    return next(synthetic_batches(n_queries, dim, seed))[1]
+
+
+def _status_kb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def _memory():
+    return {"rss_anon_mb": round(_status_kb("RssAnon") / 1024, 1),
+            "rss_file_mb": round(_status_kb("RssFile") / 1024, 1),
+            "peak_rss_mb": round(_status_kb("VmHWM") / 1024, 1)}
+
+
+def _dir_mb(path):
+    total = 0
+    for base, _, files in os.walk(path):
+        for name in files:
+            p = os.path.join(base, name)
+            if not os.path.islink(p):
+                total += os.path.getsize(p)
+    return round(total / 1024 / 1024, 1)
+
+
+# ------------------------------
+# Đo trong tiến trình con
+# ------------------------------
+def _measure_compact(path, queries, k, out):
+    from vector_index import CompactVectorIndex
+
+    base = _memory()
+    t = time.perf_counter()
+    index = CompactVectorIndex(path)
+    index.search(queries[0], k)
+    load_ms = (time.perf_counter() - t) * 1000
+    latencies, results = [], []
+    for q in queries:
+        t = time.perf_counter()
+        hits = index.search(q, k)
+        latencies.append(time.perf_counter() - t)
+        results.append([row for row, _ in hits])
+    out.put({"load_ms": load_ms, "latencies": latencies, "results": results, "base": base, "memory": _memory()})
+
+
+def _measure_chroma(path, queries, k, out):
+    import chromadb
+
+    base = _memory()
+    t = time.perf_counter()
+    collection = chromadb.PersistentClient(path=path).get_collection("bench")
+    collection.query(query_embeddings=[queries[0].tolist()], n_results=k)
+    load_ms = (time.perf_counter() - t) * 1000
+    latencies, results = [], []
+    for q in queries:
+        t = time.perf_counter()
+        got = collection.query(query_embeddings=[q.tolist()], n_results=k, include=[])
+        latencies.append(time.perf_counter() - t)
+        results.append([int(i[1:]) for i in got["ids"][0]])
+    out.put({"load_ms": load_ms, "latencies": latencies, "results": results, "base": base, "memory": _memory()})
+
+
+def measure(target, path, queries, k):
+    ctx = mp.get_context("spawn")
+    out = ctx.Queue()
+    proc = ctx.Process(target=target, args=(path, queries, k, out))
+    proc.start()
+    result = out.get()
+    proc.join()
+    return result
+
+
+# ------------------------------
+# Dựng dữ liệu
+# ------------------------------
+def build_compact(path, n, dim):
+    from vector_index import CompactVectorIndex
+
+    index = CompactVectorIndex(path, quantize="int8")
+    start = time.perf_counter()
+    for ids, vectors, texts, metas in synthetic_batches(n, dim):
+        index.add(ids, vectors, texts, metas)
+    return time.perf_counter() - start, index
+
+
+def float32_view(int8_path, path):
+    """Cùng dữ liệu nhưng quét thẳng float32 (không lượng tử hóa): manifest riêng, file dùng chung qua symlink"""
+    with open(os.path.join(int8_path, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest["quantize"] = "none"
+    gen = os.path.join(path, manifest["generation"])
+    os.makedirs(gen)
+    for name in ("vectors.f32", "files.i32", "chunks.sqlite3"):
+        os.symlink(os.path.join(int8_path, manifest["generation"], name), os.path.join(gen, name))
+    with open(os.path.join(path, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
+
+def build_chroma(path, n, dim):
+    import chromadb
+
+    client = chromadb.PersistentClient(path=path)
+    # Cùng cấu hình với collection "langchain" của ứng dụng (khoảng cách mặc định l2, vector đã chuẩn hóa)
+    collection = client.create_collection("bench")
+    start = time.perf_counter()
+    for ids, vectors, texts, metas in synthetic_batches(n, dim):
+        for i in range(0, len(ids), 5000):
+            collection.add(ids=ids[i:i + 5000], embeddings=vectors[i:i + 5000],
+                           documents=texts[i:i + 5000], metadatas=metas[i:i + 5000])
+    return time.perf_counter() - start
+
+
+def exact_topk(f32_path, n, dim, queries, k):
+    """Kết quả chính xác (float32, quét toàn bộ) làm chuẩn để tính recall"""
+    m = np.memmap(f32_path, dtype=np.float32, mode="r", shape=(n, dim))
+    best_s = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_i = np.zeros((len(queries), k), dtype=np.int64)
+    for start in range(0, n, 65536):
+        s = queries @ np.asarray(m[start:start + 65536]).T
+        all_s = np.concatenate([best_s, s], axis=1)
+        all_i = np.concatenate([best_i, np.arange(start, start + s.shape[1])[None, :].repeat(len(queries), 0)], axis=1)
+        top = np.argsort(-all_s, axis=1)[:, :k]
+        best_s = np.take_along_axis(all_s, top, axis=1)
+        best_i = np.take_along_axis(all_i, top, axis=1)
+    return best_i
+
+
+def summarize(name, measured, truth, build_sec, disk_mb):
+    k = truth.shape[1]
+    recall = np.mean([len(set(r) & set(t)) / k for r, t in zip(measured["results"], truth.tolist())])
+    lat = measured["latencies"]
+    return {
+        "backend": name,
+        "build_sec": round(build_sec, 1) if build_sec is not None else None,
+        "disk_mb": disk_mb,
+        "load_ms": round(measured["load_ms"], 1),
+        "p50_ms": round(percentile(lat, 50) * 1000, 3),
+        "p95_ms": round(percentile(lat, 95) * 1000, 3),
+        f"recall@{k}": round(float(recall), 4),
+        "memory": measured["memory"],
+        "memory_before_open": measured["base"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark vector_index vs Chroma")
+    parser.add_argument("--sizes", default="1000,100000,1000000")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--chroma-max", type=int, default=100000,
+                        help="Bỏ qua Chroma khi số đoạn lớn hơn (dựng HNSW rất lâu trên máy ít lõi)")
+    parser.add_argument("--tmp", default=None, help="Thư mục tạm (cần vài GB ở 1M đoạn)")
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    args = parser.parse_args()
+
+    queries = synthetic_queries(args.queries, args.dim)
+    report = {"config": vars(args), "results": []}
+    for n in [int(s) for s in args.sizes.split(",")]:
+        tmp = tempfile.mkdtemp(prefix=f"ptit_vi_{n}_", dir=args.tmp)
+        try:
+            int8_path = os.path.join(tmp, "int8")
+            build_sec, index = build_compact(int8_path, n, args.dim)
+            gen = index.stats()["generation"]
+            truth = exact_topk(os.path.join(int8_path, gen, "vectors.f32"), n, args.dim, queries, args.k)
+            rows = {"size": n, "backends": []}
+            rows["backends"].append(summarize("compact-int8", measure(_measure_compact, int8_path, queries, args.k),
+                                              truth, build_sec, _dir_mb(int8_path)))
+            f32_path = os.path.join(tmp, "float32")
+            float32_view(int8_path, f32_path)
+            vec_mb = round(os.path.getsize(os.path.join(int8_path, gen, "vectors.f32")) / 1024 / 1024, 1)
+            rows["backends"].append(summarize("compact-float32", measure(_measure_compact, f32_path, queries, args.k),
+                                              truth, None, vec_mb))
+            if n <= args.chroma_max:
+                chroma_path = os.path.join(tmp, "chroma")
+                build_sec = build_chroma(chroma_path, n, args.dim)
+                rows["backends"].append(summarize("chroma", measure(_measure_chroma, chroma_path, queries, args.k),
+                                                  truth, build_sec, _dir_mb(chroma_path)))
+            else:
+                rows["backends"].append({"backend": "chroma", "skipped": f"size > --chroma-max {args.chroma_max}"})
+            report["results"].append(rows)
+            print(json.dumps(rows, ensure_ascii=False), flush=True)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
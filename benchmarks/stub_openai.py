@@ -0,0 +1,193 @@
+"""
+Server giả lập API OpenAI (embeddings + chat completions) để benchmark offline.
+
+    python benchmarks/stub_openai.py --port 8089 --embed-latency-ms 30 --chat-latency-ms 400
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=stub python ...
+
+Vector embedding là tất định (băm từ khóa), câu trả lời chat là đoạn đầu của context.
+Giả lập sự cố: --fail-rate (tỉ lệ request trả 503), --tail-rate / --tail-latency-ms
+(tỉ lệ request chậm thêm), dùng để thử ngắt mạch / hedging của llm_clients
+(LLM_BASE_URL / EMBED_BASE_URL trỏ vào server này).
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DIM = 1536
+
+
+def _fold(text: str) -> str:
+    text = unicodedata.normalize("NFD", text.lower()).replace("đ", "d")
+    return "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+
+
+def stub_vector(item, dim: int = DIM):
+    """Bag-of-words băm vào dim chiều rồi chuẩn hóa L2 (text hoặc danh sách token id)"""
+    if isinstance(item, str):
+        features = re.findall(r"\w+", _fold(item))
+    else:
+        features = [str(t) for t in item]
+    vec = [0.0] * dim
+    for f in features or [""]:
+        h = int(hashlib.md5(f.encode("utf-8")).hexdigest(), 16)
+        vec[h % dim] += 1.0 if (h >> 64) & 1 else -1.0
+    norm = sum(v * v for v in vec) ** 0.5 or 1.0
+    return [v / norm for v in vec]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = {"embed_latency": 0.03, "chat_latency": 0.4, "token_latency": 0.01, "dim": DIM,
+              "embed_item_latency": 0.0, "fail_rate": 0.0, "tail_rate": 0.0, "tail_latency": 0.0}
+    counters = {"embeddings": 0, "embedding_inputs": 0, "chat": 0, "failed": 0, "slow": 0}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _inject_fault(self) -> bool:
+        """Trả 503 hoặc chậm thêm theo cấu hình; True nếu request đã bị trả lỗi"""
+        if random.random() < self.config["fail_rate"]:
+            with self.lock:
+                self.counters["failed"] += 1
+            body = json.dumps({"error": {"message": "stub: lỗi giả lập", "type": "server_error"}}).encode("utf-8")
+            self.send_response(503)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return True
+        if random.random() < self.config["tail_rate"]:
+            with self.lock:
+                self.counters["slow"] += 1
+            time.sleep(self.config["tail_latency"])
+        return False
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if self._inject_fault():
+            return
+        if self.path.endswith("/embeddings"):
+            self._embeddings(payload)
+        elif self.path.endswith("/chat/completions"):
+            self._chat(payload)
+        else:
+            self.send_error(404)
+
+    def _embeddings(self, payload):
+        inputs = payload.get("input")
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        with self.lock:
+            self.counters["embeddings"] += 1
+            self.counters["embedding_inputs"] += len(inputs)
+        time.sleep(self.config["embed_latency"] + self.config["embed_item_latency"] * len(inputs))
+
+        data = []
+        for i, item in enumerate(inputs):
+            vec = stub_vector(item, self.config["dim"])
+            if payload.get("encoding_format") == "base64":
+                vec = base64.b64encode(array("f", vec).tobytes()).decode("ascii")
+            data.append({"object": "embedding", "index": i, "embedding": vec})
+        self._json({"object": "list", "data": data, "model": payload.get("model"),
+                    "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+
+    def _chat(self, payload):
+        with self.lock:
+            self.counters["chat"] += 1
+        prompt = payload["messages"][-1]["content"]
+        if isinstance(prompt, list):
+            prompt = " ".join(p.get("text", "") for p in prompt)
+        # Câu trả lời giả lập: vài dòng đầu của phần context
+        context = prompt.split("----------------")[1] if prompt.count("----------------") >= 2 else prompt
+        answer = " ".join(context.split()[:60]) or "Không có dữ liệu."
+        time.sleep(self.config["chat_latency"])
+
+        base = {"id": "stub", "created": int(time.time()), "model": payload.get("model")}
+        if not payload.get("stream"):
+            self._json({**base, "object": "chat.completion", "choices": [{
+                "index": 0, "finish_reason": "stop",
+                "message": {"role": "assistant", "content": answer}
+            }], "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(answer) // 4,
+                          "total_tokens": (len(prompt) + len(answer)) // 4}})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write(event):
+            data = f"data: {event}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        for word in answer.split(" "):
+            time.sleep(self.config["token_latency"])
+            write(json.dumps({**base, "object": "chat.completion.chunk", "choices": [
+                {"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]}))
+        write(json.dumps({**base, "object": "chat.completion.chunk", "choices": [
+            {"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+        write("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class _StubServer(ThreadingHTTPServer):
+    request_queue_size = 256  # mặc định 5: nhiều kết nối mới cùng lúc bị từ chối
+
+
+def start_stub_server(port: int = 0, embed_latency_ms: float = 30, chat_latency_ms: float = 400,
+                      token_latency_ms: float = 10, dim: int = DIM, fail_rate: float = 0.0,
+                      tail_rate: float = 0.0, tail_latency_ms: float = 0.0):
+    """Chạy server trong thread nền, trả về (server, base_url)"""
+    StubHandler.config.update({
+        "embed_latency": embed_latency_ms / 1000,
+        "chat_latency": chat_latency_ms / 1000,
+        "token_latency": token_latency_ms / 1000,
+        "dim": dim,
+        "fail_rate": fail_rate,
+        "tail_rate": tail_rate,
+        "tail_latency": tail_latency_ms / 1000
+    })
+    server = _StubServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Server giả lập OpenAI cho benchmark")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--embed-latency-ms", type=float, default=30)
+    parser.add_argument("--chat-latency-ms", type=float, default=400)
+    parser.add_argument("--token-latency-ms", type=float, default=10)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--tail-rate", type=float, default=0.0)
+    parser.add_argument("--tail-latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    server, url = start_stub_server(args.port, args.embed_latency_ms, args.chat_latency_ms, args.token_latency_ms,
+                                    fail_rate=args.fail_rate, tail_rate=args.tail_rate,
+                                    tail_latency_ms=args.tail_latency_ms)
+    print(f"Stub OpenAI đang chạy tại {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
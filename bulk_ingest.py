@@ -0,0 +1,279 @@
+import os
+import time
+import queue
+import random
+import shutil
+import argparse
+import threading
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+import rag_system
+from rag_system import (
+    process_file, load_cached_chunks, get_vector_store, diff_chunks, log_update,
+    notify_knowledge_changed, update_lock, OLD_DOCS_DIR, EMBEDDING_MODEL, _compact_index, _file_lock
+)
+from parse_cache import PARSE_CACHE_ENABLED
+from embedding_cache import get_embeddings
+from lexical_index import get_lexical_index
+import metrics
+
+load_dotenv()
+
+PARSE_WORKERS = int(os.getenv("BULK_PARSE_WORKERS", str(os.cpu_count() or 2)))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))     # số đoạn mỗi lời gọi embed
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))     # số lời gọi embed song song
+CHROMA_WRITE_BATCH = int(os.getenv("CHROMA_WRITE_BATCH", "2000"))  # số đoạn mỗi lần ghi Chroma
+EMBED_MAX_RETRIES = 5
+
+
+def list_documents(directory):
+    return sorted(
+        os.path.join(directory, f) for f in os.listdir(directory)
+        if not f.startswith((".", "~$")) and os.path.isfile(os.path.join(directory, f))
+    )
+
+
+def embed_with_retry(embeddings, texts, max_retries=EMBED_MAX_RETRIES):
+    """Gọi embed_documents, lỗi thì thử lại với backoff lũy thừa + jitter"""
+    for attempt in range(max_retries + 1):
+        try:
+            return embeddings.embed_documents(texts)
+        except Exception:
+            if attempt == max_retries:
+                raise
+            time.sleep(min(30, 0.5 * 2 ** attempt) * (0.5 + random.random()))
+
+
+class _ChromaWriter(threading.Thread):
+    """
+    Gom các batch đã embed rồi upsert vào Chroma (và vector_index nếu có) theo lô lớn.
+    Lệnh xóa đoạn cũ của một file chỉ được đưa vào hàng đợi sau mọi batch của file đó,
+    nên chỉ chạy khi đoạn mới đã ghi xong; có lỗi ghi thì bỏ qua mọi lệnh phía sau.
+    """
+
+    def __init__(self, store, write_batch, index=None):
+        super().__init__(daemon=True)
+        self.store = store
+        self.index = index
+        self.write_batch = write_batch
+        self.queue = queue.Queue()
+        self.written = 0
+        self.added_docs, self.removed_ids = [], []  # đã ghi thật: để cập nhật chỉ mục BM25
+        self.error = None
+
+    def _flush(self, docs, vectors):
+        if not docs or self.error:
+            return
+        ids = [d.metadata["chunk_id"] for d in docs]
+        texts = [d.page_content for d in docs]
+        metas = [d.metadata for d in docs]
+        try:
+            with update_lock:
+                self.store._collection.upsert(ids=ids, embeddings=vectors, documents=texts, metadatas=metas)
+                if self.index is not None:
+                    self.index.add(ids, vectors, texts, metas)
+            self.written += len(ids)
+            self.added_docs.extend(docs)
+        except Exception as e:
+            self.error = e
+
+    def _remove(self, ids):
+        if self.error:
+            return
+        try:
+            with update_lock:
+                self.store.delete(ids=ids)
+                if self.index is not None:
+                    self.index.delete(ids=ids)
+            self.removed_ids.extend(ids)
+        except Exception as e:
+            self.error = e
+
+    def run(self):
+        docs, vectors = [], []
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self._flush(docs, vectors)
+                return
+            if item[0] == "delete":
+                # Ghi nốt các đoạn mới đang gom trước khi xóa đoạn cũ
+                self._flush(docs, vectors)
+                docs, vectors = [], []
+                self._remove(item[1])
+                continue
+            docs.extend(item[1])
+            vectors.extend(item[2])
+            if len(docs) >= self.write_batch:
+                self._flush(docs, vectors)
+                docs, vectors = [], []
+
+
+def bulk_ingest(paths, parse_workers=PARSE_WORKERS, batch_size=EMBED_BATCH_SIZE,
+                embed_concurrency=EMBED_CONCURRENCY, write_batch=CHROMA_WRITE_BATCH,
+                copy_to_old_docs=True, progress=None, use_cache=PARSE_CACHE_ENABLED):
+    """
+    Nạp nhiều file: parse song song bằng process pool -> embed theo batch với số luồng giới hạn
+    (có retry/backoff) -> ghi Chroma theo lô lớn. Chỉ embed các đoạn mới/thay đổi.
+    Giống add_or_update_file: giữ lock của từng file, đoạn cũ chỉ bị xóa sau khi đoạn mới đã ghi
+    (file embed lỗi giữ nguyên đoạn cũ), đã ghi gì thì luôn gọi notify_knowledge_changed.
+    File đã có trong parse_cache (use_cache) không được gửi sang process pool.
+    progress: hàm tùy chọn nhận (stage, fraction).
+    """
+    report = progress or (lambda stage, fraction: None)
+    start = time.time()
+    store = get_vector_store()
+    embeddings = get_embeddings(EMBEDDING_MODEL)
+    max_batch = store._client.get_max_batch_size() if hasattr(store._client, "get_max_batch_size") else write_batch
+
+    stats = {"files": len(paths), "parsed": 0, "failed": [], "chunks": 0,
+             "added": 0, "removed": 0, "kept": 0, "parse_cache_hits": 0}
+    ingested = []
+    pending = {}  # file -> [số batch chưa vào hàng đợi ghi, id đoạn cũ cần xóa sau đó]
+    in_flight = threading.BoundedSemaphore(embed_concurrency * 2)  # giới hạn số batch chờ embed
+    parse_time = [0.0]
+    embed_time = [0.0]
+    embed_lock = threading.Lock()
+
+    def batch_queued(file_name):
+        """Batch cuối của file đã vào hàng đợi ghi -> xếp lệnh xóa đoạn cũ ngay sau nó"""
+        with embed_lock:
+            pending[file_name][0] -= 1
+            if pending[file_name][0] == 0 and pending[file_name][1]:
+                writer.queue.put(("delete", pending[file_name][1]))
+
+    def embed_batch(file_name, docs):
+        try:
+            t = time.time()
+            vectors = embed_with_retry(embeddings, [d.page_content for d in docs])
+            with embed_lock:
+                embed_time[0] += time.time() - t
+            writer.queue.put(("upsert", docs, vectors))
+            batch_queued(file_name)
+        finally:
+            in_flight.release()
+
+    # Khóa theo thứ tự tên file: không chen với job upload / xóa cùng file, không deadlock giữa hai job bulk
+    with ExitStack() as locks:
+        for file_name in sorted({os.path.basename(p) for p in paths}):
+            locks.enter_context(_file_lock(file_name))
+        writer = _ChromaWriter(store, min(write_batch, max_batch), _compact_index())
+        writer.start()
+        try:
+            report("parsing", 0.0)
+            with ProcessPoolExecutor(max_workers=parse_workers) as parse_pool, \
+                    ThreadPoolExecutor(max_workers=embed_concurrency) as embed_pool:
+                t_parse = time.time()
+                cached = {}
+                if use_cache:
+                    for p in paths:
+                        chunks = load_cached_chunks(p)
+                        if chunks:
+                            cached[p] = chunks
+                stats["parse_cache_hits"] = len(cached)
+                futures = {parse_pool.submit(process_file, p, use_cache): p for p in paths if p not in cached}
+
+                def parsed():
+                    yield from cached.items()
+                    for fut in as_completed(futures):
+                        try:
+                            yield futures[fut], fut.result()
+                        except Exception as e:
+                            print(f"Lỗi khi xử lý {futures[fut]}: {e}")
+                            yield futures[fut], []
+
+                embed_futures = []
+                for done, (path, chunks) in enumerate(parsed(), 1):
+                    file_name = os.path.basename(path)
+                    if not chunks:
+                        stats["failed"].append(file_name)
+                        log_update(file_name, "error", 0, 0)
+                        continue
+
+                    to_add, to_remove, kept = diff_chunks(store, file_name, chunks)
+                    batches = [to_add[i:i + batch_size] for i in range(0, len(to_add), batch_size)]
+                    with embed_lock:
+                        pending[file_name] = [len(batches), to_remove]
+                        if not batches and to_remove:
+                            writer.queue.put(("delete", to_remove))
+                    for batch in batches:
+                        in_flight.acquire()
+                        embed_futures.append(embed_pool.submit(embed_batch, file_name, batch))
+
+                    stats["parsed"] += 1
+                    stats["chunks"] += len(chunks)
+                    stats["added"] += len(to_add)
+                    stats["removed"] += len(to_remove)
+                    stats["kept"] += kept
+                    ingested.append((path, file_name, len(chunks), len(to_add), len(to_remove), kept))
+                    report("embedding", done / len(paths))
+                parse_time[0] = time.time() - t_parse
+
+                for f in embed_futures:
+                    f.result()  # ném lỗi embed (sau khi đã retry) ra ngoài
+        finally:
+            # Luôn ghi nốt phần đã embed, dừng writer; BM25 và cache theo đúng những gì đã ghi
+            writer.queue.put(None)
+            writer.join()
+            lexical = get_lexical_index()
+            lexical.remove_ids(writer.removed_ids)
+            lexical.add_documents(writer.added_docs)
+            if writer.written or writer.removed_ids:
+                notify_knowledge_changed(f"bulk ingest {len(ingested)} file")
+        if writer.error:
+            raise writer.error
+
+        report("writing", 1.0)
+        duration = time.time() - start
+        os.makedirs(OLD_DOCS_DIR, exist_ok=True)
+        for path, file_name, n_chunks, added, removed, kept in ingested:
+            old_path = os.path.join(OLD_DOCS_DIR, file_name)
+            if copy_to_old_docs and os.path.abspath(path) != os.path.abspath(old_path):
+                shutil.copy(path, old_path)
+            log_update(file_name, "success", n_chunks, duration / max(1, len(ingested)),
+                       added=added, removed=removed, kept=kept)
+
+    metrics.INGEST_FILES.inc(stats["parsed"], status="success")
+    metrics.INGEST_FILES.inc(len(stats["failed"]), status="error")
+    for action in ("added", "removed", "kept"):
+        metrics.INGEST_CHUNKS.inc(stats[action], action=action)
+    metrics.INGEST_STAGE_SECONDS.observe(parse_time[0], stage="bulk_parsing")
+    metrics.INGEST_STAGE_SECONDS.observe(duration, stage="bulk_total")
+
+    stats.update({
+        "duration_sec": round(duration, 2),
+        "parse_sec": round(parse_time[0], 2),
+        "embed_sec": round(embed_time[0], 2),
+        "written": writer.written,
+        "chunks_per_sec": round(stats["chunks"] / duration, 1) if duration else 0.0,
+        "embedded_per_sec": round(stats["added"] / duration, 1) if duration else 0.0
+    })
+    report("done", 1.0)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Nạp hàng loạt tài liệu vào cơ sở tri thức PTIT")
+    parser.add_argument("source", nargs="?", default=OLD_DOCS_DIR, help="Thư mục tài liệu (mặc định: old_docs)")
+    parser.add_argument("--workers", type=int, default=PARSE_WORKERS, help="Số tiến trình parse")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=EMBED_CONCURRENCY)
+    parser.add_argument("--write-batch", type=int, default=CHROMA_WRITE_BATCH)
+    parser.add_argument("--reset", action="store_true", help="Xóa toàn bộ Chroma trước khi nạp")
+    parser.add_argument("--no-cache", action="store_true", help="Parse lại mọi file, không dùng parse_cache")
+    args = parser.parse_args()
+
+    if args.reset:
+        rag_system.reset_knowledge()
+    result = bulk_ingest(list_documents(args.source), parse_workers=args.workers,
+                         batch_size=args.batch_size, embed_concurrency=args.concurrency,
+                         write_batch=args.write_batch, use_cache=not args.no_cache)
+    print(f"[✅] {result['parsed']}/{result['files']} file, {result['chunks']} đoạn "
+          f"(+{result['added']} / -{result['removed']} / ={result['kept']}) "
+          f"trong {result['duration_sec']}s -> {result['chunks_per_sec']} đoạn/s "
+          f"({result['parse_cache_hits']} file lấy từ parse cache)")
+    if result["failed"]:
+        print(f"[⚠️] Lỗi: {', '.join(result['failed'])}")
@@ -0,0 +1,63 @@
+import os
+import asyncio
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))  # số lời gọi LLM chạy đồng thời
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))              # số request được phép xếp hàng chờ
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+class QueueFullError(Exception):
+    """Hàng đợi LLM đã đầy -> server nên trả 503 thay vì nhận thêm"""
+
+
+class AsyncLimiter:
+    """Giới hạn số lời gọi LLM đồng thời, kèm hàng đợi có giới hạn"""
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, max_queue: int = LLM_MAX_QUEUE):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._sem = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.in_flight = 0
+        self.rejected = 0
+
+    async def __aenter__(self):
+        if self._sem.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError("Hệ thống đang quá tải, vui lòng thử lại sau.")
+        self.waiting += 1
+        try:
+            await self._sem.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self.in_flight -= 1
+        self._sem.release()
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "rejected": self.rejected
+        }
+
+
+def get_llm_limiter() -> AsyncLimiter:
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = AsyncLimiter()
+        return _shared
@@ -0,0 +1,208 @@
+import os
+import re
+import threading
+from typing import List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))   # số token tối đa của phần context
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))      # 1 = chỉ xét độ liên quan
+CONTEXT_DUP_THRESHOLD = float(os.getenv("CONTEXT_DUP_THRESHOLD", "0.95"))  # cosine coi như trùng lặp
+CONTEXT_MIN_PIECE_TOKENS = 80   # phần còn lại của ngân sách nhỏ hơn mức này thì không cắt thêm đoạn
+MIN_OVERLAP_CHARS = 40          # phần chồng lấn tối thiểu để ghép 2 đoạn
+ADJACENT_GAP_CHARS = 10         # khoảng cách (ký tự phân tách bị splitter bỏ) vẫn coi là liền kề
+SEPARATOR = "\n\n"
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def count_tokens(text: str) -> int:
+    """Đếm token theo tokenizer của gpt-4.1 (o200k_base); không tải được tiktoken thì ước lượng"""
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding("o200k_base")
+            except Exception:
+                _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    # Tiếng Việt có dấu: trung bình ~3 ký tự / token
+    return max(1, len(text) // 3) if text else 0
+
+
+def _overlap_merge(a: str, b: str) -> Optional[str]:
+    """Nếu cuối a trùng đầu b (chunk_overlap của splitter) thì trả về đoạn đã ghép, ngược lại None"""
+    if b in a:
+        return a
+    head = b[:MIN_OVERLAP_CHARS]
+    if len(head) < MIN_OVERLAP_CHARS:
+        return None
+    idx = a.find(head)
+    while idx != -1:
+        tail = a[idx:]
+        if b.startswith(tail):
+            return a + b[len(tail):]
+        idx = a.find(head, idx + 1)
+    return None
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """Cắt text về khoảng max_tokens, ưu tiên dừng ở cuối dòng / câu"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    ratio = max_tokens / count_tokens(text)
+    cut = text[:int(len(text) * ratio)]
+    while cut and count_tokens(cut) > max_tokens:
+        cut = cut[:int(len(cut) * 0.9)]
+    boundary = max(cut.rfind("\n"), *(m.end() for m in re.finditer(r"[.!?;:]\s", cut)), 0)
+    return cut[:boundary].rstrip() if boundary > len(cut) // 2 else cut.rstrip()
+
+
+class _Piece:
+    __slots__ = ("file_name", "text", "start", "rank")
+
+    def __init__(self, file_name, text, start, rank):
+        self.file_name = file_name
+        self.text = text
+        self.start = start
+        self.rank = rank
+
+
+class ContextBuilder:
+    """
+    Dựng phần context cho prompt từ các đoạn đã truy xuất (theo thứ tự liên quan):
+    1. bỏ đoạn gần trùng lặp bằng MMR trên vector của đoạn (lấy lại từ Chroma, không gọi API),
+    2. ghép các đoạn liền kề / chồng lấn (chunk_overlap) của cùng file_name,
+    3. cắt cho vừa ngân sách token.
+    Trả về context kèm thống kê token tiết kiệm so với cách nối thẳng các đoạn ("stuff").
+    """
+
+    def __init__(self, vector_store=None, token_budget: int = CONTEXT_TOKEN_BUDGET,
+                 mmr_lambda: float = CONTEXT_MMR_LAMBDA, dup_threshold: float = CONTEXT_DUP_THRESHOLD):
+        self.vector_store = vector_store
+        self.token_budget = token_budget
+        self.mmr_lambda = mmr_lambda
+        self.dup_threshold = dup_threshold
+
+    # ------------------------------
+    # 1. MMR / loại đoạn trùng lặp
+    # ------------------------------
+    def _chunk_vectors(self, docs):
+        ids = [d.metadata.get("chunk_id") or getattr(d, "id", None) for d in docs]
+        if self.vector_store is None or not all(ids):
+            return None
+        if hasattr(self.vector_store, "get_vectors"):
+            by_id = self.vector_store.get_vectors(ids)  # vector_index
+        else:
+            got = self.vector_store._collection.get(ids=ids, include=["embeddings"])
+            by_id = dict(zip(got["ids"], got["embeddings"]))
+        if any(by_id.get(i) is None for i in ids):
+            return None
+        m = np.asarray([by_id[i] for i in ids], dtype=np.float32)
+        norms = np.linalg.norm(m, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return m / norms
+
+    def select(self, docs, query_vector=None):
+        """Thứ tự MMR, bỏ đoạn trùng văn bản hoặc có cosine >= dup_threshold với đoạn đã chọn"""
+        seen, unique = set(), []
+        for d in docs:
+            key = d.page_content.strip()
+            if key and key not in seen:
+                seen.add(key)
+                unique.append(d)
+        if query_vector is None or len(unique) < 2:
+            return unique
+
+        vectors = self._chunk_vectors(unique)
+        if vectors is None:
+            return unique
+        q = np.asarray(query_vector, dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1.0)
+        relevance = vectors @ q
+
+        chosen, remaining = [], list(range(len(unique)))
+        while remaining:
+            if chosen:
+                redundancy = (vectors[remaining] @ vectors[chosen].T).max(axis=1)
+            else:
+                redundancy = np.zeros(len(remaining), dtype=np.float32)
+            scores = self.mmr_lambda * relevance[remaining] - (1 - self.mmr_lambda) * redundancy
+            best = int(np.argmax(scores))
+            idx = remaining.pop(best)
+            if chosen and redundancy[best] >= self.dup_threshold:
+                continue
+            chosen.append(idx)
+        return [unique[i] for i in chosen]
+
+    # ------------------------------
+    # 2. Ghép đoạn cùng file
+    # ------------------------------
+    @staticmethod
+    def merge(docs) -> List[_Piece]:
+        pieces = [_Piece(d.metadata.get("file_name"), d.page_content.strip(),
+                         d.metadata.get("start_index"), rank) for rank, d in enumerate(docs)]
+        merged = True
+        while merged:
+            merged = False
+            for i, a in enumerate(pieces):
+                for j, b in enumerate(pieces):
+                    if i == j or a.file_name is None or a.file_name != b.file_name:
+                        continue
+                    if a.start is not None and b.start is not None and a.start > b.start:
+                        continue  # ghép theo đúng thứ tự trong file
+                    text = _overlap_merge(a.text, b.text)
+                    if text is None and a.start is not None and b.start is not None \
+                            and a.start + len(a.text) + ADJACENT_GAP_CHARS >= b.start:
+                        text = a.text + "\n" + b.text  # liền kề nhưng không chồng lấn
+                    if text is None:
+                        continue
+                    a.text, a.rank = text, min(a.rank, b.rank)
+                    pieces.pop(j)
+                    merged = True
+                    break
+                if merged:
+                    break
+        return sorted(pieces, key=lambda p: p.rank)
+
+    # ------------------------------
+    # 3. Ngân sách token
+    # ------------------------------
+    def fit(self, pieces: List[_Piece]) -> List[str]:
+        parts, used = [], 0
+        sep_tokens = count_tokens(SEPARATOR)
+        for p in pieces:
+            remaining = self.token_budget - used - (sep_tokens if parts else 0)
+            n = count_tokens(p.text)
+            if n <= remaining:
+                parts.append(p.text)
+                used += n + (sep_tokens if len(parts) > 1 else 0)
+            elif remaining >= CONTEXT_MIN_PIECE_TOKENS or not parts:
+                parts.append(_truncate(p.text, max(remaining, CONTEXT_MIN_PIECE_TOKENS)))
+                break
+            else:
+                break
+        return parts
+
+    def build(self, docs, query_vector=None):
+        """Trả về (context, stats) với stats gồm số đoạn vào/ra, số token gửi đi và số token tiết kiệm"""
+        baseline = count_tokens(SEPARATOR.join(d.page_content for d in docs))
+        selected = self.select(docs, query_vector)
+        pieces = self.merge(selected)
+        parts = self.fit(pieces)
+        context = SEPARATOR.join(parts)
+        tokens = count_tokens(context)
+        return context, {
+            "chunks_in": len(docs),
+            "chunks_selected": len(selected),
+            "pieces": len(parts),
+            "baseline_tokens": baseline,
+            "context_tokens": tokens,
+            "tokens_saved": max(0, baseline - tokens)
+        }
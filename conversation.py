@@ -0,0 +1,182 @@
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+
+from concurrency import QueueFullError
+
+load_dotenv()
+
+QUERY_REWRITE_ENABLED = os.getenv("QUERY_REWRITE", "1") == "1"
+HISTORY_WINDOW_TURNS = int(os.getenv("HISTORY_WINDOW_TURNS", "3"))          # số lượt hỏi-đáp gần nhất được xem
+HISTORY_SUMMARY_MAX_CHARS = int(os.getenv("HISTORY_SUMMARY_MAX_CHARS", "600"))
+HISTORY_MESSAGE_MAX_CHARS = 300   # mỗi tin nhắn cũ chỉ lấy chừng này ký tự khi viết lại / tóm tắt
+
+# Dấu hiệu câu hỏi phụ thuộc ngữ cảnh: đại từ chỉ định, "còn ...", "thì sao", ...
+_FOLLOWUP_PATTERN = re.compile(
+    r"\b(đó|đấy|ấy|kia|nó|họ|trên|như vậy|thì sao|thế nào nữa|nữa không|cái này|ngành này|môn này)\b"
+    r"|^\s*(còn|vậy|thế|và|nhưng|thế còn|vậy còn)\b",
+    re.IGNORECASE
+)
+_MIN_SELF_CONTAINED_WORDS = 4
+
+REWRITE_PROMPT = """Bạn viết lại câu hỏi cho hệ thống tìm kiếm tài liệu của Học viện Công nghệ Bưu chính Viễn thông (PTIT).
+Dựa vào tóm tắt và các lượt hội thoại gần nhất, viết lại CÂU HỎI MỚI thành một câu hỏi tiếng Việt độc lập,
+đủ ngữ cảnh (thay đại từ như "đó", "này", "ngành đó" bằng đối tượng cụ thể). Chỉ trả về câu hỏi đã viết lại.
+
+Tóm tắt: {summary}
+Hội thoại gần nhất:
+{turns}
+Câu hỏi mới: {question}
+Câu hỏi độc lập:"""
+
+SUMMARY_PROMPT = """Tóm tắt ngắn gọn (tối đa 3 câu, tiếng Việt) cuộc hội thoại giữa sinh viên và trợ lý PTIT:
+giữ lại các chủ đề, ngành, khóa, đối tượng mà người dùng đang quan tâm; bỏ chi tiết câu trả lời.
+
+Tóm tắt cũ: {summary}
+Các lượt mới:
+{turns}
+Tóm tắt mới:"""
+
+
+def _clip(text: str, limit: int = HISTORY_MESSAGE_MAX_CHARS) -> str:
+    text = " ".join((text or "").split())
+    return text if len(text) <= limit else text[:limit].rsplit(" ", 1)[0] + "…"
+
+
+def format_turns(messages) -> str:
+    label = {"user": "Người dùng", "bot": "Trợ lý"}
+    return "\n".join(f"{label.get(m['role'], m['role'])}: {_clip(m['text'])}" for m in messages) or "(không có)"
+
+
+def is_self_contained(question: str) -> bool:
+    """Câu hỏi đủ ý khi đứng một mình: đủ dài và không có dấu hiệu phụ thuộc ngữ cảnh"""
+    return len(question.split()) >= _MIN_SELF_CONTAINED_WORDS and not _FOLLOWUP_PATTERN.search(question)
+
+
+def needs_rewrite(question: str, history: Optional[dict]) -> bool:
+    """Chỉ viết lại khi có lịch sử và câu hỏi có dấu hiệu phụ thuộc ngữ cảnh (câu ngắn như "xin chào",
+    "Học phí CNTT?" vẫn đủ ý, không tốn một lượt gọi LLM)"""
+    if not QUERY_REWRITE_ENABLED or not history or not history.get("messages"):
+        return False
+    return bool(_FOLLOWUP_PATTERN.search(question))
+
+
+def _text(message) -> str:
+    return getattr(message, "content", str(message)).strip()
+
+
+class QueryRewriter:
+    """
+    Viết lại câu hỏi nối tiếp ("còn học phí ngành đó?") thành câu hỏi độc lập
+    từ tóm tắt + HISTORY_WINDOW_TURNS lượt gần nhất.
+    rewrite() trả về (query, search): query là khóa tra FAQ / cache, search là câu dùng để tìm tài liệu.
+    Lỗi LLM -> query giữ câu hỏi gốc, search ghép câu hỏi trước với câu hỏi hiện tại.
+    """
+
+    def __init__(self, llm):
+        self.llm = llm
+
+    def _prompt(self, question: str, history: dict) -> str:
+        return REWRITE_PROMPT.format(summary=history.get("summary") or "(không có)",
+                                     turns=format_turns(history["messages"]), question=question)
+
+    @staticmethod
+    def _fallback(question: str, history: dict) -> str:
+        last_user = next((m["text"] for m in reversed(history["messages"]) if m["role"] == "user"), "")
+        return f"{_clip(last_user, 150)} {question}".strip()
+
+    @staticmethod
+    def _accept(rewritten: str, question: str) -> str:
+        rewritten = rewritten.strip().strip('"').splitlines()[0].strip() if rewritten.strip() else ""
+        # Câu viết lại rỗng hoặc dài bất thường thì không tin
+        return rewritten if 0 < len(rewritten) <= max(300, 3 * len(question)) else ""
+
+    def _result(self, rewritten: str, question: str, history: dict) -> Tuple[str, str]:
+        rewritten = self._accept(rewritten, question)
+        if rewritten:
+            return rewritten, rewritten
+        return question, self._fallback(question, history)
+
+    def rewrite(self, question: str, history: Optional[dict]) -> Tuple[str, str]:
+        if not needs_rewrite(question, history):
+            return question, question
+        try:
+            return self._result(_text(self.llm.invoke(self._prompt(question, history))), question, history)
+        except Exception as e:
+            print(f"[⚠️] Không viết lại được câu hỏi: {e}")
+            return question, self._fallback(question, history)
+
+    async def arewrite(self, question: str, history: Optional[dict], limiter=None) -> Tuple[str, str]:
+        if not needs_rewrite(question, history):
+            return question, question
+        prompt = self._prompt(question, history)
+        try:
+            if limiter is None:
+                message = await self.llm.ainvoke(prompt)
+            else:
+                async with limiter:
+                    message = await self.llm.ainvoke(prompt)
+            return self._result(_text(message), question, history)
+        except QueueFullError:
+            raise
+        except Exception as e:
+            print(f"[⚠️] Không viết lại được câu hỏi: {e}")
+            return question, self._fallback(question, history)
+
+
+class ConversationMemory:
+    """
+    Bộ nhớ hội thoại có giới hạn cho mỗi session: tóm tắt ngắn (<= HISTORY_SUMMARY_MAX_CHARS)
+    + tối đa HISTORY_WINDOW_TURNS lượt gần nhất. Tin nhắn trượt ra khỏi cửa sổ được gộp dần
+    vào tóm tắt ở thread nền, nên kích thước prompt không tăng theo độ dài hội thoại.
+    """
+
+    def __init__(self, store, llm, window_turns: int = HISTORY_WINDOW_TURNS):
+        self.store = store
+        self.llm = llm
+        self.window = max(1, window_turns) * 2   # số tin nhắn (user + bot)
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summary")
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def load(self, sid: str) -> dict:
+        """{"summary", "messages"}: đọc trước khi lưu câu hỏi hiện tại"""
+        summary, _ = self.store.get_summary(sid)
+        return {"summary": summary, "messages": self.store.recent_messages(sid, self.window)}
+
+    def after_turn(self, sid: str):
+        """Gọi sau khi lưu câu trả lời: đủ một cửa sổ tin nhắn cũ chưa tóm tắt thì tóm tắt ở nền"""
+        with self._lock:
+            if sid in self._pending:
+                return
+            self._pending.add(sid)
+        self._pool.submit(self._maybe_summarize, sid)
+
+    def _maybe_summarize(self, sid: str):
+        if self.llm is None:  # chatbot chưa dựng xong
+            with self._lock:
+                self._pending.discard(sid)
+            return
+        try:
+            summary, upto_id = self.store.get_summary(sid)
+            messages = self.store.messages_after(sid, upto_id)
+            old = messages[:-self.window]
+            if len(old) < self.window:
+                return
+            prompt = SUMMARY_PROMPT.format(summary=summary or "(không có)", turns=format_turns(old))
+            try:
+                new_summary = _text(self.llm.invoke(prompt))
+            except Exception as e:
+                print(f"[⚠️] Không tóm tắt được hội thoại {sid}: {e}")
+                # Dự phòng: giữ các câu hỏi gần nhất của người dùng
+                new_summary = " | ".join(_clip(m["text"], 80) for m in old if m["role"] == "user")
+            self.store.set_summary(sid, _clip(new_summary, HISTORY_SUMMARY_MAX_CHARS), old[-1]["id"])
+        except Exception as e:
+            print(f"[⚠️] Lỗi khi cập nhật tóm tắt hội thoại {sid}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(sid)
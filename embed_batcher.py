@@ -0,0 +1,124 @@
+import os
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List
+
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+
+load_dotenv()
+
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))  # chờ gom câu hỏi (0 = tắt gom batch)
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "64"))               # đủ số câu này thì gửi ngay
+EMBED_BATCH_CONCURRENCY = 8                                              # số batch được gửi song song
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Gom các lời gọi embed_query đồng thời thành một lời gọi embed_documents:
+    câu hỏi tới trong cùng cửa sổ window_ms (hoặc đủ max_batch câu) đi chung một request HTTP,
+    mỗi người gọi nhận lại vector của mình. Các câu giống hệt nhau đang chờ hoặc đang được gửi
+    dùng chung một kết quả. embed_documents (nạp tài liệu) đi thẳng xuống base.
+    """
+
+    def __init__(self, base: Embeddings, window_ms: float = EMBED_BATCH_WINDOW_MS,
+                 max_batch: int = EMBED_BATCH_MAX):
+        self.base = base
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        # Batch câu hỏi nằm trên đường trả lời: dùng embed_queries (có hedge) nếu base hỗ trợ
+        self._embed_batch = getattr(base, "embed_queries", base.embed_documents)
+        self._pending = {}    # text -> Future, chưa gửi
+        self._inflight = {}   # text -> Future, đang gửi
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=EMBED_BATCH_CONCURRENCY, thread_name_prefix="embed-batch")
+        self._thread = None
+        self.queries = 0
+        self.deduped = 0
+        self.batches = 0
+        self.batched_texts = 0
+
+    # ------------------------------
+    # Gom batch
+    # ------------------------------
+    def _submit(self, text: str) -> Future:
+        with self._cond:
+            self.queries += 1
+            future = self._pending.get(text) or self._inflight.get(text)
+            if future is not None:
+                self.deduped += 1
+                return future
+            future = Future()
+            self._pending[text] = future
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._collect_loop, name="embed-batcher", daemon=True)
+                self._thread.start()
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+                self._cond.notify()
+            return future
+
+    def _collect_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # Câu đầu tiên tới: chờ thêm tối đa window giây hoặc tới khi đủ max_batch
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                texts = list(self._pending)[:self.max_batch]
+                batch = {t: self._pending.pop(t) for t in texts}
+                self._inflight.update(batch)
+            self._pool.submit(self._send, batch)
+
+    def _send(self, batch: dict):
+        texts = list(batch)
+        try:
+            vectors = self._embed_batch(texts)
+        except Exception as e:
+            vectors, error = None, e
+        with self._cond:
+            for text in texts:
+                self._inflight.pop(text, None)
+            self.batches += 1
+            self.batched_texts += len(texts)
+        for i, text in enumerate(texts):
+            if vectors is None:
+                batch[text].set_exception(error)
+            else:
+                batch[text].set_result(vectors[i])
+
+    # ------------------------------
+    # Giao diện Embeddings
+    # ------------------------------
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.base.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.window <= 0:
+            return self.base.embed_query(text)
+        return self._submit(text).result()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.base.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if self.window <= 0:
+            return await self.base.aembed_query(text)
+        return await asyncio.wrap_future(self._submit(text))
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "window_ms": round(self.window * 1000, 2),
+                "max_batch": self.max_batch,
+                "queries": self.queries,
+                "deduped": self.deduped,
+                "batches": self.batches,
+                "avg_batch_size": round(self.batched_texts / self.batches, 2) if self.batches else 0.0
+            }
@@ -0,0 +1,188 @@
+import os
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+
+load_dotenv()
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "5000"))            # số vector giữ trong RAM
+EMBED_CACHE_DB = os.getenv("EMBED_CACHE_DB", "./embedding_cache.sqlite3")  # "" = tắt tầng đĩa
+# Tắt (0) khi dùng endpoint tương thích OpenAI chạy cục bộ: gửi text thô, không cần tiktoken
+EMBED_CHECK_CTX_LENGTH = os.getenv("EMBED_CHECK_CTX_LENGTH", "1") == "1"
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def normalize_text(text: str) -> str:
+    """Chuẩn hóa Unicode (NFC) và khoảng trắng để cùng một câu cho cùng một key"""
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Bọc một đối tượng Embeddings (vd: OpenAIEmbeddings):
+    - Tầng 1: LRU trong RAM, giới hạn max_items vector.
+    - Tầng 2 (tùy chọn): SQLite trên đĩa, giữ lại sau khi khởi động lại.
+    Chỉ những text chưa có trong cache mới được gửi tới API.
+    """
+
+    def __init__(self, base: Embeddings, model_name: str,
+                 max_items: int = EMBED_CACHE_SIZE, db_path: Optional[str] = EMBED_CACHE_DB):
+        self.base = base
+        self.model = model_name
+        self.max_items = max_items
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = None
+        if db_path:
+            # timeout: nhiều worker (gunicorn) cùng ghi một file cache
+            self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    vec BLOB NOT NULL,
+                    created REAL NOT NULL
+                )
+            """)
+            self._db.commit()
+
+    # ------------------------------
+    # Key & lưu trữ
+    # ------------------------------
+    def _key(self, text: str) -> str:
+        raw = f"{self.model}\x00{normalize_text(text)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vec: List[float]):
+        self._lru[key] = vec
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_items:
+            self._lru.popitem(last=False)
+
+    def _get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            vec = self._lru.get(key)
+            if vec is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return vec
+            if self._db is not None:
+                row = self._db.execute("SELECT vec FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row:
+                    vec = array("f", row[0]).tolist()
+                    self._remember(key, vec)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return vec
+            self.misses += 1
+            return None
+
+    def _put_many(self, items):
+        with self._lock:
+            for key, vec in items:
+                self._remember(key, vec)
+            if self._db is not None and items:
+                now = time.time()
+                try:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO embeddings (key, model, vec, created) VALUES (?, ?, ?, ?)",
+                        [(key, self.model, array("f", vec).tobytes(), now) for key, vec in items]
+                    )
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    # Không ghi được tầng đĩa (bị khóa quá lâu) thì vẫn còn bản trong RAM
+                    self._db.rollback()
+                    print(f"[⚠️] Không ghi được cache embedding: {e}")
+
+    # ------------------------------
+    # Giao diện Embeddings
+    # ------------------------------
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(t) for t in texts]
+        result = [None] * len(texts)
+        missing = OrderedDict()  # key -> text, gộp các text trùng nhau trong cùng batch
+        for i, key in enumerate(keys):
+            vec = self._get(key) if key not in missing else None
+            if vec is not None:
+                result[i] = vec
+            else:
+                missing.setdefault(key, texts[i])
+
+        if missing:
+            vectors = self.base.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self._put_many(list(fresh.items()))
+            for i, key in enumerate(keys):
+                if result[i] is None:
+                    result[i] = fresh[key]
+        return result
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vec = self._get(key)
+        if vec is None:
+            vec = self.base.embed_query(text)
+            self._put_many([(key, vec)])
+        return vec
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(t) for t in texts]
+        result = [self._get(key) for key in keys]
+        missing = OrderedDict((key, texts[i]) for i, key in enumerate(keys) if result[i] is None)
+        if missing:
+            vectors = await self.base.aembed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self._put_many(list(fresh.items()))
+            result = [vec if vec is not None else fresh[key] for key, vec in zip(keys, result)]
+        return result
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vec = self._get(key)
+        if vec is None:
+            vec = await self.base.aembed_query(text)
+            self._put_many([(key, vec)])
+        return vec
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        stats = {
+            "model": self.model,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "memory_items": len(self._lru)
+        }
+        if hasattr(self.base, "stats"):
+            stats["batching"] = self.base.stats()
+        return stats
+
+
+def get_embeddings(model_name: str = EMBEDDING_MODEL) -> CachedEmbeddings:
+    """Trả về đối tượng embeddings có cache, dùng chung trong cả tiến trình"""
+    with _shared_lock:
+        if model_name not in _shared:
+            # Deadline, thử lại, ngắt mạch (llm_clients); EMBED_BASE_URL cho endpoint cục bộ
+            from llm_clients import make_embeddings
+            from embed_batcher import BatchingEmbeddings
+            # Câu hỏi chưa có trong cache được gom batch với các request đồng thời khác
+            base = BatchingEmbeddings(make_embeddings(model_name, check_ctx_length=EMBED_CHECK_CTX_LENGTH))
+            _shared[model_name] = CachedEmbeddings(base, model_name)
+        return _shared[model_name]
@@ -1,23 +1,46 @@
-import os, json, pickle, time
-from typing import Optional, List
+import os, json, hashlib, time, threading
+from typing import Optional, List, Tuple
 from dotenv import load_dotenv
-from langchain_openai import OpenAIEmbeddings
+from embedding_cache import get_embeddings
 import numpy as np
 
 load_dotenv()
 
 FAQ_FILE = "local_faq.json"
-VEC_FILE = "faq_vectors.pkl"
+INDEX_FILE = "faq_index.npy"        # ma trận float32 đã chuẩn hóa (n x dim)
+MANIFEST_FILE = "faq_index.json"    # hash nội dung FAQ + model của index
+INDEX_VERSION = 1
 THRESHOLD = 0.75
+BUILD_RETRY_SEC = 30                # build index lỗi (API embed lỗi) thì chờ chừng này giây mới thử lại
 
 class FAQService:
     def __init__(self, model_name="text-embedding-3-small"):
-        self.path = os.path.join(os.path.dirname(__file__), FAQ_FILE)
-        self.vec_path = os.path.join(os.path.dirname(__file__), VEC_FILE)
-        self.emb = OpenAIEmbeddings(model=model_name)
-        self.faq = self._load_faq()
-        self.vectors = self._load_or_build_vectors()
+        base_dir = os.path.dirname(__file__)
+        self.path = os.path.join(base_dir, FAQ_FILE)
+        self.index_path = os.path.join(base_dir, INDEX_FILE)
+        self.manifest_path = os.path.join(base_dir, MANIFEST_FILE)
+        self.model_name = model_name
+        self.emb = get_embeddings(model_name)
+        self._faq_mtime = None
+        # (danh sách FAQ, ma trận) luôn được thay cùng lúc: request đọc một bản chụp nhất quán
+        self._state = ([], None)
+        self._lock = threading.Lock()
+        self._building = False
+        self._retry_at = 0.0
+        with self._lock:
+            self._load()
 
+    @property
+    def faq(self) -> List[dict]:
+        return self._state[0]
+
+    @property
+    def matrix(self):
+        return self._state[1]
+
+    # ------------------------------
+    # Nạp FAQ & index
+    # ------------------------------
     def _load_faq(self) -> List[dict]:
         if not os.path.exists(self.path):
             return []
@@ -27,56 +50,158 @@ class FAQService:
         except Exception:
             return []
 
-    def _load_or_build_vectors(self):
-        # load cached
-        if os.path.exists(self.vec_path):
+    def _faq_hash(self) -> str:
+        if not os.path.exists(self.path):
+            return ""
+        with open(self.path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def _load(self, build: bool = True) -> bool:
+        """
+        Đọc FAQ + index vào biến cục bộ rồi công bố cùng lúc (gọi khi giữ self._lock).
+        build=False: index không khớp thì giữ nguyên trạng thái cũ và trả về False (không embed).
+        Chỉ ghi nhận mtime khi đã công bố trạng thái mới: lỗi / chưa build xong thì lần sau còn nạp lại.
+        """
+        mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+        faq = self._load_faq()
+        matrix = self._load_or_build_index(faq, build)
+        if faq and matrix is None:
+            return False
+        self._state = (faq, matrix)
+        self._faq_mtime = mtime
+        return True
+
+    def _load_or_build_index(self, faq: List[dict], build: bool = True):
+        questions = [q.get("question", "") for q in faq]
+        if not questions:
+            return None
+
+        faq_hash = self._faq_hash()
+        manifest = self._read_manifest()
+        if (manifest.get("version") == INDEX_VERSION
+                and manifest.get("faq_hash") == faq_hash
+                and manifest.get("model") == self.model_name
+                and manifest.get("count") == len(questions)
+                and os.path.exists(self.index_path)):
             try:
-                with open(self.vec_path, "rb") as f:
-                    return pickle.load(f)
+                return np.load(self.index_path, mmap_mode="r")
             except Exception:
                 pass
-        # build
-        questions = [q.get("question","") for q in self.faq]
-        if not questions:
+        if not build:
+            return None
+
+        # Index cũ không khớp với local_faq.json -> build lại
+        vectors = np.asarray(self.emb.embed_documents(questions), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix = vectors / norms
+
+        tmp_path = self.index_path + ".tmp.npy"
+        np.save(tmp_path, matrix)
+        os.replace(tmp_path, self.index_path)
+        with open(self.manifest_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": INDEX_VERSION,
+                "faq_hash": faq_hash,
+                "model": self.model_name,
+                "count": int(matrix.shape[0]),
+                "dim": int(matrix.shape[1]),
+                "built": time.strftime("%Y-%m-%d %H:%M:%S")
+            }, f, ensure_ascii=False, indent=2)
+        return np.load(self.index_path, mmap_mode="r")
+
+    def _reload_if_changed(self):
+        """
+        local_faq.json bị sửa (mtime đổi) -> một thread nạp lại; index không khớp thì build lại
+        trong thread nền, request vẫn dùng FAQ + index cũ cho tới khi xong (build lỗi thì thử lại
+        sau BUILD_RETRY_SEC giây).
+        """
+        mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+        if mtime == self._faq_mtime or self._building or time.monotonic() < self._retry_at:
+            return
+        with self._lock:
+            if mtime != self._faq_mtime and not self._building and not self._load(build=False):
+                self._building = True
+                threading.Thread(target=self._build_in_background, name="faq-index", daemon=True).start()
+
+    def _build_in_background(self):
+        try:
+            with self._lock:
+                self._load()
+        except Exception as e:
+            print(f"[⚠️] Lỗi khi build lại index FAQ: {e}")
+            self._retry_at = time.monotonic() + BUILD_RETRY_SEC
+        finally:
+            self._building = False
+
+    # ------------------------------
+    # So khớp
+    # ------------------------------
+    def search(self, qvec: List[float], k: int = 1, matrix=None) -> List[Tuple[int, float]]:
+        """Top-k (index, cosine) bằng một phép nhân ma trận - vector"""
+        if matrix is None:
+            matrix = self.matrix
+        if matrix is None or len(matrix) == 0:
             return []
-        vectors = self.emb.embed_documents(questions)
-        with open(self.vec_path, "wb") as f:
-            pickle.dump(vectors, f)
-        return vectors
-
-    @staticmethod
-    def _cosine(a, b):
-        a, b = np.array(a), np.array(b)
-        denom = (np.linalg.norm(a) * np.linalg.norm(b))
-        if denom == 0:
-            return 0.0
-        return float(np.dot(a, b) / denom)
-
-    def check(self, text: str) -> Optional[str]:
-        """Trả answer string nếu match, hoặc None"""
-        if not self.faq or not self.vectors:
+        q = np.asarray(qvec, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if norm == 0:
+            return []
+        scores = matrix @ (q / norm)
+        k = min(k, len(scores))
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def check(self, text: str, query_vector: Optional[List[float]] = None) -> Optional[str]:
+        """Trả answer string nếu match, hoặc None.
+        Có thể truyền sẵn query_vector để không phải embed lại câu hỏi."""
+        self._reload_if_changed()
+        if not self.faq or self.matrix is None:
             return None
         # short queries hơn ưu tiên FAQ
         if len(text.split()) > 50:
             return None
-        try:
-            qvec = self.emb.embed_query(text)
-        except Exception:
-            return None
-        best_idx, best_score = None, 0.0
-        for i, v in enumerate(self.vectors):
-            s = self._cosine(qvec, v)
-            if s > best_score:
-                best_score, best_idx = s, i
-        if best_idx is not None and best_score >= THRESHOLD:
-            return self.faq[best_idx].get("answer")
-        return None
+        if query_vector is None:
+            try:
+                query_vector = self.emb.embed_query(text)
+            except Exception:
+                return None
+        return self.match_vector(query_vector)
 
-    def rebuild(self):
-        self.faq = self._load_faq()
-        if os.path.exists(self.vec_path):
+    async def acheck(self, text: str, query_vector: Optional[List[float]] = None) -> Optional[str]:
+        """Phiên bản async của check() (dùng aembed_query khi chưa có vector)"""
+        if query_vector is None:
+            self._reload_if_changed()
+            if not self.faq or self.matrix is None or len(text.split()) > 50:
+                return None
             try:
-                os.remove(self.vec_path)
+                query_vector = await self.emb.aembed_query(text)
             except Exception:
-                pass
-        self.vectors = self._load_or_build_vectors()
+                return None
+        return self.check(text, query_vector=query_vector)
+
+    def match_vector(self, qvec: List[float]) -> Optional[str]:
+        """So khớp một vector câu hỏi đã embed với các câu hỏi FAQ"""
+        faq, matrix = self._state
+        hits = self.search(qvec, k=1, matrix=matrix)
+        if hits and hits[0][1] >= THRESHOLD:
+            return faq[hits[0][0]].get("answer")
+        return None
+
+    def rebuild(self):
+        with self._lock:
+            for p in (self.index_path, self.manifest_path):
+                if os.path.exists(p):
+                    try:
+                        os.remove(p)
+                    except Exception:
+                        pass
+            self._load()
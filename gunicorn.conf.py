@@ -0,0 +1,72 @@
+# Chạy nhiều tiến trình:  gunicorn -c gunicorn.conf.py app:app
+#
+# - Mỗi worker tự tạo client (Chroma, OpenAI, SQLite) sau khi fork (preload_app = False).
+# - Worker giữ khóa WRITER_LOCK_FILE là writer duy nhất: chạy hàng đợi ingest và đồng bộ thư mục;
+#   các worker khác chỉ thêm job vào hàng đợi (SQLite) và reload khi kb_version.json thay đổi.
+# - Chroma chạy ở chế độ server: nếu chưa đặt CHROMA_HOST, master tự chạy `chroma run` trên
+#   ./knowledge_base_ptit (tắt bằng CHROMA_AUTOSTART=0), mọi worker kết nối bằng HttpClient.
+# - Cache embedding / câu trả lời và lịch sử hội thoại nằm trong SQLite (WAL), dùng chung giữa các worker.
+import os
+import time
+import socket
+import subprocess
+import multiprocessing
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+# gthread: mỗi worker nhiều thread, giữ được kết nối /send-stream (SSE) trong lúc LLM sinh token
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+preload_app = False
+
+CHROMA_DB_PATH = "./knowledge_base_ptit"
+CHROMA_PORT = os.getenv("CHROMA_PORT", "8001")
+CHROMA_START_TIMEOUT = 30  # giây chờ Chroma server nhận kết nối
+
+# Biến môi trường của master được các worker kế thừa khi fork
+os.environ["WRITER_ELECTION"] = "1"
+
+_chroma_server = None
+
+
+def _wait_for_port(host, port, timeout_sec):
+    deadline = time.time() + timeout_sec
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, int(port)), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def on_starting(server):
+    global _chroma_server
+    if os.getenv("CHROMA_HOST") or os.getenv("CHROMA_AUTOSTART", "1") != "1":
+        return
+    os.makedirs(CHROMA_DB_PATH, exist_ok=True)
+    _chroma_server = subprocess.Popen(
+        ["chroma", "run", "--path", CHROMA_DB_PATH, "--host", "localhost", "--port", CHROMA_PORT],
+        stdout=subprocess.DEVNULL
+    )
+    if not _wait_for_port("localhost", CHROMA_PORT, CHROMA_START_TIMEOUT):
+        _chroma_server.terminate()
+        raise RuntimeError(f"Chroma server không khởi động được trên cổng {CHROMA_PORT}")
+    os.environ["CHROMA_HOST"] = "localhost"
+    os.environ["CHROMA_PORT"] = CHROMA_PORT
+    server.log.info("Chroma server (pid %s) trên localhost:%s", _chroma_server.pid, CHROMA_PORT)
+
+
+def on_exit(server):
+    if _chroma_server is not None:
+        _chroma_server.terminate()
+        try:
+            _chroma_server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            _chroma_server.kill()
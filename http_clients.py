@@ -0,0 +1,48 @@
+import os
+import threading
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Pool kết nối HTTP dùng chung cho mọi client OpenAI (embedding + chat)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))
+
+_lock = threading.Lock()
+_sync_client = None
+_async_client = None
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                        max_keepalive_connections=HTTP_MAX_KEEPALIVE)
+
+
+def get_http_client() -> httpx.Client:
+    global _sync_client
+    with _lock:
+        if _sync_client is None:
+            _sync_client = httpx.Client(limits=_limits(), timeout=HTTP_TIMEOUT)
+        return _sync_client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    global _async_client
+    with _lock:
+        if _async_client is None:
+            _async_client = httpx.AsyncClient(limits=_limits(), timeout=HTTP_TIMEOUT)
+        return _async_client
+
+
+async def aclose_http_clients():
+    """Đóng pool kết nối khi server ASGI tắt"""
+    global _sync_client, _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    if _sync_client is not None:
+        _sync_client.close()
+        _sync_client = None
@@ -0,0 +1,303 @@
+import os
+import uuid
+import sqlite3
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))  # số file được xử lý song song
+INGEST_JOBS_DB = os.getenv("INGEST_JOBS_DB", "./ingest_jobs.sqlite3")
+INGEST_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", "0.5"))  # giây, writer hỏi job mới
+MAX_KEPT_JOBS = 200                                      # số job cũ giữ lại để tra cứu
+
+# Tỉ lệ hoàn thành ứng với từng bước trong add_or_update_file
+STAGE_PROGRESS = {"queued": 0.0, "parsing": 0.1, "embedding": 0.4, "writing": 0.8, "done": 1.0}
+
+_COLUMNS = ("id", "kind", "file", "path", "force_replace", "status", "stage",
+            "progress", "message", "created", "finished")
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class IngestJobQueue:
+    """
+    Hàng đợi nạp tài liệu chạy nền: upload trả về job id ngay,
+    trang admin hỏi trạng thái qua /jobs. Các file khác nhau được xử lý song song,
+    cùng một file được rag_system tuần tự hóa.
+
+    Job nằm trong SQLite nên mọi worker (gunicorn) đều thêm và xem được job,
+    nhưng chỉ tiến trình writer (process_roles) gọi start() để nhận và chạy job.
+    Các thao tác ghi khác (xóa file, reset, đồng bộ thư mục, sinh sẵn câu trả lời phổ biến,
+    export / khôi phục snapshot) cũng đi qua hàng đợi này.
+    """
+
+    def __init__(self, workers: int = INGEST_WORKERS, db_path: str = INGEST_JOBS_DB):
+        self.workers = workers
+        self.db_path = db_path
+        self._local = threading.local()
+        self._pool = None
+        self._running = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._init_schema()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                id TEXT UNIQUE NOT NULL,
+                kind TEXT NOT NULL,
+                file TEXT NOT NULL,
+                path TEXT,
+                force_replace INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                progress REAL NOT NULL DEFAULT 0,
+                message TEXT NOT NULL DEFAULT '',
+                created TEXT NOT NULL,
+                finished TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, seq);
+        """)
+        conn.commit()
+
+    @staticmethod
+    def _row(row) -> dict:
+        job = {c: row[c] for c in _COLUMNS}
+        job["force_replace"] = bool(job["force_replace"])
+        return job
+
+    # ------------------------------
+    # Thêm job (mọi worker)
+    # ------------------------------
+    def _new_job(self, kind: str, file_label: str, path: str = None, force_replace: bool = False) -> dict:
+        job = {
+            "id": uuid.uuid4().hex[:12],
+            "kind": kind,
+            "file": file_label,
+            "path": path,
+            "force_replace": force_replace,
+            "status": "queued",
+            "stage": "queued",
+            "progress": 0.0,
+            "message": "",
+            "created": _now(),
+            "finished": None
+        }
+        conn = self._conn()
+        with conn:
+            conn.execute(f"INSERT INTO jobs ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                         [job[c] for c in _COLUMNS])
+            conn.execute("DELETE FROM jobs WHERE status NOT IN ('queued', 'running') "
+                         "AND seq <= (SELECT MAX(seq) FROM jobs) - ?", (MAX_KEPT_JOBS,))
+        self._wake.set()
+        return job
+
+    def submit(self, file_path: str, force_replace: bool = False) -> dict:
+        return self._new_job("file", os.path.basename(file_path), file_path, force_replace)
+
+    def submit_bulk(self, directory: str) -> dict:
+        """Nạp cả thư mục bằng bulk_ingest (parse song song, embed theo batch)"""
+        return self._new_job("bulk", f"{directory} (hàng loạt)", directory, force_replace=True)
+
+    def submit_many(self, file_paths, force_replace: bool = False):
+        return [self.submit(p, force_replace) for p in file_paths]
+
+    def submit_delete(self, file_name: str) -> dict:
+        return self._new_job("delete", f"{file_name} (xóa)", file_name)
+
+    def submit_reset(self, directory: str) -> dict:
+        """Xóa toàn bộ Chroma rồi nạp lại directory trong cùng một job"""
+        return self._new_job("reset", f"{directory} (reset + nạp lại)", directory)
+
+    def submit_sync(self) -> dict:
+        return self._new_job("sync", "Đồng bộ thư mục tài liệu")
+
+    def submit_popular(self, action: str = "mine") -> dict:
+        """Khai thác câu hỏi phổ biến ("mine") hoặc chỉ sinh lại câu trả lời ("regenerate");
+        đã có job cùng loại đang chờ thì dùng lại job đó"""
+        row = self._conn().execute("SELECT id FROM jobs WHERE kind = 'popular' AND path = ? AND status = 'queued'",
+                                   (action,)).fetchone()
+        if row is not None:
+            return self.get(row["id"])
+        label = "Phân tích câu hỏi phổ biến" if action == "mine" else "Sinh lại câu trả lời câu hỏi phổ biến"
+        return self._new_job("popular", label, action)
+
+    def submit_snapshot(self) -> dict:
+        """Export bundle tri thức vào SNAPSHOT_DIR"""
+        return self._new_job("snapshot", "Export snapshot tri thức")
+
+    def submit_restore(self, bundle_path: str) -> dict:
+        """Thay toàn bộ tri thức bằng nội dung bundle (không embed lại)"""
+        return self._new_job("restore", f"{os.path.basename(bundle_path)} (khôi phục)", bundle_path)
+
+    # ------------------------------
+    # Chạy job (chỉ tiến trình writer)
+    # ------------------------------
+    def start(self):
+        """Bắt đầu nhận job; job 'running' của writer cũ (đã chết) được đưa lại hàng đợi"""
+        with self._lock:
+            if self._pool is not None:
+                return self
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ingest")
+        conn = self._conn()
+        with conn:
+            conn.execute("UPDATE jobs SET status = 'queued', stage = 'queued', progress = 0 WHERE status = 'running'")
+        threading.Thread(target=self._dispatch_loop, name="ingest-dispatch", daemon=True).start()
+        return self
+
+    def _claim(self):
+        """Nhận job cũ nhất đang chờ; UPDATE có điều kiện nên một job chỉ được nhận một lần"""
+        conn = self._conn()
+        row = conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY seq LIMIT 1").fetchone()
+        if row is None:
+            return None
+        with conn:
+            claimed = conn.execute("UPDATE jobs SET status = 'running' WHERE id = ? AND status = 'queued'",
+                                   (row["id"],)).rowcount
+        return self.get(row["id"]) if claimed else None
+
+    def _dispatch_loop(self):
+        while True:
+            job = None
+            with self._lock:
+                free = self._running < self.workers
+            if free:
+                try:
+                    job = self._claim()
+                except sqlite3.Error as e:
+                    print(f"[⚠️] Lỗi khi nhận job ingest: {e}")
+            if job is None:
+                self._wake.wait(INGEST_POLL_INTERVAL)
+                self._wake.clear()
+                continue
+            with self._lock:
+                self._running += 1
+            self._pool.submit(self._execute, job)
+
+    def _execute(self, job: dict):
+        handlers = {"file": self._run, "bulk": self._run_bulk, "delete": self._run_delete,
+                    "reset": self._run_reset, "sync": self._run_sync, "popular": self._run_popular,
+                    "snapshot": self._run_snapshot, "restore": self._run_restore}
+        try:
+            status, message = handlers[job["kind"]](job)
+        except Exception as e:
+            status, message = "error", str(e)
+        finally:
+            with self._lock:
+                self._running -= 1
+            self._wake.set()
+        self._update(job["id"], status=status, message=message, stage="done", progress=1.0, finished=_now())
+
+    def _update(self, job_id: str, **fields):
+        conn = self._conn()
+        with conn:
+            conn.execute(f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                         [*fields.values(), job_id])
+
+    def _run(self, job: dict):
+        from rag_system import add_or_update_file
+
+        def progress(stage):
+            self._update(job["id"], stage=stage, progress=STAGE_PROGRESS.get(stage, 0.0))
+
+        result = add_or_update_file(job["path"], force_replace=job["force_replace"], progress=progress)
+        if result.get("exists"):
+            return "exists", f"{result['file']} đã tồn tại, cần xác nhận ghi đè."
+        if result.get("success"):
+            return "success", result.get("message", "")
+        return "error", result.get("message", "")
+
+    def _run_bulk(self, job: dict):
+        from bulk_ingest import bulk_ingest, list_documents
+
+        def progress(stage, fraction):
+            self._update(job["id"], stage=stage, progress=round(fraction, 3))
+
+        r = bulk_ingest(list_documents(job["path"]), progress=progress)
+        status = "error" if r["failed"] and not r["parsed"] else "success"
+        message = (f"{r['parsed']}/{r['files']} file, {r['chunks']} đoạn "
+                   f"(+{r['added']} / -{r['removed']} / ={r['kept']}), {r['chunks_per_sec']} đoạn/s")
+        if r["failed"]:
+            message += f"; lỗi: {', '.join(r['failed'])}"
+        return status, message
+
+    def _run_delete(self, job: dict):
+        from rag_system import delete_knowledge
+
+        if delete_knowledge(job["path"]):
+            return "success", f"Đã xóa {job['path']}"
+        return "error", f"Lỗi khi xóa {job['path']}"
+
+    def _run_reset(self, job: dict):
+        from rag_system import reset_knowledge
+
+        self._update(job["id"], stage="reset")
+        reset_knowledge()
+        status, message = self._run_bulk(job)
+        return status, f"Đã reset; {message}"
+
+    def _run_sync(self, job: dict):
+        from knowledge_sync import get_knowledge_sync
+
+        result = get_knowledge_sync().sync_once()
+        message = (f"+{len(result['ingested'])} file, -{len(result['deleted'])} file, "
+                   f"{len(result['errors'])} lỗi ({result['duration_sec']}s)")
+        return ("error" if result["errors"] and not result["changed"] else "success"), message
+
+    def _run_popular(self, job: dict):
+        from popular_questions import get_popular_questions
+
+        popular = get_popular_questions()
+        result = popular.mine() if job["path"] == "mine" else popular.regenerate()
+        if result is None:
+            return "success", "Chưa khai thác câu hỏi phổ biến lần nào, bỏ qua."
+        return "success", (f"{result['questions_mined']} câu hỏi, {result['clusters']} cụm phổ biến: "
+                           f"{result['answered']} sinh sẵn, {result['faq']} thuộc FAQ ({result['duration_sec']}s)")
+
+    def _run_snapshot(self, job: dict):
+        from kb_snapshot import export_snapshot
+
+        def progress(stage, fraction):
+            self._update(job["id"], stage=stage, progress=round(fraction, 3))
+
+        r = export_snapshot(progress=progress)
+        return "success", (f"{os.path.basename(r['path'])}: {r['chunks']} đoạn, {r['files']} file, "
+                           f"{r['size_mb']} MB ({r['duration_sec']}s)")
+
+    def _run_restore(self, job: dict):
+        from kb_snapshot import import_snapshot
+
+        def progress(stage, fraction):
+            self._update(job["id"], stage=stage, progress=round(fraction, 3))
+
+        r = import_snapshot(job["path"], progress=progress)
+        return "success", (f"Đã khôi phục {r['chunks']} đoạn, {r['files']} file "
+                           f"(kb_version nguồn {r['source_kb_version']}, {r['duration_sec']}s)")
+
+    # ------------------------------
+    # Tra cứu
+    # ------------------------------
+    def get(self, job_id: str):
+        row = self._conn().execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def list(self, limit: int = 20):
+        rows = self._conn().execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs ORDER BY seq DESC LIMIT ?", (limit,))
+        return [self._row(r) for r in rows]
@@ -0,0 +1,359 @@
+import os
+import io
+import json
+import time
+import shutil
+import tarfile
+import hashlib
+import argparse
+import tempfile
+from datetime import datetime
+
+import numpy as np
+from dotenv import load_dotenv
+
+from kb_version import get_kb_version
+
+load_dotenv()
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "./snapshots")
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "5"))  # số bundle giữ lại khi export vào SNAPSHOT_DIR
+SNAPSHOT_SUFFIX = ".kb.tar.gz"
+FORMAT_VERSION = 1
+PAGE = 5000  # số đoạn mỗi lần đọc / ghi Chroma
+
+
+def _state_files() -> dict:
+    """Tên file trong bundle -> file trên máy (FAQ nằm cạnh faq_service.py, các file trạng thái theo cấu hình)"""
+    from rag_system import UPDATE_LOG_FILE
+    from knowledge_sync import SYNC_MANIFEST_FILE
+    from faq_service import FAQ_FILE, INDEX_FILE, MANIFEST_FILE
+
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    # local_faq.json đứng cuối: khi khôi phục, FAQService thấy mtime đổi và nạp lại index đã có sẵn (không embed lại)
+    files = {f"faq/{name}": os.path.join(base_dir, name) for name in (INDEX_FILE, MANIFEST_FILE, FAQ_FILE)}
+    files["state/sync_manifest.json"] = SYNC_MANIFEST_FILE
+    files["state/update_log.json"] = UPDATE_LOG_FILE
+    return files
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _copy_atomic(src: str, dst: str):
+    os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+    tmp = f"{dst}.restore.tmp"
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+# ==============================
+# Export
+# ==============================
+def _dump_collection(collection, workdir: str) -> dict:
+    """chunks.jsonl ([id, nội dung, metadata] mỗi dòng) + embeddings.npy (float32, cùng thứ tự)"""
+    total = collection.count()
+    chunks_path = os.path.join(workdir, "chunks.jsonl")
+    vectors = None
+    files = {}
+    offset = 0
+    with open(chunks_path, "w", encoding="utf-8") as f:
+        while offset < total:
+            page = collection.get(include=["embeddings", "documents", "metadatas"], limit=PAGE, offset=offset)
+            if not len(page["ids"]):
+                break
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(os.path.join(workdir, "embeddings.npy"), mode="w+",
+                                                    dtype=np.float32, shape=(total, len(page["embeddings"][0])))
+            vectors[offset:offset + len(page["ids"])] = np.asarray(page["embeddings"], dtype=np.float32)
+            for chunk_id, text, meta in zip(page["ids"], page["documents"], page["metadatas"]):
+                f.write(json.dumps([chunk_id, text, meta or {}], ensure_ascii=False) + "\n")
+                name = (meta or {}).get("file_name")
+                files[name] = files.get(name, 0) + 1
+            offset += len(page["ids"])
+    if offset != total:
+        raise RuntimeError(f"Collection thay đổi trong lúc export ({offset}/{total} đoạn)")
+    if vectors is None:
+        np.save(os.path.join(workdir, "embeddings.npy"), np.zeros((0, 0), dtype=np.float32))
+        dim = 0
+    else:
+        vectors.flush()
+        dim = vectors.shape[1]
+        del vectors
+    return {"chunks": total, "dim": dim, "files": {k or "": v for k, v in files.items()}}
+
+
+def export_snapshot(path: str = None, include_docs: bool = True, progress=None) -> dict:
+    """
+    Ghi một bundle nhất quán (tar.gz) của tri thức hiện tại: các đoạn (nội dung, metadata, embedding),
+    FAQ + index vector FAQ, manifest đồng bộ thư mục, log cập nhật và (tùy chọn) tài liệu gốc trong old_docs.
+    Giữ update_lock suốt lúc đọc nên không lẫn với thao tác ghi của tiến trình này; kb_version đổi
+    trong lúc export (tiến trình khác ghi) thì báo lỗi thay vì ghi bundle lệch.
+    """
+    from rag_system import get_vector_store, update_lock, EMBEDDING_MODEL, OLD_DOCS_DIR
+
+    start = time.perf_counter()
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix=".export-", dir=SNAPSHOT_DIR)
+    try:
+        members = {}  # tên trong bundle -> file tạm
+        with update_lock:
+            version = get_kb_version()
+            if progress:
+                progress("export", 0.1)
+            info = _dump_collection(get_vector_store()._collection, workdir)
+            members["chunks.jsonl"] = os.path.join(workdir, "chunks.jsonl")
+            members["embeddings.npy"] = os.path.join(workdir, "embeddings.npy")
+            for name, src in _state_files().items():
+                if os.path.exists(src):
+                    members[name] = os.path.join(workdir, name.replace("/", "__"))
+                    shutil.copyfile(src, members[name])
+            if include_docs and os.path.isdir(OLD_DOCS_DIR):
+                for name in sorted(os.listdir(OLD_DOCS_DIR)):
+                    src = os.path.join(OLD_DOCS_DIR, name)
+                    if os.path.isfile(src):
+                        members[f"docs/{name}"] = os.path.join(workdir, f"docs__{len(members)}")
+                        shutil.copyfile(src, members[f"docs/{name}"])
+            if get_kb_version() != version:
+                raise RuntimeError("Tri thức thay đổi trong lúc export, hãy thử lại")
+
+        if progress:
+            progress("compress", 0.6)
+        manifest = {
+            "format": FORMAT_VERSION,
+            "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "kb_version": version,
+            "embedding_model": EMBEDDING_MODEL,
+            **info,
+            "members": {name: _sha256(p) for name, p in members.items()}
+        }
+        if path is None:
+            stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+            path = os.path.join(SNAPSHOT_DIR, f"kb-{stamp}-v{version}{SNAPSHOT_SUFFIX}")
+        tmp = f"{path}.tmp"
+        with tarfile.open(tmp, "w:gz", compresslevel=6) as tar:
+            data = json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8")
+            entry = tarfile.TarInfo("manifest.json")
+            entry.size, entry.mtime = len(data), int(time.time())
+            tar.addfile(entry, io.BytesIO(data))  # manifest đứng đầu: list_snapshots chỉ đọc phần này
+            for name, p in members.items():
+                tar.add(p, arcname=name, recursive=False)
+        os.replace(tmp, path)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if os.path.dirname(os.path.abspath(path)) == os.path.abspath(SNAPSHOT_DIR):
+        _prune(SNAPSHOT_KEEP)
+    return {
+        "path": path,
+        "kb_version": version,
+        "chunks": manifest["chunks"],
+        "files": len(manifest["files"]),
+        "size_mb": round(os.path.getsize(path) / 1024 / 1024, 2),
+        "duration_sec": round(time.perf_counter() - start, 2)
+    }
+
+
+# ==============================
+# Import
+# ==============================
+def read_manifest(path: str) -> dict:
+    with tarfile.open(path, "r:gz") as tar:
+        entry = tar.next()
+        if entry is None or entry.name != "manifest.json":
+            raise ValueError(f"{os.path.basename(path)} không phải bundle tri thức (thiếu manifest.json)")
+        return json.load(tar.extractfile(entry))
+
+
+def _extract(path: str, manifest: dict, workdir: str) -> dict:
+    """Giải nén đúng các file có trong manifest (không theo đường dẫn trong tar) và kiểm tra sha256"""
+    expected = manifest["members"]
+    extracted = {}
+    with tarfile.open(path, "r:gz") as tar:
+        for entry in tar:
+            if entry.name not in expected or not entry.isfile():
+                continue
+            dst = os.path.join(workdir, f"m{len(extracted)}")
+            with tar.extractfile(entry) as src, open(dst, "wb") as out:
+                shutil.copyfileobj(src, out, 1 << 20)
+            extracted[entry.name] = dst
+    for name, digest in expected.items():
+        if name not in extracted:
+            raise ValueError(f"Bundle thiếu {name}")
+        if _sha256(extracted[name]) != digest:
+            raise ValueError(f"Bundle hỏng: sai checksum {name}")
+    return extracted
+
+
+def import_snapshot(path: str, progress=None) -> dict:
+    """
+    Khôi phục tri thức từ bundle: thay toàn bộ collection Chroma bằng các đoạn + embedding có sẵn
+    (không gọi API embedding), chỉ mục BM25 / vector_index, FAQ, manifest đồng bộ, log và old_docs;
+    sau đó tăng kb_version để cache và các worker nạp lại.
+    Lỗi sau khi đã xóa collection: tri thức chỉ còn một phần, vẫn tăng kb_version (cache không phục vụ
+    câu trả lời cũ, BM25 / vector_index dựng lại từ Chroma) rồi báo lỗi để job được đánh dấu thất bại.
+    """
+    from langchain_core.documents import Document
+    from rag_system import get_vector_store, update_lock, EMBEDDING_MODEL, OLD_DOCS_DIR
+    from lexical_index import get_lexical_index
+    from vector_index import get_vector_index, RETRIEVER_BACKEND
+
+    start = time.perf_counter()
+    manifest = read_manifest(path)
+    if manifest.get("format", 0) > FORMAT_VERSION:
+        raise ValueError(f"Bundle định dạng {manifest.get('format')} mới hơn phiên bản hỗ trợ ({FORMAT_VERSION})")
+    if manifest.get("embedding_model") != EMBEDDING_MODEL:
+        raise ValueError(f"Bundle dùng embedding {manifest.get('embedding_model')}, hệ thống dùng {EMBEDDING_MODEL}")
+
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix=".import-", dir=SNAPSHOT_DIR)
+    reset_done, row = False, 0
+    try:
+        if progress:
+            progress("verify", 0.05)
+        files = _extract(path, manifest, workdir)
+        vectors = np.load(files["embeddings.npy"], mmap_mode="r")
+        if len(vectors) != manifest["chunks"]:
+            raise ValueError("Số embedding không khớp số đoạn trong manifest")
+
+        with update_lock:
+            store = get_vector_store()
+            store.reset_collection()
+            reset_done = True
+            collection = store._collection
+            lexical = get_lexical_index()
+            lexical.clear()
+            index = get_vector_index() if RETRIEVER_BACKEND == "compact" else None
+            if index is not None:
+                index.reset()
+
+            with open(files["chunks.jsonl"], "r", encoding="utf-8") as f:
+                while True:
+                    lines = [line for _, line in zip(range(PAGE), f)]
+                    if not lines:
+                        break
+                    page = [json.loads(line) for line in lines]
+                    ids = [c[0] for c in page]
+                    texts = [c[1] for c in page]
+                    metas = [c[2] or None for c in page]  # Chroma không nhận metadata rỗng
+                    embeddings = np.asarray(vectors[row:row + len(page)])
+                    collection.add(ids=ids, embeddings=embeddings, documents=texts, metadatas=metas)
+                    row += len(page)
+                    docs = [Document(page_content=t or "", metadata={**(m or {}), "chunk_id": i}, id=i)
+                            for i, t, m in zip(ids, texts, metas)]
+                    lexical.add_documents(docs)
+                    if index is not None:
+                        index.add(ids, embeddings, texts, [d.metadata for d in docs])
+                    if progress:
+                        progress("load", 0.1 + 0.8 * row / max(1, manifest["chunks"]))
+
+            for name, dst in _state_files().items():
+                if name in files:
+                    _copy_atomic(files[name], dst)
+            docs_in_bundle = {name[len("docs/"):]: p for name, p in files.items() if name.startswith("docs/")}
+            if docs_in_bundle:
+                os.makedirs(OLD_DOCS_DIR, exist_ok=True)
+                for name in os.listdir(OLD_DOCS_DIR):
+                    if name not in docs_in_bundle and os.path.isfile(os.path.join(OLD_DOCS_DIR, name)):
+                        os.remove(os.path.join(OLD_DOCS_DIR, name))
+                for name, p in docs_in_bundle.items():
+                    _copy_atomic(p, os.path.join(OLD_DOCS_DIR, os.path.basename(name)))
+        del vectors
+    except Exception as e:
+        if not reset_done:
+            raise
+        raise RuntimeError(f"Khôi phục dở dang ({row}/{manifest['chunks']} đoạn đã vào Chroma), "
+                           f"tri thức hiện chỉ còn một phần: {e}") from e
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        if reset_done:
+            _notify_restored(path, complete=row == manifest["chunks"])
+
+    return {
+        "path": path,
+        "chunks": manifest["chunks"],
+        "files": len(manifest["files"]),
+        "source_kb_version": manifest["kb_version"],
+        "kb_version": get_kb_version(),
+        "duration_sec": round(time.perf_counter() - start, 2)
+    }
+
+
+def _notify_restored(path: str, complete: bool):
+    """Đã xóa collection thì luôn tăng kb_version, kể cả khi khôi phục lỗi giữa chừng"""
+    from rag_system import notify_knowledge_changed
+    from lexical_index import get_lexical_index
+    from vector_index import get_vector_index, RETRIEVER_BACKEND
+
+    try:
+        notify_knowledge_changed(f"restore {os.path.basename(path)}" + ("" if complete else " (dở dang)"))
+        if not complete:
+            # Không biết trang cuối đã vào tới chỉ mục nào: đánh dấu lệch để lần tìm kiếm sau dựng lại từ Chroma
+            get_lexical_index().mark_synced(-1)
+            if RETRIEVER_BACKEND == "compact":
+                get_vector_index().mark_synced(-1)
+    except Exception as e:
+        print(f"[⚠️] Lỗi khi báo thay đổi tri thức sau khôi phục: {e}")
+
+
+# ==============================
+# Quản lý bundle trong SNAPSHOT_DIR
+# ==============================
+def list_snapshots() -> list:
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return []
+    items = []
+    for name in sorted(os.listdir(SNAPSHOT_DIR), reverse=True):
+        if not name.endswith(SNAPSHOT_SUFFIX):
+            continue
+        path = os.path.join(SNAPSHOT_DIR, name)
+        item = {"name": name, "size_mb": round(os.path.getsize(path) / 1024 / 1024, 2)}
+        try:
+            m = read_manifest(path)
+            item.update(created=m["created"], kb_version=m["kb_version"], chunks=m["chunks"], files=len(m["files"]))
+        except (OSError, ValueError, tarfile.TarError) as e:
+            item["error"] = str(e)
+        items.append(item)
+    return items
+
+
+def snapshot_path(name: str) -> str:
+    """Đường dẫn bundle trong SNAPSHOT_DIR theo tên (không cho phép đi ra ngoài thư mục)"""
+    name = os.path.basename(name or "")
+    if not name.endswith(SNAPSHOT_SUFFIX):
+        raise ValueError(f"Tên bundle không hợp lệ: {name}")
+    return os.path.join(SNAPSHOT_DIR, name)
+
+
+def _prune(keep: int):
+    names = sorted(n for n in os.listdir(SNAPSHOT_DIR) if n.endswith(SNAPSHOT_SUFFIX))
+    for name in names[:max(0, len(names) - keep)]:
+        try:
+            os.remove(os.path.join(SNAPSHOT_DIR, name))
+        except FileNotFoundError:
+            pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export / import bundle tri thức (đoạn, embedding, FAQ, manifest)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_export = sub.add_parser("export", help="Ghi bundle của tri thức hiện tại")
+    p_export.add_argument("-o", "--output", help=f"File bundle (mặc định: {SNAPSHOT_DIR}/kb-<thời gian>{SNAPSHOT_SUFFIX})")
+    p_export.add_argument("--no-docs", action="store_true", help="Không kèm tài liệu gốc trong old_docs")
+    p_import = sub.add_parser("import", help="Khôi phục tri thức từ bundle (không embed lại)")
+    p_import.add_argument("path")
+    sub.add_parser("list", help=f"Liệt kê bundle trong {SNAPSHOT_DIR}")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        result = export_snapshot(args.output, include_docs=not args.no_docs)
+    elif args.command == "import":
+        result = import_snapshot(args.path)
+    else:
+        result = list_snapshots()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
@@ -0,0 +1,51 @@
+import os
+import json
+import threading
+from datetime import datetime
+
+# Phiên bản cơ sở tri thức: tăng mỗi khi thêm / sửa / xóa / reset tài liệu.
+# Các cache câu trả lời gắn với phiên bản này để không bao giờ sống lâu hơn tài liệu nguồn.
+KB_VERSION_FILE = "./kb_version.json"
+
+_lock = threading.Lock()
+_cached = {"mtime": None, "version": 0}
+
+
+def get_kb_version() -> int:
+    """Đọc phiên bản hiện tại (chỉ đọc lại file khi mtime thay đổi)"""
+    try:
+        mtime = os.path.getmtime(KB_VERSION_FILE)
+    except OSError:
+        return 0
+    with _lock:
+        if mtime != _cached["mtime"]:
+            try:
+                with open(KB_VERSION_FILE, "r", encoding="utf-8") as f:
+                    _cached["version"] = int(json.load(f).get("version", 0))
+            except Exception:
+                pass
+            _cached["mtime"] = mtime
+        return _cached["version"]
+
+
+def bump_kb_version(reason: str = "") -> int:
+    """Tăng phiên bản tri thức và ghi ra file"""
+    with _lock:
+        version = _cached["version"]
+        try:
+            with open(KB_VERSION_FILE, "r", encoding="utf-8") as f:
+                version = int(json.load(f).get("version", 0))
+        except Exception:
+            pass
+        version += 1
+        tmp_path = KB_VERSION_FILE + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": version,
+                "reason": reason,
+                "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, KB_VERSION_FILE)
+        _cached["version"] = version
+        _cached["mtime"] = os.path.getmtime(KB_VERSION_FILE)
+        return version
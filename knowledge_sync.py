@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from rag_system import delete_knowledge
+from bulk_ingest import bulk_ingest, PARSE_WORKERS
+from parse_cache import file_sha256
+
+load_dotenv()
+
+SYNC_DIR = os.getenv("KB_SYNC_DIR", "./new_docs")                  # thư mục thả tài liệu
+SYNC_MANIFEST_FILE = os.getenv("KB_SYNC_MANIFEST", "./sync_manifest.json")
+SYNC_INTERVAL = int(os.getenv("KB_SYNC_INTERVAL", "60"))           # giây giữa hai lần quét
+SYNC_MAX_INTERVAL = int(os.getenv("KB_SYNC_MAX_INTERVAL", "900"))  # trần khi giãn nhịp (backoff)
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+class KnowledgeSync:
+    """
+    Đồng bộ thư mục tài liệu với Chroma dựa trên manifest (mtime, size, sha256) đã index.
+    Một lần quét khi không có gì thay đổi chỉ tốn vài lệnh stat: không đọc, không parse, không embed.
+    """
+
+    def __init__(self, watch_dir=SYNC_DIR, manifest_path=SYNC_MANIFEST_FILE):
+        self.watch_dir = watch_dir
+        self.manifest_path = manifest_path
+        self._lock = threading.Lock()
+        self.last_result = None
+
+    # ------------------------------
+    # Manifest
+    # ------------------------------
+    def load_manifest(self) -> dict:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return {"files": {}}
+
+    def save_manifest(self, manifest):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    # ------------------------------
+    # Quét & đồng bộ
+    # ------------------------------
+    def _list_files(self):
+        if not os.path.isdir(self.watch_dir):
+            return {}
+        files = {}
+        for name in os.listdir(self.watch_dir):
+            # Bỏ file ẩn và file khóa tạm của Word (~$...)
+            if name.startswith((".", "~$")):
+                continue
+            path = os.path.join(self.watch_dir, name)
+            if os.path.isfile(path):
+                files[name] = path
+        return files
+
+    def scan(self, manifest):
+        """Trả về (to_ingest, to_delete, touched): chỉ hash khi mtime/size khác manifest"""
+        known = manifest.get("files", {})
+        failed = manifest.get("failed", {})
+        now = time.time()
+        to_ingest, touched = [], {}
+        current = self._list_files()
+        for name, path in current.items():
+            st = os.stat(path)
+            entry = known.get(name)
+            if entry and entry["mtime"] == st.st_mtime and entry["size"] == st.st_size:
+                continue
+            bad = failed.get(name)
+            if bad and bad["mtime"] == st.st_mtime and bad["size"] == st.st_size and now < bad["retry_at"]:
+                continue  # file lỗi chưa đổi, chờ tới lượt thử lại
+            digest = file_sha256(path)
+            if entry and entry["sha256"] == digest:
+                # Chỉ đổi mtime (vd: copy lại), nội dung y nguyên
+                touched[name] = {**entry, "mtime": st.st_mtime, "size": st.st_size}
+                continue
+            to_ingest.append((name, path, st, digest))
+        to_delete = [name for name in known if name not in current]
+        return to_ingest, to_delete, touched
+
+    def _ingest(self, paths) -> dict:
+        """
+        Nạp các file mới/đổi trong một lần bulk_ingest: parse song song, embed theo batch và chỉ báo
+        thay đổi tri thức một lần cho cả lượt. Trả về {tên file: lỗi} của các file không nạp được
+        """
+        try:
+            r = bulk_ingest(paths, parse_workers=max(1, min(PARSE_WORKERS, len(paths))))
+        except Exception as e:
+            # Lỗi embed / ghi Chroma: coi như cả lượt lỗi; lần sau nạp lại chỉ embed phần chưa ghi
+            return {os.path.basename(p): str(e) for p in paths}
+        return {name: f"Không thể xử lý {name}" for name in r["failed"]}
+
+    def sync_once(self, interval=SYNC_INTERVAL, max_interval=SYNC_MAX_INTERVAL) -> dict:
+        with self._lock:
+            start = time.time()
+            manifest = self.load_manifest()
+            files = manifest.setdefault("files", {})
+            failed = manifest.setdefault("failed", {})
+            to_ingest, to_delete, touched = self.scan(manifest)
+            result = {"ingested": [], "deleted": [], "errors": [], "touched": len(touched)}
+
+            files.update(touched)
+            errors = self._ingest([path for _, path, _, _ in to_ingest]) if to_ingest else {}
+            for name, path, st, digest in to_ingest:
+                if name not in errors:
+                    files[name] = {
+                        "mtime": st.st_mtime,
+                        "size": st.st_size,
+                        "sha256": digest,
+                        "indexed_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    }
+                    failed.pop(name, None)
+                    result["ingested"].append(name)
+                else:
+                    # Backoff theo từng file: không parse lại file lỗi ở mỗi lần quét
+                    attempts = failed.get(name, {}).get("attempts", 0) + 1
+                    failed[name] = {
+                        "mtime": st.st_mtime,
+                        "size": st.st_size,
+                        "attempts": attempts,
+                        "retry_at": time.time() + min(interval * 2 ** attempts, max_interval)
+                    }
+                    result["errors"].append({"file": name, "message": errors[name]})
+
+            for name in to_delete:
+                if delete_knowledge(name):
+                    files.pop(name, None)
+                    result["deleted"].append(name)
+                else:
+                    result["errors"].append({"file": name, "message": "Không xóa được tri thức"})
+
+            for name in list(failed):
+                if name not in files and not os.path.exists(os.path.join(self.watch_dir, name)):
+                    failed.pop(name)
+
+            if touched or to_ingest or to_delete:
+                self.save_manifest(manifest)
+
+            result["changed"] = bool(result["ingested"] or result["deleted"])
+            result["duration_sec"] = round(time.time() - start, 3)
+            self.last_result = result
+            return result
+
+    def run_forever(self, interval=SYNC_INTERVAL, max_interval=SYNC_MAX_INTERVAL, stop_event=None):
+        """
+        Quét định kỳ mỗi interval giây. Lần quét lỗi (vd: Chroma/API không truy cập được)
+        -> nhân đôi khoảng chờ, tối đa max_interval; quét thành công -> quay về interval.
+        """
+        stop_event = stop_event or threading.Event()
+        delay = interval
+        while not stop_event.is_set():
+            try:
+                result = self.sync_once(interval, max_interval)
+                if result["changed"]:
+                    print(f"[🔄] Đồng bộ tri thức: +{len(result['ingested'])} / -{len(result['deleted'])} file")
+                if result["errors"]:
+                    print(f"[⚠️] Lỗi đồng bộ: {result['errors']}")
+                delay = interval
+            except Exception as e:
+                print(f"[⚠️] Lỗi khi đồng bộ tri thức: {e}")
+                delay = min(delay * 2, max_interval)
+            stop_event.wait(delay)
+
+
+def get_knowledge_sync() -> KnowledgeSync:
+    """Dùng chung một KnowledgeSync (một khóa manifest) cho thread tự đồng bộ và job đồng bộ thủ công"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = KnowledgeSync()
+        return _shared
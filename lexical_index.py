@@ -0,0 +1,204 @@
+import os
+import re
+import math
+import threading
+import unicodedata
+from collections import Counter
+
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+
+from kb_version import get_kb_version
+
+load_dotenv()
+
+HYBRID_ENABLED = os.getenv("HYBRID_ENABLED", "1") == "1"   # tắt -> chỉ tìm kiếm bằng vector
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+RRF_K = int(os.getenv("RRF_K", "60"))                       # hằng số của reciprocal-rank fusion
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def fold_text(text: str) -> str:
+    """Chữ thường + bỏ dấu tiếng Việt: "Học bổng" -> "hoc bong", "Đào tạo" -> "dao tao" """
+    text = unicodedata.normalize("NFD", text.lower()).replace("đ", "d")
+    return "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+
+
+def tokenize(text: str):
+    """
+    Tách từ cho BM25: từng âm tiết đã bỏ dấu + cặp âm tiết liền kề (từ ghép tiếng Việt).
+    Token có gạch dưới (vd: Bang_quy_doi_diem) được giữ nguyên và tách thêm từng phần.
+    """
+    tokens = []
+    words = re.findall(r"\w+", fold_text(text))
+    syllables = []
+    for w in words:
+        if "_" in w:
+            tokens.append(w)
+            syllables.extend(p for p in w.split("_") if p)
+        else:
+            syllables.append(w)
+    tokens.extend(syllables)
+    tokens.extend(f"{a}_{b}" for a, b in zip(syllables, syllables[1:]))
+    return tokens
+
+
+def _doc_key(doc) -> str:
+    """Khóa so khớp cùng một đoạn giữa kết quả Chroma và BM25 (đoạn cũ chưa có chunk_id dùng id của Chroma)"""
+    return (doc.metadata.get("chunk_id") or getattr(doc, "id", None)
+            or f"{doc.metadata.get('file_name', '')}\x00{doc.page_content}")
+
+
+def reciprocal_rank_fusion(result_lists, k: int, rrf_k: int = RRF_K):
+    """Gộp nhiều danh sách Document đã xếp hạng: score = Σ 1 / (rrf_k + rank)"""
+    scores, docs = {}, {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, 1):
+            key = _doc_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [docs[key] for key in ranked]
+
+
+class BM25Index:
+    """
+    Chỉ mục BM25 trong bộ nhớ trên đúng các đoạn đang có trong Chroma.
+    Dựng lười từ Chroma ở lần tìm kiếm đầu, sau đó cập nhật tăng dần khi thêm / xóa / reset;
+    nếu phiên bản tri thức đổi từ nơi khác (vd: CLI bulk_ingest) thì dựng lại.
+    Không cần mạng nên cũng là nguồn truy xuất dự phòng khi API embedding chậm hoặc lỗi.
+    """
+
+    def __init__(self, vector_store_factory=None, k1: float = BM25_K1, b: float = BM25_B):
+        self._store_factory = vector_store_factory
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()  # chỉ một thread dựng lại, các thread khác chờ kết quả
+        self._built = False
+        self._version = None
+        self._docs = {}        # chunk_id -> Document
+        self._tf = {}          # chunk_id -> Counter(token)
+        self._len = {}         # chunk_id -> số token
+        self._postings = {}    # token -> set(chunk_id)
+        self._total_len = 0
+
+    # ------------------------------
+    # Cập nhật
+    # ------------------------------
+    def _add_locked(self, key, doc):
+        if key in self._docs:
+            self._remove_locked(key)
+        tf = Counter(tokenize(doc.page_content))
+        self._docs[key] = doc
+        self._tf[key] = tf
+        self._len[key] = sum(tf.values())
+        self._total_len += self._len[key]
+        for token in tf:
+            self._postings.setdefault(token, set()).add(key)
+
+    def _remove_locked(self, key):
+        tf = self._tf.pop(key, None)
+        if tf is None:
+            return
+        self._docs.pop(key, None)
+        self._total_len -= self._len.pop(key, 0)
+        for token in tf:
+            ids = self._postings.get(token)
+            if ids is not None:
+                ids.discard(key)
+                if not ids:
+                    del self._postings[token]
+
+    def _clear_locked(self):
+        self._docs, self._tf, self._len, self._postings, self._total_len = {}, {}, {}, {}, 0
+
+    def add_documents(self, docs):
+        with self._lock:
+            if not self._built:
+                return  # chưa dựng: lần tìm kiếm đầu sẽ đọc thẳng từ Chroma
+            for doc in docs:
+                self._add_locked(_doc_key(doc), doc)
+
+    def remove_ids(self, ids):
+        with self._lock:
+            for key in ids:
+                self._remove_locked(key)
+
+    def remove_file(self, file_name: str):
+        with self._lock:
+            for key in [k for k, d in self._docs.items() if d.metadata.get("file_name") == file_name]:
+                self._remove_locked(key)
+
+    def clear(self):
+        with self._lock:
+            self._clear_locked()
+
+    def mark_synced(self, kb_version: int):
+        """Gọi sau khi đã cập nhật tăng dần: phiên bản mới không cần dựng lại"""
+        with self._lock:
+            self._version = kb_version
+
+    def rebuild(self):
+        """Đọc toàn bộ đoạn từ Chroma và dựng lại chỉ mục"""
+        from rag_system import get_vector_store
+
+        store = (self._store_factory or get_vector_store)()
+        version = get_kb_version()
+        data = store.get(include=["documents", "metadatas"])
+        with self._lock:
+            self._clear_locked()
+            for chunk_id, text, meta in zip(data["ids"], data["documents"], data["metadatas"]):
+                meta = dict(meta or {})
+                meta.setdefault("chunk_id", chunk_id)
+                self._add_locked(chunk_id, Document(page_content=text or "", metadata=meta, id=chunk_id))
+            self._built = True
+            self._version = version
+
+    def _ensure_fresh(self):
+        if self._built and self._version == get_kb_version():
+            return
+        with self._build_lock:
+            if not self._built or self._version != get_kb_version():
+                self.rebuild()
+
+    # ------------------------------
+    # Tìm kiếm
+    # ------------------------------
+    def search(self, query: str, k: int = 4):
+        self._ensure_fresh()
+        terms = set(tokenize(query))
+        with self._lock:
+            n = len(self._docs)
+            if not n or not terms:
+                return []
+            avgdl = self._total_len / n or 1.0
+            scores = {}
+            for term in terms:
+                ids = self._postings.get(term)
+                if not ids:
+                    continue
+                idf = math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+                for key in ids:
+                    tf = self._tf[key][term]
+                    norm = tf + self.k1 * (1 - self.b + self.b * self._len[key] / avgdl)
+                    scores[key] = scores.get(key, 0.0) + idf * tf * (self.k1 + 1) / norm
+            ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+            return [self._docs[key] for key in ranked]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"built": self._built, "chunks": len(self._docs),
+                    "terms": len(self._postings), "version": self._version}
+
+
+def get_lexical_index() -> BM25Index:
+    """Chỉ mục BM25 dùng chung cho cả tiến trình"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = BM25Index()
+        return _shared
@@ -0,0 +1,367 @@
+import os
+import time
+import queue
+import random
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+
+import metrics
+
+load_dotenv()
+
+# Endpoint tương thích OpenAI (vd: server cục bộ / stub để chạy offline); để trống = OPENAI_BASE_URL / api.openai.com
+LLM_BASE_URL = os.getenv("LLM_BASE_URL") or None
+LLM_API_KEY = os.getenv("LLM_API_KEY") or None
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4.1-nano")
+EMBED_BASE_URL = os.getenv("EMBED_BASE_URL") or None
+EMBED_API_KEY = os.getenv("EMBED_API_KEY") or None
+
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "30"))          # giây cho một lần gọi LLM (stream: tới token đầu / giữa 2 token)
+EMBED_DEADLINE = float(os.getenv("EMBED_DEADLINE", "10"))      # giây cho một lần gọi embedding
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))     # số lần thử lại khi lỗi tạm thời
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.3"))  # giây, backoff = random(0, base * 2^lần)
+RETRY_MAX_DELAY = 5.0
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))     # số lỗi liên tiếp thì ngắt mạch
+BREAKER_RESET = float(os.getenv("BREAKER_RESET", "30"))        # giây ngắt mạch trước khi cho thử lại một lời gọi
+HEDGE_AFTER_MS = float(os.getenv("HEDGE_AFTER_MS", "0"))       # > 0: quá ngưỡng chưa có kết quả thì gửi thêm 1 request
+
+_call_pool = ThreadPoolExecutor(max_workers=64, thread_name_prefix="upstream")
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class UpstreamUnavailableError(Exception):
+    """LLM / embedding không dùng được (ngắt mạch, quá hạn hoặc hết lượt thử lại)"""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Lỗi mạng, quá hạn, 429 và 5xx thì thử lại; lỗi 4xx khác (sai key, prompt quá dài) thì không"""
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    status = getattr(exc, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    # openai.APIConnectionError / APITimeoutError không có status_code
+    return type(exc).__name__ in ("APIConnectionError", "APITimeoutError", "ConnectError", "ReadTimeout")
+
+
+class CircuitBreaker:
+    """
+    closed -> (BREAKER_FAILURES lỗi liên tiếp) -> open: từ chối ngay, không chờ timeout
+    -> (sau BREAKER_RESET giây) half_open: cho một lời gọi thử, thành công thì closed, lỗi thì open lại.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURES, reset_timeout: float = BREAKER_RESET):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state, self._trial = "half_open", False
+            if self.state == "half_open" and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            if self.state != "closed":
+                self.state = "closed"
+                metrics.CIRCUIT_OPEN.set(0, service=self.name)
+                print(f"[✅] {self.name}: đóng mạch, gọi lại bình thường")
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"[⚠️] {self.name}: ngắt mạch {self.reset_timeout:g}s sau {self.failures} lỗi")
+                self.state, self.opened_at, self._trial = "open", time.monotonic(), False
+                metrics.CIRCUIT_OPEN.set(1, service=self.name)
+
+    def stats(self) -> dict:
+        return {"state": self.state, "failures": self.failures}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Một breaker cho mỗi dịch vụ upstream (vd: "llm" dùng chung cho chatbot và viết lại câu hỏi)"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def breaker_stats() -> dict:
+    with _breakers_lock:
+        return {name: b.stats() for name, b in _breakers.items()}
+
+
+class CallPolicy:
+    """Deadline + thử lại có jitter + hedging + ngắt mạch cho các lời gọi tới một dịch vụ"""
+
+    def __init__(self, service: str, deadline: float, retries: int = UPSTREAM_RETRIES,
+                 hedge_after_ms: float = HEDGE_AFTER_MS):
+        self.service = service
+        self.deadline = deadline
+        self.retries = retries
+        self.hedge_after = hedge_after_ms / 1000 if hedge_after_ms > 0 else None
+        self.breaker = get_breaker(service)
+
+    def _event(self, event: str):
+        metrics.UPSTREAM_EVENTS.inc(service=self.service, event=event)
+
+    def _check_open(self):
+        if not self.breaker.allow():
+            self._event("short_circuit")
+            raise UpstreamUnavailableError(f"{self.service} tạm ngắt mạch do lỗi liên tiếp")
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+    def _give_up(self, exc: BaseException):
+        raise UpstreamUnavailableError(f"{self.service} không phản hồi: {exc!r}") from exc
+
+    # ------------------------------
+    # Đồng bộ
+    # ------------------------------
+    def _attempt(self, fn, hedge: bool):
+        """Một lần gọi có deadline; hedge -> sau hedge_after giây gửi thêm bản sao, lấy kết quả về trước"""
+        start = time.monotonic()
+        futures = [_call_pool.submit(fn)]
+        if hedge and self.hedge_after is not None and self.hedge_after < self.deadline:
+            done, _ = wait(futures, timeout=self.hedge_after)
+            if not done:
+                self._event("hedged")
+                futures.append(_call_pool.submit(fn))
+        errors = []
+        while futures:
+            remaining = self.deadline - (time.monotonic() - start)
+            done, pending = wait(futures, timeout=max(0.0, remaining), return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f"quá {self.deadline:g}s")
+            for f in done:
+                if f.exception() is None:
+                    return f.result()
+                errors.append(f.exception())
+            futures = list(pending)
+        raise errors[0]
+
+    def call(self, fn, hedge: bool = True):
+        self._check_open()
+        for attempt in range(self.retries + 1):
+            try:
+                result = self._attempt(fn, hedge)
+                self.breaker.record_success()
+                self._event("ok")
+                return result
+            except Exception as e:
+                retryable = is_retryable(e)
+                self._event("timeout" if isinstance(e, TimeoutError) else "error")
+                if not retryable:
+                    raise
+                self.breaker.record_failure()
+                if attempt == self.retries or not self.breaker.allow():
+                    self._give_up(e)
+                self._event("retry")
+                time.sleep(self._backoff(attempt))
+
+    def stream(self, make_iter):
+        """
+        Stream có deadline tới phần tử đầu và giữa hai phần tử. Chỉ thử lại khi chưa nhận được
+        phần tử nào; lỗi giữa chừng được ném tiếp (phần đã gửi cho người dùng không lấy lại được).
+        """
+        self._check_open()
+        for attempt in range(self.retries + 1):
+            items = queue.Queue()
+
+            def pump():
+                try:
+                    for item in make_iter():
+                        items.put(("item", item))
+                    items.put(("end", None))
+                except Exception as e:
+                    items.put(("error", e))
+
+            threading.Thread(target=pump, name=f"{self.service}-stream", daemon=True).start()
+            started = False
+            try:
+                while True:
+                    try:
+                        kind, item = items.get(timeout=self.deadline)
+                    except queue.Empty:
+                        raise TimeoutError(f"quá {self.deadline:g}s không nhận được dữ liệu")
+                    if kind == "error":
+                        raise item
+                    if kind == "end":
+                        break
+                    started = True
+                    yield item
+                self.breaker.record_success()
+                self._event("ok")
+                return
+            except Exception as e:
+                self._event("timeout" if isinstance(e, TimeoutError) else "error")
+                if not is_retryable(e):
+                    raise
+                self.breaker.record_failure()
+                if started:
+                    self._give_up(e)
+                if attempt == self.retries or not self.breaker.allow():
+                    self._give_up(e)
+                self._event("retry")
+                time.sleep(self._backoff(attempt))
+
+    # ------------------------------
+    # Async
+    # ------------------------------
+    async def _aattempt(self, make_coro, hedge: bool):
+        start = time.monotonic()
+        tasks = [asyncio.ensure_future(make_coro())]
+        try:
+            if hedge and self.hedge_after is not None and self.hedge_after < self.deadline:
+                done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+                if not done:
+                    self._event("hedged")
+                    tasks.append(asyncio.ensure_future(make_coro()))
+            errors = []
+            pending = set(tasks)
+            while pending:
+                remaining = self.deadline - (time.monotonic() - start)
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, remaining),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise TimeoutError(f"quá {self.deadline:g}s")
+                for t in done:
+                    if t.exception() is None:
+                        return t.result()
+                    errors.append(t.exception())
+            raise errors[0]
+        finally:
+            for t in tasks:
+                if not t.done():
+                    t.cancel()
+
+    async def acall(self, make_coro, hedge: bool = True):
+        self._check_open()
+        for attempt in range(self.retries + 1):
+            try:
+                result = await self._aattempt(make_coro, hedge)
+                self.breaker.record_success()
+                self._event("ok")
+                return result
+            except Exception as e:
+                self._event("timeout" if isinstance(e, TimeoutError) else "error")
+                if not is_retryable(e):
+                    raise
+                self.breaker.record_failure()
+                if attempt == self.retries or not self.breaker.allow():
+                    self._give_up(e)
+                self._event("retry")
+                await asyncio.sleep(self._backoff(attempt))
+
+
+class ResilientChatModel:
+    """
+    Bọc ChatOpenAI: invoke / ainvoke / stream đi qua CallPolicy.
+    Các thuộc tính khác (model_name, ...) được lấy từ model gốc.
+    """
+
+    def __init__(self, llm, service: str = "llm", deadline: float = LLM_DEADLINE, hedge: bool = True):
+        self.llm = llm
+        self.hedge = hedge
+        self.policy = CallPolicy(service, deadline)
+
+    def invoke(self, prompt, **kwargs):
+        return self.policy.call(lambda: self.llm.invoke(prompt, **kwargs), hedge=self.hedge)
+
+    async def ainvoke(self, prompt, **kwargs):
+        return await self.policy.acall(lambda: self.llm.ainvoke(prompt, **kwargs), hedge=self.hedge)
+
+    def stream(self, prompt, **kwargs):
+        return self.policy.stream(lambda: self.llm.stream(prompt, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+
+class ResilientEmbeddings(Embeddings):
+    """Bọc OpenAIEmbeddings; chỉ embed câu hỏi (nằm trên đường trả lời) mới được hedge"""
+
+    def __init__(self, base: Embeddings, service: str = "embedding", deadline: float = EMBED_DEADLINE):
+        self.base = base
+        self.policy = CallPolicy(service, deadline)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.policy.call(lambda: self.base.embed_documents(texts), hedge=False)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.policy.call(lambda: self.base.embed_query(text))
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Batch câu hỏi do embed_batcher gom lại: vẫn nằm trên đường trả lời nên được hedge"""
+        return self.policy.call(lambda: self.base.embed_documents(texts))
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.policy.acall(lambda: self.base.aembed_documents(texts), hedge=False)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.policy.acall(lambda: self.base.aembed_query(text))
+
+
+# ==============================
+# Tạo client
+# ==============================
+def _endpoint(base_url, api_key) -> dict:
+    """Chỉ truyền base_url / api_key khi được cấu hình, để SDK vẫn đọc OPENAI_BASE_URL / OPENAI_API_KEY"""
+    return {k: v for k, v in (("base_url", base_url), ("api_key", api_key)) if v}
+
+
+def make_chat_model(temperature: float, max_tokens: Optional[int] = None, service: str = "llm",
+                    deadline: float = LLM_DEADLINE, hedge: bool = True, **kwargs) -> ResilientChatModel:
+    """ChatOpenAI (LLM_MODEL, LLM_BASE_URL) dùng pool HTTP chung; thử lại do CallPolicy đảm nhiệm"""
+    from langchain_openai import ChatOpenAI
+    from http_clients import get_http_client, get_async_http_client
+
+    llm = ChatOpenAI(
+        model=LLM_MODEL,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        timeout=deadline,   # request bị bỏ (hedge thua, quá hạn) cũng tự đóng
+        max_retries=0,
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
+        **_endpoint(LLM_BASE_URL, LLM_API_KEY),
+        **kwargs
+    )
+    return ResilientChatModel(llm, service=service, deadline=deadline, hedge=hedge)
+
+
+def make_embeddings(model_name: str, check_ctx_length: bool = True) -> ResilientEmbeddings:
+    from langchain_openai import OpenAIEmbeddings
+    from http_clients import get_http_client, get_async_http_client
+
+    base = OpenAIEmbeddings(
+        model=model_name,
+        check_embedding_ctx_length=check_ctx_length,
+        timeout=EMBED_DEADLINE,
+        max_retries=0,
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
+        **_endpoint(EMBED_BASE_URL, EMBED_API_KEY)
+    )
+    return ResilientEmbeddings(base)
@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import logging
+import threading
+from typing import Dict, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+REQUEST_LOG_ENABLED = os.getenv("REQUEST_LOG", "1") == "1"   # một dòng JSON cho mỗi request
+
+# Mốc histogram (giây): từ vài ms (FAQ, cache) tới vài chục giây (LLM, ingest file lớn)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = []
+_collectors = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple, object] = {}
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels) -> Tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Bộ đếm chỉ tăng"""
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self._header() + [f"{self.name}{_format_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Gauge(Counter):
+    """
+    Giá trị đặt trực tiếp. kind="counter" cho các tổng đã được module khác tự đếm
+    (vd: hits của cache embedding) và chỉ được chép vào lúc render.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames=(), kind: str = "gauge"):
+        super().__init__(name, help_text, labelnames)
+        self.kind = kind
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        with self._lock:
+            items = [(k, (list(v[0]), v[1], v[2])) for k, v in self._values.items()]
+        lines = self._header()
+        for key, (counts, total, n) in items:
+            for bound, c in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', bound)])} {c}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {n}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {round(total, 6)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {n}")
+        return lines
+
+
+def register_collector(callback):
+    """callback() được gọi ngay trước mỗi lần render, dùng để chép số liệu từ module khác vào Gauge"""
+    if callback not in _collectors:
+        _collectors.append(callback)
+
+
+def render() -> str:
+    """Toàn bộ số liệu ở định dạng text của Prometheus"""
+    for callback in list(_collectors):
+        try:
+            callback()
+        except Exception as e:
+            print(f"Lỗi khi thu thập metrics: {e}")
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for m in metrics:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+# ==============================
+# Các metric của ứng dụng
+# ==============================
+HTTP_REQUESTS = Counter("ptit_http_requests_total", "Số request HTTP", ["method", "route", "status"])
+HTTP_SECONDS = Histogram("ptit_http_request_duration_seconds", "Thời gian xử lý request HTTP", ["route"])
+
+ANSWERS = Counter("ptit_answers_total",
+                  "Số câu trả lời theo nguồn (faq, popular, cache, rag, lexical, extractive, partial, error)",
+                  ["source"])
+ANSWER_STAGE_SECONDS = Histogram("ptit_answer_stage_seconds",
+                                 "Thời gian từng bước khi trả lời (embed, faq, retrieve, generate, persist...)",
+                                 ["stage"])
+LLM_TOKENS = Counter("ptit_llm_tokens_total", "Số token LLM", ["kind"])
+CONTEXT_TOKENS = Counter("ptit_context_tokens_total",
+                         "Token phần context: sent (gửi đi) và saved (bớt được so với nối thẳng các đoạn)", ["kind"])
+
+INGEST_STAGE_SECONDS = Histogram("ptit_ingest_stage_seconds", "Thời gian từng bước nạp tài liệu", ["stage"])
+INGEST_FILES = Counter("ptit_ingest_files_total", "Số file được nạp theo kết quả", ["status"])
+INGEST_CHUNKS = Counter("ptit_ingest_chunks_total", "Số đoạn khi nạp tài liệu (added, removed, kept)", ["action"])
+
+LLM_IN_FLIGHT = Gauge("ptit_llm_in_flight", "Số lời gọi LLM async đang chạy")
+LLM_WAITING = Gauge("ptit_llm_waiting", "Số request async đang chờ tới lượt gọi LLM")
+UPSTREAM_EVENTS = Counter("ptit_upstream_events_total",
+                          "Lời gọi LLM/embedding: ok, error, timeout, retry, hedged, short_circuit",
+                          ["service", "event"])
+CIRCUIT_OPEN = Gauge("ptit_circuit_open", "1 khi đang ngắt mạch tới dịch vụ upstream", ["service"])
+CACHE_EVENTS = Gauge("ptit_cache_events_total", "Hit/miss của các cache (embedding, answer)",
+                     ["cache", "result"], kind="counter")
+
+
+def record_answer(result: dict, extra_timings: dict = None):
+    """Ghi nhận một lượt trả lời: nguồn, thời gian từng bước (ms -> giây) và số token"""
+    ANSWERS.inc(source=result.get("source", "unknown"))
+    timings = dict(result.get("timings") or {})
+    timings.update(extra_timings or {})
+    for stage, ms in timings.items():
+        ANSWER_STAGE_SECONDS.observe(ms / 1000, stage=stage)
+    for kind, n in (result.get("usage") or {}).items():
+        if n:
+            LLM_TOKENS.inc(n, kind=kind)
+    context = result.get("context") or {}
+    if context:
+        CONTEXT_TOKENS.inc(context.get("context_tokens", 0), kind="sent")
+        CONTEXT_TOKENS.inc(context.get("tokens_saved", 0), kind="saved")
+
+
+class StageClock:
+    """
+    Đo thời gian giữa các lần mark(stage) liên tiếp vào một Histogram:
+    mark("parsing") ... mark("embedding") ghi thời gian của bước "parsing".
+    """
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.stage = None
+        self.start = None
+
+    def mark(self, stage: str = None):
+        now = time.perf_counter()
+        if self.stage is not None:
+            self.histogram.observe(now - self.start, stage=self.stage)
+        self.stage, self.start = stage, now
+
+
+# ==============================
+# Log có cấu trúc cho mỗi request
+# ==============================
+request_logger = logging.getLogger("ptit.request")
+if not request_logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    request_logger.addHandler(_handler)
+    request_logger.setLevel(logging.INFO)
+    request_logger.propagate = False
+
+
+def log_request(**fields):
+    """Ghi một dòng JSON (event=request, path, status, duration_ms, source, timings, ...)"""
+    if not REQUEST_LOG_ENABLED:
+        return
+    fields.setdefault("ts", round(time.time(), 3))
+    request_logger.info(json.dumps({"event": "request", **fields}, ensure_ascii=False, default=str))
@@ -0,0 +1,156 @@
+import os
+import gzip
+import json
+import uuid
+import hashlib
+import threading
+from importlib import metadata
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PARSE_CACHE_ENABLED = os.getenv("PARSE_CACHE", "1") == "1"
+PARSE_CACHE_DIR = os.getenv("PARSE_CACHE_DIR", "./parse_cache")
+PARSE_CACHE_MAX_MB = float(os.getenv("PARSE_CACHE_MAX_MB", "200"))  # vượt quá thì xóa mục ít dùng nhất
+FORMAT_VERSION = 1
+# Metadata gắn theo đường dẫn / tên file: không lưu, đặt lại khi đọc từ cache
+_PATH_METADATA = ("source", "file_name", "chunk_id")
+
+_shared = None
+_shared_lock = threading.Lock()
+_loader_version = None
+_evict_lock = threading.Lock()
+
+
+def file_sha256(path, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def loader_version() -> str:
+    """Phiên bản unstructured + langchain: nâng cấp thư viện parse thì cache cũ tự mất hiệu lực"""
+    global _loader_version
+    if _loader_version is None:
+        parts = []
+        for package in ("unstructured", "langchain-community", "langchain-text-splitters"):
+            try:
+                parts.append(f"{package}={metadata.version(package)}")
+            except metadata.PackageNotFoundError:
+                parts.append(f"{package}=?")
+        _loader_version = ",".join(parts)
+    return _loader_version
+
+
+class ParseCache:
+    """
+    Cache kết quả đọc + chia đoạn tài liệu, key = sha256(nội dung file, phiên bản loader,
+    tham số splitter). Mỗi mục là một file gzip JSON (chỉ nội dung đoạn + metadata riêng của đoạn),
+    ghi bằng os.replace nên dùng chung được giữa các tiến trình parse / worker.
+    Tổng dung lượng vượt max_mb thì xóa các mục lâu không dùng nhất (theo mtime, được chạm khi đọc).
+    """
+
+    def __init__(self, directory: str = PARSE_CACHE_DIR, max_mb: float = PARSE_CACHE_MAX_MB):
+        self.directory = directory
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, content_hash: str, splitter_params: dict) -> str:
+        raw = json.dumps([FORMAT_VERSION, content_hash, loader_version(), splitter_params], sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json.gz")
+
+    def load(self, key: str, file_path: str):
+        """Danh sách Document (chưa có chunk_id) hoặc None nếu chưa có trong cache"""
+        from langchain_core.documents import Document
+
+        path = self._path(key)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)  # đánh dấu vừa dùng cho việc xóa theo LRU
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        file_name = os.path.basename(file_path)
+        return [Document(page_content=text, metadata={**meta, "source": file_path, "file_name": file_name})
+                for text, meta in entry["chunks"]]
+
+    def save(self, key: str, chunks):
+        entry = {
+            "v": FORMAT_VERSION,
+            "chunks": [[c.page_content, {k: v for k, v in c.metadata.items() if k not in _PATH_METADATA}]
+                       for c in chunks]
+        }
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = f"{self._path(key)}.{uuid.uuid4().hex[:8]}.tmp"
+            with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=6) as f:
+                json.dump(entry, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp, self._path(key))
+        except OSError as e:
+            print(f"[⚠️] Không ghi được parse cache: {e}")
+            return
+        self.evict()
+
+    def _entries(self):
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            if not name.endswith(".json.gz"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue  # tiến trình khác vừa xóa
+            entries.append((st.st_mtime, st.st_size, name))
+        return entries
+
+    def evict(self):
+        with _evict_lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def clear(self):
+        for _, _, name in self._entries():
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        return {
+            "enabled": PARSE_CACHE_ENABLED,
+            "entries": len(entries),
+            "size_mb": round(sum(size for _, size, _ in entries) / 1024 / 1024, 2),
+            "max_mb": round(self.max_bytes / 1024 / 1024, 2),
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+def get_parse_cache() -> ParseCache:
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = ParseCache()
+        return _shared
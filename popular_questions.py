@@ -0,0 +1,430 @@
+import os
+import json
+import atexit
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from typing import Optional, List
+
+import numpy as np
+from dotenv import load_dotenv
+
+from kb_version import get_kb_version
+
+load_dotenv()
+
+POPULAR_ENABLED = os.getenv("POPULAR_QUESTIONS", "1") == "1"
+POPULAR_FILE = os.getenv("POPULAR_FILE", "./popular_questions.json")   # cụm + câu trả lời; vector nằm ở file .npy cùng tên
+POPULAR_TOP_N = int(os.getenv("POPULAR_TOP_N", "30"))                  # số cụm được sinh sẵn câu trả lời
+POPULAR_MIN_COUNT = int(os.getenv("POPULAR_MIN_COUNT", "3"))           # cụm hỏi ít hơn thì bỏ qua
+POPULAR_CLUSTER_THRESHOLD = float(os.getenv("POPULAR_CLUSTER_THRESHOLD", "0.85"))  # cosine để gộp vào cụm
+POPULAR_MATCH_THRESHOLD = float(os.getenv("POPULAR_MATCH_THRESHOLD", "0.9"))       # cosine để trả lời ngay
+POPULAR_HISTORY_LIMIT = int(os.getenv("POPULAR_HISTORY_LIMIT", "20000"))  # số câu hỏi gần nhất được phân tích
+POPULAR_AUTO_REFRESH = os.getenv("POPULAR_AUTO_REFRESH", "1") == "1"   # sinh lại câu trả lời khi tri thức đổi
+# Bộ đếm lượt trả lời dùng chung giữa các worker (gunicorn); "" = mỗi tiến trình tự đếm
+POPULAR_STATS_DB = os.getenv("POPULAR_STATS_DB", "./popular_stats.sqlite3")
+STATS_FLUSH_SEC = 5  # gom số lượt trong RAM, tối đa mỗi 5 giây mới ghi SQLite một lần
+MAX_UNIQUE_QUESTIONS = 5000  # chỉ phân cụm các câu (đã chuẩn hóa) được hỏi nhiều nhất
+MAX_QUESTION_WORDS = 50
+EXAMPLES_PER_CLUSTER = 5
+EMBED_BATCH = 256
+FORMAT_VERSION = 1
+
+# Câu trả lời lỗi / "không có dữ liệu" không được sinh sẵn: để đường RAG thường xử lý
+_REJECT_PREFIXES = ("Lỗi", "Mình chưa có dữ liệu")
+_NO_DATA_MARKER = "Hiện tại tôi chưa có dữ liệu cụ thể"
+
+_shared = None
+_shared_lock = threading.Lock()
+_pipeline_provider = None
+
+
+def register_pipeline_provider(provider):
+    """provider() trả về QueryPipeline hiện tại của chatbot (dùng để sinh câu trả lời trong tiến trình đã có chatbot)"""
+    global _pipeline_provider
+    _pipeline_provider = provider
+
+
+def _current_pipeline():
+    if _pipeline_provider is not None:
+        return _pipeline_provider()
+    from rag_chatbot import RAGChatbot
+
+    return RAGChatbot().pipeline
+
+
+def _normalize_text(text: str) -> str:
+    return " ".join(text.lower().split()).rstrip("?.! ")
+
+
+def _acceptable(answer: Optional[str]) -> bool:
+    answer = (answer or "").strip()
+    return len(answer) >= 20 and not answer.startswith(_REJECT_PREFIXES) and _NO_DATA_MARKER not in answer
+
+
+def _normalize_rows(vectors) -> np.ndarray:
+    m = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return m / norms
+
+
+def cluster_questions(questions: List[str], embeddings, threshold: float = POPULAR_CLUSTER_THRESHOLD,
+                      max_unique: int = MAX_UNIQUE_QUESTIONS):
+    """
+    Gom câu hỏi theo nghĩa: đếm các câu giống hệt nhau (sau khi chuẩn hóa), embed mỗi câu một lần,
+    rồi duyệt theo tần suất giảm dần - câu gần tâm một cụm có sẵn (cosine >= threshold) thì vào cụm đó,
+    không thì mở cụm mới. Trả về (clusters, vectors): clusters sắp theo số lượt hỏi giảm dần,
+    mỗi cụm có "question" (cách hỏi phổ biến nhất), "count", "examples" và "rows" (chỉ số trong vectors).
+    """
+    counts, display, display_count = Counter(), {}, {}
+    for text, n in Counter((t or "").strip() for t in questions).items():
+        key = _normalize_text(text)
+        if len(key) < 3 or len(key.split()) > MAX_QUESTION_WORDS:
+            continue
+        counts[key] += n
+        if n > display_count.get(key, 0):  # hiển thị cách viết gặp nhiều nhất
+            display[key], display_count[key] = text, n
+    unique = [key for key, _ in counts.most_common(max_unique)]
+    if not unique:
+        return [], np.zeros((0, 0), dtype=np.float32)
+
+    texts = [display[key] for key in unique]
+    vectors = []
+    for start in range(0, len(texts), EMBED_BATCH):
+        vectors.extend(embeddings.embed_documents(texts[start:start + EMBED_BATCH]))
+    vectors = _normalize_rows(vectors)
+
+    centroids = np.zeros((len(unique), vectors.shape[1]), dtype=np.float32)  # tổng vector (có trọng số) của cụm
+    clusters = []
+    for row, key in enumerate(unique):
+        v = vectors[row]
+        best = -1
+        if clusters:
+            c = centroids[:len(clusters)]
+            scores = (c @ v) / np.maximum(np.linalg.norm(c, axis=1), 1e-12)
+            best = int(np.argmax(scores))
+            if scores[best] < threshold:
+                best = -1
+        if best < 0:
+            best = len(clusters)
+            clusters.append({"question": texts[row], "count": 0, "examples": [], "rows": []})
+        cluster = clusters[best]
+        cluster["count"] += counts[key]
+        cluster["rows"].append(row)
+        if len(cluster["examples"]) < EXAMPLES_PER_CLUSTER:
+            cluster["examples"].append(texts[row])
+        centroids[best] += v * counts[key]
+
+    clusters.sort(key=lambda c: c["count"], reverse=True)
+    return clusters, vectors
+
+
+class PopularQuestions:
+    """
+    Tầng trả lời sẵn cho các câu hỏi phổ biến, khai thác từ lịch sử hội thoại (SessionStore).
+    mine(): phân cụm câu hỏi cũ, xếp hạng theo số lượt hỏi rồi sinh sẵn câu trả lời cho top-N cụm
+    bằng pipeline RAG hiện tại; regenerate(): chỉ sinh lại câu trả lời (sau khi tri thức thay đổi).
+    Kết quả nằm trong POPULAR_FILE (JSON) + vector các cách hỏi của từng cụm (.npy), ghi bằng os.replace;
+    mọi worker tự nạp lại khi mtime của file JSON đổi.
+    lookup() chỉ trả lời khi câu trả lời được sinh trên đúng kb_version hiện tại.
+    Số lượt trả lời / trượt được cộng dồn vào SQLite (db_path) cho mọi worker, tính từ lần mine() gần nhất;
+    không có db_path thì chỉ là số của tiến trình hiện tại.
+    """
+
+    def __init__(self, path: str = POPULAR_FILE, threshold: float = POPULAR_MATCH_THRESHOLD,
+                 enabled: bool = POPULAR_ENABLED, db_path: Optional[str] = POPULAR_STATS_DB):
+        self.path = path
+        self.index_path = os.path.splitext(path)[0] + ".npy"
+        self.threshold = threshold
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._job_lock = threading.Lock()  # mine / regenerate chạy tuần tự
+        self._mtime = None
+        self.data = {}
+        self._matrix = None   # vector đã chuẩn hóa của các cách hỏi
+        self._rows = None     # chỉ số cụm của từng dòng trong _matrix
+        self._stats_lock = threading.Lock()
+        self._pending = Counter()   # "hits", "misses", "cluster:<id>" chưa ghi vào SQLite
+        self._flushed = time.monotonic()
+
+        self._db = None
+        if db_path and enabled:
+            self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self._db.commit()
+            atexit.register(self.flush_counters)  # số lượt còn gom trong RAM khi worker dừng
+
+    # ------------------------------
+    # Nạp dữ liệu đã khai thác
+    # ------------------------------
+    def _reload_if_changed(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            # Lỗi thì giữ dữ liệu cũ; JSON luôn được ghi sau .npy nên lần ghi kế tiếp sẽ nạp lại
+            self._mtime = mtime
+            data, matrix, rows = {}, None, None
+            if mtime is not None:
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                    matrix = np.load(self.index_path)
+                    rows = np.asarray(data.get("rows", []), dtype=np.int32)
+                except (OSError, ValueError) as e:
+                    print(f"[⚠️] Không đọc được dữ liệu câu hỏi phổ biến: {e}")
+                    return
+                if data.get("version") != FORMAT_VERSION or len(rows) != len(matrix):
+                    print("[⚠️] Dữ liệu câu hỏi phổ biến không khớp phiên bản / số vector, bỏ qua")
+                    return
+            self.data, self._matrix, self._rows = data, matrix, rows
+
+    # ------------------------------
+    # Bộ đếm dùng chung
+    # ------------------------------
+    def _count(self, *names: str):
+        with self._stats_lock:
+            self._pending.update(names)
+            if self._db is not None and time.monotonic() - self._flushed >= STATS_FLUSH_SEC:
+                self._flush_counters()
+
+    def _flush_counters(self):
+        """Cộng số lượt đang gom vào SQLite (gọi khi giữ _stats_lock); lỗi thì giữ lại để lần sau ghi tiếp"""
+        self._flushed = time.monotonic()
+        if not self._pending:
+            return
+        try:
+            self._db.executemany(
+                "INSERT INTO counters (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", list(self._pending.items()))
+            self._db.commit()
+            self._pending.clear()
+        except sqlite3.Error as e:
+            self._db.rollback()
+            print(f"[⚠️] Không ghi được bộ đếm câu hỏi phổ biến: {e}")
+
+    def flush_counters(self):
+        with self._stats_lock:
+            if self._db is not None:
+                self._flush_counters()
+
+    def _counters(self) -> Counter:
+        with self._stats_lock:
+            if self._db is None:
+                return Counter(self._pending)
+            self._flush_counters()
+            try:
+                return Counter(dict(self._db.execute("SELECT name, value FROM counters").fetchall()))
+            except sqlite3.Error as e:
+                print(f"[⚠️] Không đọc được bộ đếm câu hỏi phổ biến: {e}")
+                return Counter(self._pending)
+
+    def _reset_counters(self):
+        """Cụm mới sau mine(): đếm lại từ đầu"""
+        with self._stats_lock:
+            self._pending.clear()
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM counters")
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    self._db.rollback()
+                    print(f"[⚠️] Không xóa được bộ đếm câu hỏi phổ biến: {e}")
+
+    @property
+    def clusters(self) -> List[dict]:
+        self._reload_if_changed()
+        return self.data.get("clusters", [])
+
+    # ------------------------------
+    # Tra cứu (đường trả lời)
+    # ------------------------------
+    def lookup(self, qvec, kb_version: int) -> Optional[str]:
+        if not self.enabled:
+            return None
+        self._reload_if_changed()
+        matrix, rows, data = self._matrix, self._rows, self.data
+        if matrix is None or not len(matrix) or data.get("kb_version") != kb_version:
+            self._count("misses")
+            return None
+        q = np.asarray(qvec, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if not norm or q.shape[0] != matrix.shape[1]:
+            self._count("misses")
+            return None
+        scores = matrix @ (q / norm)
+        best = int(np.argmax(scores))
+        cluster = data["clusters"][int(rows[best])]
+        if scores[best] >= self.threshold and cluster.get("answer"):
+            self._count("hits", f"cluster:{cluster['id']}")
+            return cluster["answer"]
+        self._count("misses")
+        return None
+
+    # ------------------------------
+    # Khai thác & sinh câu trả lời (job nền / CLI)
+    # ------------------------------
+    def mine(self, store=None, embeddings=None, pipeline=None, top_n: int = POPULAR_TOP_N,
+             min_count: int = POPULAR_MIN_COUNT, limit: int = POPULAR_HISTORY_LIMIT) -> dict:
+        """Phân cụm lịch sử câu hỏi, giữ top_n cụm có ít nhất min_count lượt hỏi rồi sinh sẵn câu trả lời"""
+        from session_store import SessionStore
+        from embedding_cache import get_embeddings
+        from conversation import is_self_contained
+
+        start = time.perf_counter()
+        with self._job_lock:
+            store = store or SessionStore()
+            embeddings = embeddings or get_embeddings()
+            # Câu nối tiếp / chào hỏi ("còn ngành đó thì sao?", "xin chào") không có nghĩa khi đứng một mình:
+            # sinh sẵn câu trả lời cho chúng sẽ trả lời sai ngữ cảnh
+            questions = [q for q in store.user_questions(limit) if is_self_contained(q)]
+            clusters, vectors = cluster_questions(questions, embeddings)
+            top = [c for c in clusters if c["count"] >= min_count][:top_n]
+
+            # Chỉ giữ vector các cách hỏi thuộc cụm được chọn
+            kept_rows, row_cluster = [], []
+            for i, c in enumerate(top):
+                c["id"] = hashlib.sha1(_normalize_text(c["question"]).encode("utf-8")).hexdigest()[:12]
+                c["rep_row"] = len(kept_rows)
+                rows = c.pop("rows")
+                kept_rows.extend(rows)
+                row_cluster.extend([i] * len(rows))
+            matrix = vectors[kept_rows] if kept_rows else np.zeros((0, vectors.shape[1] if vectors.size else 0),
+                                                                    dtype=np.float32)
+            data = {
+                "version": FORMAT_VERSION,
+                "mined_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "questions_mined": sum(c["count"] for c in clusters),
+                "clusters_found": len(clusters),
+                "clusters": top,
+                "rows": row_cluster
+            }
+            self._answer(data, matrix, pipeline or _current_pipeline())
+            self._write(data, matrix)
+            self._reset_counters()
+        return self._summary(data, start)
+
+    def regenerate(self, pipeline=None) -> Optional[dict]:
+        """Sinh lại câu trả lời của các cụm đã khai thác trên tri thức hiện tại. None nếu chưa khai thác lần nào"""
+        start = time.perf_counter()
+        with self._job_lock:
+            self._reload_if_changed()
+            if not self.data.get("clusters"):
+                return None
+            data = json.loads(json.dumps(self.data))  # bản sao: lookup vẫn dùng bản cũ trong lúc sinh
+            self._answer(data, self._matrix, pipeline or _current_pipeline())
+            self._write(data, None)
+        return self._summary(data, start)
+
+    @staticmethod
+    def _answer(data: dict, matrix, pipeline):
+        """Điền "answer" / "served_by" cho từng cụm; gắn kb_version lúc bắt đầu sinh"""
+        kb_version = get_kb_version()
+        for c in data["clusters"]:
+            qvec = matrix[c["rep_row"]]
+            c["answer"] = None
+            if pipeline.faq is not None and pipeline.faq.match_vector(qvec):
+                c["served_by"] = "faq"  # FAQ đã trả lời ngay, không cần sinh
+                continue
+            try:
+                answer = pipeline.precompute(c["question"], qvec)
+            except Exception as e:
+                print(f"[⚠️] Không sinh được câu trả lời cho '{c['question']}': {e}")
+                answer = None
+            if _acceptable(answer):
+                c["answer"], c["served_by"] = answer, "popular"
+            else:
+                c["served_by"] = "rag"
+        data["kb_version"] = kb_version
+        data["answered_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+
+    def _write(self, data: dict, matrix):
+        """Ghi .npy trước, JSON sau (JSON đổi mtime là tín hiệu cho các worker nạp lại)"""
+        if matrix is not None:
+            tmp = self.index_path + ".tmp.npy"
+            np.save(tmp, np.asarray(matrix, dtype=np.float32))
+            os.replace(tmp, self.index_path)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+
+    @staticmethod
+    def _summary(data: dict, start: float) -> dict:
+        clusters = data["clusters"]
+        return {
+            "questions_mined": data.get("questions_mined", 0),
+            "clusters": len(clusters),
+            "answered": sum(1 for c in clusters if c.get("answer")),
+            "faq": sum(1 for c in clusters if c.get("served_by") == "faq"),
+            "kb_version": data.get("kb_version"),
+            "duration_sec": round(time.perf_counter() - start, 2)
+        }
+
+    def stats(self) -> dict:
+        clusters = self.clusters
+        counters = self._counters()
+        hits, total = counters["hits"], counters["hits"] + counters["misses"]
+        mined = self.data.get("questions_mined") or 0
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "mined_at": self.data.get("mined_at"),
+            "answered_at": self.data.get("answered_at"),
+            "kb_version": self.data.get("kb_version"),
+            "current": bool(clusters) and self.data.get("kb_version") == get_kb_version(),
+            "questions_mined": mined,
+            "clusters_found": self.data.get("clusters_found", 0),
+            "shared": self._db is not None,
+            "hits": hits,
+            "misses": counters["misses"],
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "clusters": [{
+                "id": c["id"],
+                "question": c["question"],
+                "count": c["count"],
+                "share": round(c["count"] / mined, 4) if mined else 0.0,
+                "examples": c["examples"],
+                "served_by": c.get("served_by"),
+                "hits": counters[f"cluster:{c['id']}"]
+            } for c in clusters]
+        }
+
+
+def get_popular_questions() -> PopularQuestions:
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = PopularQuestions()
+        return _shared
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Khai thác câu hỏi phổ biến từ lịch sử hội thoại và sinh sẵn câu trả lời")
+    parser.add_argument("--top", type=int, default=POPULAR_TOP_N, help="Số cụm được sinh sẵn câu trả lời")
+    parser.add_argument("--min-count", type=int, default=POPULAR_MIN_COUNT)
+    parser.add_argument("--regenerate", action="store_true",
+                        help="Chỉ sinh lại câu trả lời cho các cụm đã có (sau khi cập nhật tri thức)")
+    args = parser.parse_args()
+
+    popular = get_popular_questions()
+    if args.regenerate:
+        result = popular.regenerate()
+        if result is None:
+            print("Chưa khai thác câu hỏi phổ biến lần nào.")
+    else:
+        result = popular.mine(top_n=args.top, min_count=args.min_count)
+    if result is not None:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        for c in popular.stats()["clusters"]:
+            print(f"{c['count']:>6}  {c['served_by'] or '-':<8} {c['question']}")
@@ -0,0 +1,95 @@
+import os
+import threading
+
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:  # Windows: không có gunicorn, luôn chạy một tiến trình
+    fcntl = None
+
+load_dotenv()
+
+# Bật khi chạy nhiều worker (gunicorn.conf.py tự bật): chỉ một tiến trình được ghi tri thức
+WRITER_ELECTION = os.getenv("WRITER_ELECTION", "0") == "1"
+WRITER_LOCK_FILE = os.getenv("WRITER_LOCK_FILE", "./ingest_writer.lock")
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+class WriterRole:
+    """
+    Bầu chọn tiến trình ghi duy nhất (single writer) giữa các worker bằng flock trên WRITER_LOCK_FILE.
+    Mỗi worker có một thread chờ khóa; worker giữ khóa chạy hàng đợi ingest và đồng bộ thư mục.
+    Worker đó chết thì hệ điều hành nhả khóa và một worker khác lên thay.
+    Không bật WRITER_ELECTION (flask run, uvicorn một tiến trình) -> tiến trình hiện tại là writer.
+    """
+
+    def __init__(self, lock_path: str = WRITER_LOCK_FILE, election: bool = WRITER_ELECTION):
+        self.lock_path = lock_path
+        self.election = election and fcntl is not None
+        self._elected = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._fd = None
+        self._started = False
+
+    @property
+    def is_writer(self) -> bool:
+        return self._elected.is_set()
+
+    def on_elected(self, callback):
+        """callback() chạy một lần khi tiến trình này trở thành writer (ngay lập tức nếu đã là writer)"""
+        with self._lock:
+            if not self._elected.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return self
+            self._started = True
+        if not self.election:
+            self._become_writer()
+        else:
+            threading.Thread(target=self._wait_for_lock, name="writer-election", daemon=True).start()
+        return self
+
+    def _wait_for_lock(self):
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)   # chặn tới khi writer hiện tại thoát
+        except OSError as e:
+            print(f"[⚠️] Không khóa được {self.lock_path}: {e}")
+            os.close(fd)
+            return
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd  # giữ fd mở suốt vòng đời tiến trình
+        self._become_writer()
+
+    def _become_writer(self):
+        with self._lock:
+            self._elected.set()
+            callbacks, self._callbacks = self._callbacks, []
+        if self.election:
+            print(f"[✍️] Tiến trình {os.getpid()} là writer (ingest, đồng bộ tri thức)")
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"[⚠️] Lỗi khi khởi động vai trò writer: {e}")
+
+    def stats(self) -> dict:
+        return {"pid": os.getpid(), "writer": self.is_writer, "election": self.election}
+
+
+def get_writer_role() -> WriterRole:
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = WriterRole()
+        return _shared
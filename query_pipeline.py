@@ -0,0 +1,389 @@
+import os
+import re
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Tuple
+
+from dotenv import load_dotenv
+
+from kb_version import get_kb_version
+from lexical_index import reciprocal_rank_fusion, tokenize
+from llm_clients import UpstreamUnavailableError
+
+load_dotenv()
+
+# Quá thời gian này mà API embedding chưa trả về -> trả lời bằng BM25 (0 = chờ mãi)
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT", "3"))
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "10"))  # số ứng viên lấy từ mỗi nguồn trước khi gộp
+
+EXTRACTIVE_SENTENCES = 4  # số câu trích khi LLM không dùng được
+EXTRACTIVE_NOTICE = ("Hệ thống sinh câu trả lời đang gián đoạn, dưới đây là các đoạn liên quan nhất "
+                     "trong tài liệu của PTIT:")
+PARTIAL_NOTICE = "\n\n(Câu trả lời bị gián đoạn, bạn vui lòng hỏi lại sau ít phút để có câu trả lời đầy đủ.)"
+
+_embed_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="embed")
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?;:])\s+|\n+")
+
+
+def _add_usage(usage: dict, message):
+    """Cộng số token của một message/chunk LLM (usage_metadata của langchain) vào usage"""
+    meta = getattr(message, "usage_metadata", None) or {}
+    for kind in ("input_tokens", "output_tokens"):
+        if meta.get(kind):
+            usage[kind] = usage.get(kind, 0) + meta[kind]
+
+
+def extractive_answer(question: str, docs, max_sentences: int = EXTRACTIVE_SENTENCES) -> str:
+    """
+    Câu trả lời dự phòng không cần LLM: các câu trùng nhiều từ với câu hỏi nhất
+    trong những đoạn được tìm thấy, giữ thứ tự xuất hiện, kèm tên file nguồn.
+    """
+    terms = set(tokenize(question))
+    candidates = []
+    for rank, doc in enumerate(docs):
+        for pos, sentence in enumerate(_SENTENCE_SPLIT.split(doc.page_content)):
+            sentence = " ".join(sentence.split())
+            if len(sentence) < 20:
+                continue
+            overlap = len(terms & set(tokenize(sentence)))
+            if overlap:
+                candidates.append((overlap, -rank, (rank, pos), sentence, doc.metadata.get("file_name")))
+    if not candidates:
+        if not docs:
+            return ""
+        top = " ".join(docs[0].page_content.split())[:400]
+        candidates = [(0, 0, (0, 0), top, docs[0].metadata.get("file_name"))]
+    best = sorted(candidates, key=lambda c: (c[0], c[1]), reverse=True)[:max_sentences]
+    lines = [f"- {sentence}" + (f" ({file_name})" if file_name else "")
+             for _, _, _, sentence, file_name in sorted(best, key=lambda c: c[2])]
+    return EXTRACTIVE_NOTICE + "\n" + "\n".join(lines)
+
+
+class _StageTimer:
+    """Đo thời gian (ms) của từng bước trong pipeline"""
+
+    def __init__(self, timings: dict, name: str):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings[self.name] = round((time.perf_counter() - self.start) * 1000, 2)
+        return False
+
+
+class QueryPipeline:
+    """
+    Pipeline trả lời một câu hỏi với đúng MỘT lần embedding:
+    embed câu hỏi -> so khớp FAQ -> câu hỏi phổ biến (sinh sẵn) -> cache câu trả lời
+    -> tìm kiếm Chroma bằng vector -> gọi LLM.
+    Có lexical_index thì kết quả Chroma được gộp với BM25 (reciprocal-rank fusion);
+    embedding lỗi hoặc quá EMBED_TIMEOUT -> chỉ dùng BM25 (source "lexical").
+    LLM không dùng được (UpstreamUnavailableError) -> trích các câu liên quan từ tài liệu
+    (source "extractive"); stream bị ngắt giữa chừng -> giữ phần đã gửi (source "partial").
+    Có rewriter và history thì câu hỏi nối tiếp được viết lại thành câu hỏi độc lập trước khi embed
+    (bước "rewrite"); mọi bước sau, kể cả FAQ và cache, dùng câu hỏi đã viết lại. Viết lại lỗi thì
+    FAQ / cache dùng câu hỏi gốc, chỉ tìm kiếm + sinh câu trả lời dùng câu hỏi ghép với câu hỏi trước
+    (embed thêm một lần, câu trả lời không vào cache).
+    """
+
+    def __init__(self, embeddings, vector_store, llm, prompt, faq_service=None,
+                 answer_cache=None, llm_limiter=None, k: int = 4, lexical_index=None,
+                 fetch_k: int = HYBRID_FETCH_K, embed_timeout: float = EMBED_TIMEOUT,
+                 context_builder=None, rewriter=None, popular=None):
+        self.embeddings = embeddings
+        self.vector_store = vector_store
+        self.llm = llm
+        self.prompt = prompt
+        self.faq = faq_service
+        self.answer_cache = answer_cache
+        self.llm_limiter = llm_limiter  # chỉ dùng cho đường async (arun)
+        self.k = k
+        self.lexical = lexical_index
+        self.fetch_k = max(fetch_k, k)
+        self.embed_timeout = embed_timeout
+        self.context_builder = context_builder  # None -> nối thẳng các đoạn như chain_type="stuff"
+        self.rewriter = rewriter
+        self.popular = popular  # PopularQuestions: câu trả lời sinh sẵn cho các cụm câu hỏi phổ biến
+
+    def embed(self, question: str) -> List[float]:
+        return self.embeddings.embed_query(question)
+
+    def _embed_or_none(self, question: str) -> Optional[List[float]]:
+        """Embed câu hỏi; trả về None (chế độ dự phòng BM25) nếu lỗi hoặc quá hạn"""
+        if self.lexical is None:
+            return self.embed(question)
+        try:
+            if self.embed_timeout > 0:
+                return _embed_pool.submit(self.embed, question).result(timeout=self.embed_timeout)
+            return self.embed(question)
+        except Exception as e:
+            print(f"[⚠️] Embedding lỗi/chậm, dùng BM25: {e!r}")
+            return None
+
+    def retrieve(self, query_vector: Optional[List[float]], question: Optional[str] = None):
+        if query_vector is None:
+            return self.lexical.search(question, k=self.k)
+        if self.lexical is None or question is None:
+            return self.vector_store.similarity_search_by_vector(query_vector, k=self.k)
+        dense = self.vector_store.similarity_search_by_vector(query_vector, k=self.fetch_k)
+        sparse = self.lexical.search(question, k=self.fetch_k)
+        return reciprocal_rank_fusion([dense, sparse], k=self.k)
+
+    def build_prompt(self, question: str, docs, query_vector=None, context_stats: Optional[dict] = None) -> str:
+        if self.context_builder is None:
+            # Giống chain_type="stuff": nối nội dung các đoạn bằng dòng trống
+            context = "\n\n".join(d.page_content for d in docs)
+        else:
+            context, stats = self.context_builder.build(docs, query_vector)
+            if context_stats is not None:
+                context_stats.update(stats)
+        return self.prompt.format(context=context, question=question)
+
+    def complete(self, prompt: str, usage: Optional[dict] = None) -> str:
+        message = self.llm.invoke(prompt)
+        if usage is not None:
+            _add_usage(usage, message)
+        return getattr(message, "content", str(message)).strip()
+
+    def generate(self, question: str, docs, usage: Optional[dict] = None) -> str:
+        return self.complete(self.build_prompt(question, docs), usage)
+
+    def precompute(self, question: str, query_vector) -> Optional[str]:
+        """Sinh câu trả lời mới, bỏ qua FAQ / các cache (cho popular_questions). None nếu LLM không dùng được"""
+        docs = self.retrieve(query_vector, question)
+        try:
+            return self.complete(self.build_prompt(question, docs, query_vector))
+        except UpstreamUnavailableError as e:
+            print(f"[⚠️] LLM không dùng được, bỏ qua sinh sẵn '{question}': {e}")
+            return None
+
+    @staticmethod
+    def _extractive(query: str, docs, error) -> str:
+        print(f"[⚠️] LLM không dùng được, trả lời bằng trích đoạn: {error}")
+        return extractive_answer(query, docs)
+
+    def _standalone(self, question: str, history: Optional[dict], timings: dict) -> Tuple[str, str]:
+        """(query, search): khóa tra FAQ / cache và câu dùng để tìm tài liệu (xem QueryRewriter)"""
+        if self.rewriter is None or not history:
+            return question, question
+        with _StageTimer(timings, "rewrite"):
+            return self.rewriter.rewrite(question, history)
+
+    def _search_vector(self, query: str, search: str, qvec, timings: dict):
+        """Vector cho bước tìm kiếm: câu tìm kiếm khác khóa tra cứu thì embed riêng"""
+        if search == query or qvec is None:
+            return qvec
+        with _StageTimer(timings, "embed_search"):
+            return self._embed_or_none(search)
+
+    @staticmethod
+    def _result(question, query, answer, source, timings, usage, context) -> dict:
+        result = {"answer": answer, "source": source, "timings": timings, "usage": usage, "context": context}
+        if query != question:
+            result["query"] = query
+        return result
+
+    def _fast_path(self, question: str, timings: dict, kb_version: int):
+        """Embed + FAQ + câu hỏi phổ biến + cache câu trả lời. Trả về (qvec, answer, source)"""
+        with _StageTimer(timings, "embed"):
+            qvec = self._embed_or_none(question)
+        if qvec is None:
+            return None, None, "lexical"
+
+        if self.faq is not None:
+            with _StageTimer(timings, "faq"):
+                answer = self.faq.check(question, query_vector=qvec)
+            if answer:
+                return qvec, answer, "faq"
+
+        if self.popular is not None:
+            with _StageTimer(timings, "popular"):
+                answer = self.popular.lookup(qvec, kb_version)
+            if answer:
+                return qvec, answer, "popular"
+
+        if self.answer_cache is not None:
+            with _StageTimer(timings, "answer_cache"):
+                answer = self.answer_cache.lookup(qvec, kb_version)
+            if answer:
+                return qvec, answer, "cache"
+
+        return qvec, None, "rag"
+
+    def run(self, question: str, history: Optional[dict] = None) -> dict:
+        """
+        Trả về dict gồm answer, source ("faq" | "popular" | "cache" | "rag" | "lexical" | "extractive"),
+        timings (ms) của từng bước, usage (số token LLM), context (token gửi đi / tiết kiệm)
+        và query (câu hỏi đã viết lại, chỉ có khi khác câu hỏi gốc).
+        history: {"summary", "messages"} của ConversationMemory.load()
+        """
+        timings, usage, context = {}, {}, {}
+        total_start = time.perf_counter()
+        kb_version = get_kb_version()
+
+        query, search = self._standalone(question, history, timings)
+        qvec, answer, source = self._fast_path(query, timings, kb_version)
+        if not answer:
+            svec = self._search_vector(query, search, qvec, timings)
+            with _StageTimer(timings, "retrieve"):
+                docs = self.retrieve(svec, search)
+            with _StageTimer(timings, "context"):
+                prompt = self.build_prompt(search, docs, svec, context)
+            with _StageTimer(timings, "generate"):
+                try:
+                    answer = self.complete(prompt, usage)
+                except UpstreamUnavailableError as e:
+                    answer, source = self._extractive(search, docs, e), "extractive"
+            if self.answer_cache is not None and source == "rag" and search == query:
+                self.answer_cache.admit(query, qvec, answer, kb_version)
+
+        timings["total"] = round((time.perf_counter() - total_start) * 1000, 2)
+        return self._result(question, query, answer, source, timings, usage, context)
+
+    def stream(self, question: str, history: Optional[dict] = None):
+        """
+        Như run() nhưng trả về generator các sự kiện:
+        {"type": "token", "text": ...} cho từng phần câu trả lời (FAQ/cache gửi một lần),
+        cuối cùng {"type": "done", "answer", "source", "timings", "usage", "context"[, "query"]}.
+        """
+        timings, usage, context = {}, {}, {}
+        total_start = time.perf_counter()
+        kb_version = get_kb_version()
+
+        query, search = self._standalone(question, history, timings)
+        qvec, answer, source = self._fast_path(query, timings, kb_version)
+        if answer:
+            yield {"type": "token", "text": answer}
+        else:
+            svec = self._search_vector(query, search, qvec, timings)
+            with _StageTimer(timings, "retrieve"):
+                docs = self.retrieve(svec, search)
+            with _StageTimer(timings, "context"):
+                prompt = self.build_prompt(search, docs, svec, context)
+            parts = []
+            gen_start = time.perf_counter()
+            try:
+                for chunk in self.llm.stream(prompt):
+                    _add_usage(usage, chunk)
+                    text = getattr(chunk, "content", str(chunk))
+                    if not text:
+                        continue
+                    if not parts:
+                        timings["first_token"] = round((time.perf_counter() - total_start) * 1000, 2)
+                    parts.append(text)
+                    yield {"type": "token", "text": text}
+            except UpstreamUnavailableError as e:
+                if parts:
+                    print(f"[⚠️] Stream LLM bị ngắt giữa chừng: {e}")
+                    parts.append(PARTIAL_NOTICE)
+                    source = "partial"
+                else:
+                    parts.append(self._extractive(search, docs, e))
+                    source = "extractive"
+                if parts[-1]:
+                    yield {"type": "token", "text": parts[-1]}
+            timings["generate"] = round((time.perf_counter() - gen_start) * 1000, 2)
+            answer = "".join(parts).strip()
+            if self.answer_cache is not None and source == "rag" and search == query:
+                self.answer_cache.admit(query, qvec, answer, kb_version)
+
+        timings["total"] = round((time.perf_counter() - total_start) * 1000, 2)
+        yield {"type": "done", **self._result(question, query, answer, source, timings, usage, context)}
+
+    # ------------------------------
+    # Đường async (ASGI): aembed_query / ainvoke, giới hạn số lời gọi LLM đồng thời
+    # ------------------------------
+    async def _aembed_or_none(self, question: str) -> Optional[List[float]]:
+        if self.lexical is None:
+            return await self.embeddings.aembed_query(question)
+        try:
+            return await asyncio.wait_for(self.embeddings.aembed_query(question),
+                                          timeout=self.embed_timeout or None)
+        except Exception as e:
+            print(f"[⚠️] Embedding lỗi/chậm, dùng BM25: {e!r}")
+            return None
+
+    async def aretrieve(self, query_vector: Optional[List[float]], question: str):
+        if query_vector is None:
+            return await asyncio.to_thread(self.lexical.search, question, self.k)
+        if self.lexical is None:
+            return await self.vector_store.asimilarity_search_by_vector(query_vector, k=self.k)
+        dense, sparse = await asyncio.gather(
+            self.vector_store.asimilarity_search_by_vector(query_vector, k=self.fetch_k),
+            asyncio.to_thread(self.lexical.search, question, self.fetch_k)
+        )
+        return reciprocal_rank_fusion([dense, sparse], k=self.k)
+
+    async def _afast_path(self, question: str, timings: dict, kb_version: int):
+        with _StageTimer(timings, "embed"):
+            qvec = await self._aembed_or_none(question)
+        if qvec is None:
+            return None, None, "lexical"
+
+        if self.faq is not None:
+            with _StageTimer(timings, "faq"):
+                answer = await self.faq.acheck(question, query_vector=qvec)
+            if answer:
+                return qvec, answer, "faq"
+
+        if self.popular is not None:
+            with _StageTimer(timings, "popular"):
+                answer = self.popular.lookup(qvec, kb_version)
+            if answer:
+                return qvec, answer, "popular"
+
+        if self.answer_cache is not None:
+            with _StageTimer(timings, "answer_cache"):
+                answer = self.answer_cache.lookup(qvec, kb_version)
+            if answer:
+                return qvec, answer, "cache"
+
+        return qvec, None, "rag"
+
+    async def acomplete(self, prompt: str, usage: Optional[dict] = None) -> str:
+        if self.llm_limiter is None:
+            message = await self.llm.ainvoke(prompt)
+        else:
+            async with self.llm_limiter:
+                message = await self.llm.ainvoke(prompt)
+        if usage is not None:
+            _add_usage(usage, message)
+        return getattr(message, "content", str(message)).strip()
+
+    async def agenerate(self, question: str, docs, usage: Optional[dict] = None) -> str:
+        return await self.acomplete(self.build_prompt(question, docs), usage)
+
+    async def arun(self, question: str, history: Optional[dict] = None) -> dict:
+        timings, usage, context = {}, {}, {}
+        total_start = time.perf_counter()
+        kb_version = get_kb_version()
+
+        query = search = question
+        if self.rewriter is not None and history:
+            with _StageTimer(timings, "rewrite"):
+                query, search = await self.rewriter.arewrite(question, history, self.llm_limiter)
+        qvec, answer, source = await self._afast_path(query, timings, kb_version)
+        if not answer:
+            svec = qvec
+            if search != query and qvec is not None:
+                with _StageTimer(timings, "embed_search"):
+                    svec = await self._aembed_or_none(search)
+            with _StageTimer(timings, "retrieve"):
+                docs = await self.aretrieve(svec, search)
+            with _StageTimer(timings, "context"):
+                prompt = await asyncio.to_thread(self.build_prompt, search, docs, svec, context)
+            with _StageTimer(timings, "generate"):
+                try:
+                    answer = await self.acomplete(prompt, usage)
+                except UpstreamUnavailableError as e:
+                    answer, source = self._extractive(search, docs, e), "extractive"
+            if self.answer_cache is not None and source == "rag" and search == query:
+                self.answer_cache.admit(query, qvec, answer, kb_version)
+
+        timings["total"] = round((time.perf_counter() - total_start) * 1000, 2)
+        return self._result(question, query, answer, source, timings, usage, context)
@@ -1,10 +1,19 @@
 import os
+import time
+import threading
 from dotenv import load_dotenv
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from embedding_cache import get_embeddings
+from answer_cache import get_answer_cache
+from concurrency import get_llm_limiter, QueueFullError
+from llm_clients import make_chat_model
 from langchain.prompts import PromptTemplate
-from langchain.chains import RetrievalQA
 from faq_service import FAQService
+from query_pipeline import QueryPipeline
+from lexical_index import get_lexical_index, HYBRID_ENABLED
+from context_builder import ContextBuilder
+from conversation import QueryRewriter
+from rag_system import get_retriever, register_reload_callback
+from popular_questions import get_popular_questions, register_pipeline_provider
 
 load_dotenv()
 
@@ -12,24 +21,11 @@ EMBEDDING_MODEL = "text-embedding-3-small"
 CHROMA_DB_PATH = "./knowledge_base_ptit"
 os.makedirs(CHROMA_DB_PATH, exist_ok=True)
 
+# Trả cho người dùng khi truy vấn lỗi; chi tiết lỗi chỉ ghi vào log
+ERROR_MESSAGE = "Lỗi hệ thống: chưa trả lời được câu hỏi này, bạn vui lòng thử lại sau ít phút."
 
-class RAGChatbot:
-    def __init__(self):
-        self.embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL)
-        self.vector_store = Chroma(
-            persist_directory=CHROMA_DB_PATH,
-            embedding_function=self.embeddings
-        )
-
-        self.llm = ChatOpenAI(
-            model="gpt-4.1-nano",
-            temperature=0.3
-        )
-
-        self.retriever = self.vector_store.as_retriever(search_kwargs={"k": 4})
-
-        # Prompt cho RAG
-        template = """
+# Prompt cho RAG (parse một lần cho cả tiến trình)
+PROMPT_TEMPLATE = """
         Bạn là trợ lý ảo của Học viện Công nghệ Bưu chính Viễn thông (PTIT).
         Bạn sẽ nhận được dữ liệu ngữ cảnh (context) từ một hệ thống Retrieval-Augmented Generation (RAG) chứa các thông tin chính xác về trường.
         Nguyên tắc trả lời bắt buộc:
@@ -58,45 +54,126 @@ class RAGChatbot:
             -Giọng điệu thân thiện, rõ ràng, lịch sự..
         """
 
-        prompt = PromptTemplate(
-            input_variables=["context", "question"],
-            template=template
-        )
+PROMPT = PromptTemplate(
+    input_variables=["context", "question"],
+    template=PROMPT_TEMPLATE
+)
 
-        self.qa_chain = RetrievalQA.from_chain_type(
-            llm=self.llm,
-            retriever=self.retriever,
-            chain_type="stuff",
-            chain_type_kwargs={"prompt": prompt}
 
+class RAGChatbot:
+    """
+    Các client dài hạn (embeddings, Chroma, ChatOpenAI, FAQ) được tạo một lần.
+    Khi tri thức thay đổi, reload() chỉ dựng một QueryPipeline mới (một "generation")
+    rồi hoán đổi tham chiếu; request đang chạy vẫn hoàn tất trên generation cũ.
+    """
+
+    def __init__(self, faq_service=None):
+        self.embeddings = get_embeddings(EMBEDDING_MODEL)
+        self.vector_store = get_retriever()
+
+        # Mỗi lời gọi có deadline, thử lại có jitter và ngắt mạch khi OpenAI lỗi liên tục (llm_clients)
+        self.llm = make_chat_model(
+            temperature=0.3,
+            stream_usage=True  # chunk cuối của stream kèm số token (cho /metrics)
+        )
+        # Nhiệt độ 0 cho việc viết lại câu hỏi nối tiếp và tóm tắt hội thoại; hạn ngắn vì có dự phòng
+        self.rewrite_llm = make_chat_model(temperature=0, max_tokens=200, deadline=5, hedge=False)
+
+        # Dùng chung FAQService với app nếu được truyền vào, tránh nạp FAQ 2 lần
+        self.faq = faq_service or FAQService(self.embeddings.model)
+        self.answer_cache = get_answer_cache()
+        # BM25 trên cùng các đoạn của Chroma: gộp kết quả + dự phòng khi embedding chậm
+        self.lexical_index = get_lexical_index() if HYBRID_ENABLED else None
+        # Câu trả lời sinh sẵn cho các câu hỏi hay gặp (khai thác từ lịch sử), phục vụ trước cache
+        self.popular = get_popular_questions()
+
+        # Embed câu hỏi một lần, dùng chung cho FAQ và tìm kiếm Chroma
+        self._reload_lock = threading.Lock()
+        self.generation = 0
+        self.pipeline = self._build_pipeline()
+        # Job sinh sẵn câu trả lời trong tiến trình này dùng generation hiện tại của chatbot
+        register_pipeline_provider(lambda: self.pipeline)
+
+    def _build_pipeline(self) -> QueryPipeline:
+        return QueryPipeline(
+            embeddings=self.embeddings,
+            vector_store=self.vector_store,
+            llm=self.llm,
+            prompt=PROMPT,
+            faq_service=self.faq,
+            answer_cache=self.answer_cache,
+            llm_limiter=get_llm_limiter(),
+            k=4,
+            lexical_index=self.lexical_index,
+            # Bỏ đoạn trùng (MMR), ghép đoạn chồng lấn cùng file, cắt theo CONTEXT_TOKEN_BUDGET
+            context_builder=ContextBuilder(self.vector_store),
+            rewriter=QueryRewriter(self.rewrite_llm),
+            popular=self.popular
         )
 
-        self.faq = FAQService(self.embeddings.model)
+    def reload(self) -> float:
+        """Dựng generation mới trên retriever hiện tại rồi hoán đổi nguyên tử. Trả về thời gian (ms)"""
+        start = time.perf_counter()
+        with self._reload_lock:
+            self.vector_store = get_retriever()
+            pipeline = self._build_pipeline()
+            self.generation += 1
+            self.pipeline = pipeline  # gán tham chiếu là nguyên tử
+        return round((time.perf_counter() - start) * 1000, 2)
+
+    def watch_knowledge(self):
+        """Tự reload mỗi khi rag_system báo tri thức thay đổi"""
+        register_reload_callback(self.reload)
+        return self
+
+    @staticmethod
+    def _error_message(e: Exception) -> str:
+        """Chi tiết lỗi chỉ in ra log, người dùng nhận thông báo chung"""
+        print(f"[⚠️] Lỗi khi truy vấn RAG: {e}")
+        return ERROR_MESSAGE
+
+    def ask(self, question: str, history: dict = None) -> dict:
+        """Trả về dict {answer, source, timings} cho một câu hỏi; history từ ConversationMemory.load()"""
+        try:
+            result = self.pipeline.run(question, history)
+            if not result["answer"]:
+                result["answer"] = "Mình chưa có dữ liệu về vấn đề này, bạn có thể hỏi lại cách khác nhé."
+            return result
 
-    def get_answer(self, question: str):
-        """Trả lời câu hỏi dựa trên dữ liệu RAG"""
+        except Exception as e:
+            return {"answer": self._error_message(e), "source": "error", "timings": {}, "usage": {}}
+
+    async def aask(self, question: str, history: dict = None) -> dict:
+        """Phiên bản async của ask(); QueueFullError được ném tiếp để server trả 503"""
         try:
-            faq_ans = None
-            if hasattr(self, "faq"):
-                faq_ans = self.faq.check(question)
-            if faq_ans:
-                return faq_ans
-            response = self.qa_chain.invoke({"query": question})
-            result = response.get("result", "").strip()
-
-            if not result:
-                return "Mình chưa có dữ liệu về vấn đề này, bạn có thể hỏi lại cách khác nhé."
+            result = await self.pipeline.arun(question, history)
+            if not result["answer"]:
+                result["answer"] = "Mình chưa có dữ liệu về vấn đề này, bạn có thể hỏi lại cách khác nhé."
             return result
 
+        except QueueFullError:
+            raise
         except Exception as e:
-            return f"Lỗi khi truy vấn RAG: {str(e)}"
+            return {"answer": self._error_message(e), "source": "error", "timings": {}, "usage": {}}
 
-    def close(self):
-        """Đóng kết nối tới Chroma để có thể xóa DB."""
+    def stream_answer(self, question: str, history: dict = None):
+        """Generator sự kiện token/done (xem QueryPipeline.stream)"""
+        sent_tokens = False
         try:
-            if hasattr(self, "db") and hasattr(self.db, "client"):
-                self.db.client._client.teardown()  # đóng kết nối Chroma
-            elif hasattr(self, "db") and hasattr(self.db, "_client"):
-                self.db._client.teardown()
+            for event in self.pipeline.stream(question, history):
+                if event["type"] == "token":
+                    sent_tokens = True
+                elif event["type"] == "done" and not event["answer"]:
+                    event["answer"] = "Mình chưa có dữ liệu về vấn đề này, bạn có thể hỏi lại cách khác nhé."
+                    if not sent_tokens:
+                        yield {"type": "token", "text": event["answer"]}
+                yield event
+
         except Exception as e:
-            print("Không thể đóng DB:", e)
+            msg = self._error_message(e)
+            yield {"type": "error", "text": msg}
+            yield {"type": "done", "answer": msg, "source": "error", "timings": {}, "usage": {}}
+
+    def get_answer(self, question: str):
+        """Trả lời câu hỏi dựa trên dữ liệu RAG"""
+        return self.ask(question)["answer"]
@@ -1,15 +1,19 @@
 import os
 import json
 import shutil
+import hashlib
 import threading
 import time
 from datetime import datetime
 from dotenv import load_dotenv
 
-from langchain_community.document_loaders import UnstructuredFileLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
+from embedding_cache import get_embeddings
+from answer_cache import get_answer_cache
+from kb_version import bump_kb_version, get_kb_version
+from lexical_index import get_lexical_index
+from parse_cache import get_parse_cache, file_sha256, PARSE_CACHE_ENABLED
+from vector_index import get_vector_index, RETRIEVER_BACKEND
+import metrics
 
 # ==============================
 # Cấu hình
@@ -19,47 +23,192 @@ EMBEDDING_MODEL = "text-embedding-3-small"
 CHROMA_DB_PATH = "./knowledge_base_ptit"
 OLD_DOCS_DIR = "./old_docs"
 UPDATE_LOG_FILE = "./update_log.json"
+# Chế độ nhiều tiến trình: mọi worker dùng chung một Chroma server (chroma run) thay vì mở thư mục trực tiếp
+CHROMA_HOST = os.getenv("CHROMA_HOST", "")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8001"))
+COLLECTION_NAME = "langchain"
+KB_WATCH_INTERVAL = float(os.getenv("KB_WATCH_INTERVAL", "2"))  # giây, kiểm tra tri thức đổi bởi tiến trình khác
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
 
-update_lock = threading.Lock()
+update_lock = threading.Lock()   # tuần tự hóa các thao tác ghi vào Chroma
+_file_locks = {}                 # mỗi file một lock: cùng file thì xử lý lần lượt
+_file_locks_guard = threading.Lock()
 _vector_cache = None
-chatbot_reload_callback = None  # Flask sẽ gán callback reload chatbot
+_store_lock = threading.Lock()
+_reload_callbacks = []  # các hàm được gọi mỗi khi tri thức thay đổi (vd: chatbot hot-swap)
+_seen_version = {"version": None}  # phiên bản tri thức mà tiến trình này đã reload theo
 
 
 # ==============================
 # Xử lý & nhúng tài liệu
 # ==============================
-def process_file(file_path):
-    """Đọc & chia nhỏ nội dung file"""
+def _splitter_params():
+    return {"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP, "add_start_index": True}
+
+
+def _parse_cache_key(file_path):
+    return get_parse_cache().key(file_sha256(file_path), _splitter_params())
+
+
+def load_cached_chunks(file_path):
+    """Các đoạn đã parse của đúng nội dung file này (từ parse_cache), None nếu chưa có"""
+    try:
+        chunks = get_parse_cache().load(_parse_cache_key(file_path), file_path)
+    except OSError:
+        return None
+    if chunks:
+        assign_chunk_ids(chunks)
+    return chunks
+
+
+def process_file(file_path, use_cache=PARSE_CACHE_ENABLED):
+    """
+    Đọc & chia nhỏ nội dung file. use_cache: file cùng nội dung (cùng phiên bản loader,
+    tham số chia đoạn) đã parse trước đó thì lấy luôn từ parse_cache, bỏ qua unstructured.
+    """
     try:
+        if use_cache:
+            chunks = load_cached_chunks(file_path)
+            if chunks is not None:
+                return chunks
+
+        # unstructured / langchain_community rất nặng: chỉ import khi thật sự nạp tài liệu
+        from langchain_community.document_loaders import UnstructuredFileLoader
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
         loader = UnstructuredFileLoader(file_path)
         docs = loader.load()
 
-        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+        # start_index: vị trí đoạn trong file, để ghép các đoạn liền kề khi dựng context
+        splitter = RecursiveCharacterTextSplitter(**_splitter_params())
         chunks = splitter.split_documents(docs)
 
         for c in chunks:
             c.metadata["file_name"] = os.path.basename(file_path)
+        if use_cache and chunks:
+            get_parse_cache().save(_parse_cache_key(file_path), chunks)
+        assign_chunk_ids(chunks)
         return chunks
     except Exception as e:
         print(f"Lỗi khi xử lý {file_path}: {e}")
         return []
 
 
+def assign_chunk_ids(chunks):
+    """
+    Gán chunk_id tất định = hash(file_name + nội dung) vào metadata.
+    Đoạn trùng nội dung trong cùng file được đánh thêm số thứ tự.
+    """
+    seen = {}
+    for c in chunks:
+        raw = f"{c.metadata.get('file_name', '')}\x00{c.page_content}"
+        base = hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+        n = seen.get(base, 0)
+        seen[base] = n + 1
+        c.metadata["chunk_id"] = base if n == 0 else f"{base}-{n}"
+    return [c.metadata["chunk_id"] for c in chunks]
+
+
 # ==============================
 # Khởi tạo hoặc tải vector store
 # ==============================
 def get_vector_store():
+    """
+    Một client Chroma dùng chung cho cả ingest lẫn truy vấn.
+    Có CHROMA_HOST -> HttpClient tới Chroma server; ngược lại mở thẳng CHROMA_DB_PATH (một tiến trình).
+    """
     global _vector_cache
-    if _vector_cache is None:
-        embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL)
-        _vector_cache = Chroma(persist_directory=CHROMA_DB_PATH, embedding_function=embeddings)
-    return _vector_cache
+    with _store_lock:
+        if _vector_cache is None:
+            from langchain_chroma import Chroma
+
+            embeddings = get_embeddings(EMBEDDING_MODEL)
+            if CHROMA_HOST:
+                import chromadb
+                client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+                _vector_cache = Chroma(client=client, collection_name=COLLECTION_NAME,
+                                       embedding_function=embeddings)
+            else:
+                _vector_cache = Chroma(persist_directory=CHROMA_DB_PATH, collection_name=COLLECTION_NAME,
+                                       embedding_function=embeddings)
+        return _vector_cache
+
+
+# ==============================
+# Thông báo thay đổi tri thức
+# ==============================
+def get_retriever():
+    """Nguồn tìm kiếm vector của chatbot: Chroma hoặc vector_index trong tiến trình (RETRIEVER_BACKEND=compact)"""
+    if RETRIEVER_BACKEND == "compact":
+        index = get_vector_index()
+        index.ensure_fresh()
+        return index
+    return get_vector_store()
+
+
+def _compact_index():
+    """vector_index cần ghi song song với Chroma (đã export lại nếu đang lệch), None nếu dùng Chroma"""
+    if RETRIEVER_BACKEND != "compact":
+        return None
+    index = get_vector_index()
+    index.ensure_fresh()
+    return index
+
+
+def register_reload_callback(callback):
+    """Đăng ký hàm được gọi (không tham số) sau mỗi lần thêm / xóa / reset tri thức"""
+    if callback not in _reload_callbacks:
+        _reload_callbacks.append(callback)
+
+
+def _run_reload_callbacks(reason):
+    for callback in list(_reload_callbacks):
+        try:
+            callback()
+        except Exception as e:
+            print(f"Lỗi khi reload sau '{reason}': {e}")
+
+
+def notify_knowledge_changed(reason):
+    """Tăng phiên bản tri thức, xóa cache câu trả lời và gọi các callback reload"""
+    version = bump_kb_version(reason)
+    _seen_version["version"] = version
+    # Chỉ mục BM25 đã được cập nhật tăng dần trước đó, không cần dựng lại
+    get_lexical_index().mark_synced(version)
+    if RETRIEVER_BACKEND == "compact":
+        get_vector_index().mark_synced(version)
+    get_answer_cache().invalidate()
+    _run_reload_callbacks(reason)
+
+
+def start_knowledge_watcher(interval=KB_WATCH_INTERVAL):
+    """
+    Worker không phải writer: theo dõi kb_version.json (chỉ stat file) và khi tiến trình khác
+    đổi tri thức thì xóa cache câu trả lời + gọi callback reload như notify_knowledge_changed.
+    BM25 tự dựng lại ở lần tìm kiếm kế tiếp vì phiên bản đã khác.
+    """
+    _seen_version["version"] = get_kb_version()
+
+    def watch():
+        while True:
+            time.sleep(interval)
+            try:
+                version = get_kb_version()
+                if version != _seen_version["version"]:
+                    _seen_version["version"] = version
+                    get_answer_cache().invalidate()
+                    _run_reload_callbacks(f"kb_version {version} (tiến trình khác)")
+            except Exception as e:
+                print(f"[⚠️] Lỗi khi theo dõi phiên bản tri thức: {e}")
+
+    threading.Thread(target=watch, name="kb-watcher", daemon=True).start()
 
 
 # ==============================
 # Ghi log cập nhật
 # ==============================
-def log_update(file_name, status, chunks, duration):
+def log_update(file_name, status, chunks, duration, added=None, removed=None, kept=None):
     entry = {
         "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "file": file_name,
@@ -67,6 +216,8 @@ def log_update(file_name, status, chunks, duration):
         "chunks": chunks,
         "duration_sec": round(duration, 2)
     }
+    if added is not None:
+        entry.update({"added": added, "removed": removed, "kept": kept})
     with open(UPDATE_LOG_FILE, "a", encoding="utf-8") as f:
         json.dump(entry, f, ensure_ascii=False)
         f.write("\n")
@@ -83,15 +234,26 @@ def get_update_logs(limit=10):
 # ==============================
 # Xóa tri thức theo file
 # ==============================
+def _delete_chunks(file_name):
+    get_vector_store().delete(where={"file_name": file_name})
+
+
 def delete_knowledge(file_name):
     try:
-        embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL)
-        store = Chroma(persist_directory=CHROMA_DB_PATH, embedding_function=embeddings)
-        store.delete(where={"file_name": file_name})
+        with _file_lock(file_name):
+            with update_lock:
+                _delete_chunks(file_name)
+                get_lexical_index().remove_file(file_name)
+                index = _compact_index()
+                if index is not None:
+                    index.delete(file_name=file_name)
+
+            old_path = os.path.join(OLD_DOCS_DIR, file_name)
+            if os.path.exists(old_path):
+                os.remove(old_path)
 
-        old_path = os.path.join(OLD_DOCS_DIR, file_name)
-        if os.path.exists(old_path):
-            os.remove(old_path)
+        # Câu trả lời đã cache có thể dựa trên file vừa xóa
+        notify_knowledge_changed(f"delete {file_name}")
 
         print(f"Đã xóa tri thức: {file_name}")
         return True
@@ -100,60 +262,125 @@ def delete_knowledge(file_name):
         return False
 
 
+def reset_knowledge():
+    """Xóa toàn bộ vector trong Chroma (giữ nguyên client đang dùng chung)"""
+    with update_lock:
+        get_vector_store().reset_collection()
+        get_lexical_index().clear()
+        if RETRIEVER_BACKEND == "compact":
+            get_vector_index().reset()
+    notify_knowledge_changed("reset")
+
+
 # ==============================
 # Thêm hoặc cập nhật tri thức
 # ==============================
-def add_or_update_file(file_path, force_replace=False):
+def diff_chunks(store, file_name, chunks):
+    """So sánh với các đoạn đang có trong Chroma theo chunk_id -> (to_add, to_remove_ids, kept)"""
+    new_ids = {c.metadata["chunk_id"] for c in chunks}
+    existing_ids = set(store.get(where={"file_name": file_name}, include=[])["ids"])
+    to_add = [c for c in chunks if c.metadata["chunk_id"] not in existing_ids]
+    to_remove = list(existing_ids - new_ids)
+    return to_add, to_remove, len(chunks) - len(to_add)
+
+
+def _file_lock(file_name):
+    with _file_locks_guard:
+        return _file_locks.setdefault(file_name, threading.Lock())
+
+
+def add_or_update_file(file_path, force_replace=False, progress=None):
+    """
+    progress: hàm tùy chọn nhận tên bước ("parsing", "embedding", "writing", "done")
+    để hàng đợi job báo tiến độ cho trang admin.
+    """
     os.makedirs(OLD_DOCS_DIR, exist_ok=True)
     file_name = os.path.basename(file_path)
     old_path = os.path.join(OLD_DOCS_DIR, file_name)
-    if os.path.exists(old_path) and not force_replace:
-        return {"exists": True, "file": file_name}
-    start = time.time()
-    try:
-        store = get_vector_store()
-        chunks = process_file(file_path)
+    clock = metrics.StageClock(metrics.INGEST_STAGE_SECONDS)
 
-        if not chunks:
-            return {"success": False, "message": f"Không thể xử lý {file_name}"}
+    def report(stage):
+        # Mỗi lần chuyển bước: ghi thời gian bước trước vào /metrics rồi báo tiến độ
+        clock.mark(None if stage == "done" else stage)
+        if progress:
+            progress(stage)
 
-        # Nếu ghi đè: xóa vector + file cũ
-        if os.path.exists(old_path):
-            delete_knowledge(file_name)
+    with _file_lock(file_name):
+        if os.path.exists(old_path) and not force_replace:
+            return {"exists": True, "file": file_name}
+        start = time.time()
+        try:
+            store = get_vector_store()
+            report("parsing")
+            chunks = process_file(file_path)
 
-        # Thêm tài liệu mới
-        store.add_documents(chunks)
-        shutil.copy(file_path, old_path)
+            if not chunks:
+                metrics.INGEST_FILES.inc(status="error")
+                return {"success": False, "message": f"Không thể xử lý {file_name}"}
 
-        duration = time.time() - start
-        log_update(file_name, "success", len(chunks), duration)
+            to_add, to_remove, kept = diff_chunks(store, file_name, chunks)
 
-        # Reload chatbot sau khi cập nhật
-        if chatbot_reload_callback:
-            chatbot_reload_callback()
+            # Chỉ embed đoạn mới/thay đổi, ngoài update_lock: các file khác nhau embed song song,
+            # add_documents bên dưới chỉ còn đọc vector từ cache
+            report("embedding")
+            vectors = store.embeddings.embed_documents([c.page_content for c in to_add]) if to_add else []
 
-        return {
-            "success": True,
-            "message": f"✅ Đã thêm/cập nhật {file_name} ({len(chunks)} đoạn)."
-        }
-    except Exception as e:
-        log_update(file_name, "error", 0, 0)
-        return {"success": False, "message": str(e)}
+            report("writing")
+            with update_lock:
+                if to_remove:
+                    store.delete(ids=to_remove)
+                if to_add:
+                    store.add_documents(to_add, ids=[c.metadata["chunk_id"] for c in to_add])
+                lexical = get_lexical_index()
+                lexical.remove_ids(to_remove)
+                lexical.add_documents(to_add)
+                index = _compact_index()
+                if index is not None:
+                    index.delete(ids=to_remove)
+                    index.add_documents(to_add, vectors)
+                shutil.copy(file_path, old_path)
+
+            duration = time.time() - start
+            log_update(file_name, "success", len(chunks), duration,
+                       added=len(to_add), removed=len(to_remove), kept=kept)
+
+            # Reload chatbot sau khi cập nhật (bỏ qua nếu nội dung không đổi)
+            if to_add or to_remove:
+                notify_knowledge_changed(f"update {file_name}")
+            report("done")
+            metrics.INGEST_FILES.inc(status="success")
+            for action, n in (("added", len(to_add)), ("removed", len(to_remove)), ("kept", kept)):
+                metrics.INGEST_CHUNKS.inc(n, action=action)
+
+            return {
+                "success": True,
+                "message": f"✅ Đã thêm/cập nhật {file_name} ({len(chunks)} đoạn: "
+                           f"+{len(to_add)} mới, -{len(to_remove)} xóa, {kept} giữ nguyên).",
+                "added": len(to_add),
+                "removed": len(to_remove),
+                "kept": kept
+            }
+        except Exception as e:
+            log_update(file_name, "error", 0, 0)
+            metrics.INGEST_FILES.inc(status="error")
+            return {"success": False, "message": str(e)}
 
 
 # ==============================
 # Tự động cập nhật nền (nếu cần)
 # ==============================
 
-def start_auto_update(interval=7200):
-    def loop():
-        while True:
-            try:
-                print("[⏳] Kiểm tra cập nhật tri thức định kỳ...")
-                time.sleep(interval)
-            except KeyboardInterrupt:
-                break
-    threading.Thread(target=loop, daemon=True).start()
+def start_auto_update(interval=None):
+    """Chạy đồng bộ thư mục tài liệu (knowledge_sync) trong thread nền"""
+    from knowledge_sync import get_knowledge_sync, SYNC_INTERVAL
+
+    syncer = get_knowledge_sync()
+    threading.Thread(
+        target=syncer.run_forever,
+        kwargs={"interval": interval or SYNC_INTERVAL},
+        daemon=True
+    ).start()
+    return syncer
 
 
 # ==============================
@@ -0,0 +1,233 @@
+import os
+import json
+import uuid
+import sqlite3
+import datetime
+import threading
+from typing import Optional, List
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SESSION_DB = os.getenv("SESSION_DB", "./chat_history.sqlite3")
+DEFAULT_SESSION_NAME = "Cuộc trò chuyện mới"
+
+
+class SessionStore:
+    """
+    Lưu lịch sử hội thoại trong SQLite (WAL), đánh index theo session_id.
+    Mỗi tin nhắn là một INSERT -> chi phí không phụ thuộc vào độ lớn lịch sử.
+    """
+
+    def __init__(self, db_path: str = SESSION_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._init_schema()
+
+    def _conn(self) -> sqlite3.Connection:
+        # Mỗi thread một kết nối; WAL cho phép đọc song song với ghi
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                created TEXT NOT NULL,
+                message_count INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+                role TEXT NOT NULL,
+                text TEXT NOT NULL,
+                ts TEXT NOT NULL,
+                query TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id, id);
+            CREATE TABLE IF NOT EXISTS session_summaries (
+                session_id TEXT PRIMARY KEY REFERENCES sessions(id) ON DELETE CASCADE,
+                summary TEXT NOT NULL,
+                upto_message_id INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        # DB cũ chưa có cột query (câu hỏi đã viết lại thành câu độc lập)
+        if "query" not in {r["name"] for r in conn.execute("PRAGMA table_info(messages)")}:
+            try:
+                conn.execute("ALTER TABLE messages ADD COLUMN query TEXT")
+            except sqlite3.OperationalError:
+                pass  # worker khác vừa thêm
+        conn.commit()
+
+    # ------------------------------
+    # Session
+    # ------------------------------
+    def create_session(self, initial_name: Optional[str] = None, sid: Optional[str] = None) -> dict:
+        s = {
+            "id": sid or str(uuid.uuid4()),
+            "name": initial_name or DEFAULT_SESSION_NAME,
+            "created": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "messages": []
+        }
+        conn = self._conn()
+        conn.execute("INSERT INTO sessions (id, name, created) VALUES (?, ?, ?)",
+                     (s["id"], s["name"], s["created"]))
+        conn.commit()
+        return s
+
+    def get_session(self, sid: Optional[str], with_messages: bool = True) -> Optional[dict]:
+        if not sid:
+            return None
+        conn = self._conn()
+        row = conn.execute("SELECT id, name, created FROM sessions WHERE id = ?", (sid,)).fetchone()
+        if not row:
+            return None
+        s = dict(row)
+        if with_messages:
+            s["messages"] = [
+                dict(m) for m in conn.execute(
+                    "SELECT role, text, ts FROM messages WHERE session_id = ? ORDER BY id", (sid,)
+                )
+            ]
+        return s
+
+    def list_sessions(self, limit: int = 30, offset: int = 0) -> List[dict]:
+        """Danh sách session có tin nhắn, mới nhất trước"""
+        rows = self._conn().execute(
+            "SELECT id, name, created FROM sessions WHERE message_count > 0 "
+            "ORDER BY rowid DESC LIMIT ? OFFSET ?", (limit, offset)
+        )
+        return [dict(r) for r in rows]
+
+    def count_sessions(self) -> int:
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM sessions WHERE message_count > 0"
+        ).fetchone()[0]
+
+    def rename_session(self, sid: str, new_name: str):
+        conn = self._conn()
+        conn.execute("UPDATE sessions SET name = ? WHERE id = ?", (new_name, sid))
+        conn.commit()
+
+    def delete_session(self, sid: str):
+        conn = self._conn()
+        conn.execute("DELETE FROM sessions WHERE id = ?", (sid,))
+        conn.commit()
+
+    # ------------------------------
+    # Tin nhắn
+    # ------------------------------
+    def append_message(self, sid: str, role: str, text: str, ts: Optional[str] = None) -> int:
+        """Lưu tin nhắn, trả về id"""
+        conn = self._conn()
+        with conn:
+            cur = conn.execute(
+                "INSERT INTO messages (session_id, role, text, ts) VALUES (?, ?, ?, ?)",
+                (sid, role, text, ts or datetime.datetime.now().isoformat())
+            )
+            conn.execute("UPDATE sessions SET message_count = message_count + 1 WHERE id = ?", (sid,))
+        return cur.lastrowid
+
+    def set_message_query(self, message_id: int, query: str):
+        """Ghi câu hỏi đã viết lại (độc lập với ngữ cảnh) cho tin nhắn của người dùng"""
+        conn = self._conn()
+        conn.execute("UPDATE messages SET query = ? WHERE id = ?", (query, message_id))
+        conn.commit()
+
+    def recent_messages(self, sid: str, limit: int) -> List[dict]:
+        """limit tin nhắn gần nhất của session (cũ -> mới)"""
+        rows = self._conn().execute(
+            "SELECT id, role, text FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?", (sid, limit)
+        ).fetchall()
+        return [dict(r) for r in reversed(rows)]
+
+    def messages_after(self, sid: str, after_id: int) -> List[dict]:
+        rows = self._conn().execute(
+            "SELECT id, role, text FROM messages WHERE session_id = ? AND id > ? ORDER BY id", (sid, after_id)
+        )
+        return [dict(r) for r in rows]
+
+    def user_questions(self, limit: int) -> List[str]:
+        """
+        limit câu hỏi gần nhất của người dùng trên mọi session (cho việc phân tích câu hỏi phổ biến);
+        câu đã được viết lại thì lấy bản viết lại
+        """
+        rows = self._conn().execute(
+            "SELECT COALESCE(query, text) AS text FROM messages WHERE role = 'user' ORDER BY id DESC LIMIT ?",
+            (limit,)
+        )
+        return [r["text"] for r in rows]
+
+    # ------------------------------
+    # Tóm tắt hội thoại (bộ nhớ dài hạn có giới hạn)
+    # ------------------------------
+    def get_summary(self, sid: str):
+        """(summary, id tin nhắn cuối đã được tóm tắt)"""
+        row = self._conn().execute(
+            "SELECT summary, upto_message_id FROM session_summaries WHERE session_id = ?", (sid,)
+        ).fetchone()
+        return (row["summary"], row["upto_message_id"]) if row else ("", 0)
+
+    def set_summary(self, sid: str, summary: str, upto_message_id: int):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO session_summaries (session_id, summary, upto_message_id) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET summary = excluded.summary, "
+                "upto_message_id = excluded.upto_message_id",
+                (sid, summary, upto_message_id)
+            )
+
+    # ------------------------------
+    # Chuyển dữ liệu từ chat_history.json (chạy một lần)
+    # ------------------------------
+    def migrate_from_json(self, json_path: str) -> int:
+        conn = self._conn()
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_json'").fetchone():
+            return 0
+        sessions = []
+        if os.path.exists(json_path):
+            try:
+                with open(json_path, "r", encoding="utf-8") as f:
+                    content = f.read().strip()
+                    sessions = json.loads(content) if content else []
+            except Exception as e:
+                print(f"Không thể đọc {json_path}: {e}")
+                return 0
+
+        count = 0
+        with conn:
+            # Nhiều worker khởi động cùng lúc: khóa ghi rồi kiểm tra lại, chỉ một tiến trình chuyển dữ liệu
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_json'").fetchone():
+                return 0
+            for s in sessions:
+                messages = s.get("messages") or []
+                if not messages or not s.get("id"):
+                    continue
+                conn.execute(
+                    "INSERT OR IGNORE INTO sessions (id, name, created, message_count) VALUES (?, ?, ?, ?)",
+                    (s["id"], s.get("name") or DEFAULT_SESSION_NAME, s.get("created") or "", len(messages))
+                )
+                conn.executemany(
+                    "INSERT INTO messages (session_id, role, text, ts) VALUES (?, ?, ?, ?)",
+                    [(s["id"], m.get("role", ""), m.get("text", ""), m.get("ts", "")) for m in messages]
+                )
+                count += 1
+            conn.execute("INSERT INTO meta (key, value) VALUES ('migrated_json', ?)",
+                         (datetime.datetime.now().isoformat(),))
+        return count
@@ -0,0 +1,120 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))        # 0 = tắt; > 0: lưu profile của request chậm hơn
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))  # chu kỳ lấy mẫu stack
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))     # giữ tối đa bấy nhiêu file profile
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def _collapse(frame) -> str:
+    """Stack dạng "collapsed" (flamegraph.pl / speedscope): hàm ngoài cùng;...;hàm trong cùng"""
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class SlowRequestProfiler:
+    """
+    Profiler lấy mẫu (sampling) cho request chậm, chỉ chạy khi bật PROFILE_SLOW_MS.
+    Một thread nền đọc stack của các thread đang phục vụ request mỗi PROFILE_INTERVAL_MS;
+    request nào vượt ngưỡng thì các stack đã gom được ghi ra PROFILE_DIR.
+    """
+
+    def __init__(self, slow_ms: float = PROFILE_SLOW_MS, interval_ms: float = PROFILE_INTERVAL_MS,
+                 out_dir: str = PROFILE_DIR):
+        self.slow_ms = slow_ms
+        self.interval = interval_ms / 1000
+        self.out_dir = out_dir
+        self.enabled = slow_ms > 0
+        self._active = {}                 # thread id -> Counter(stack)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.saved = 0
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._sample_loop, name="slow-profiler", daemon=True)
+            self._thread.start()
+
+    def _sample_loop(self):
+        me = threading.get_ident()
+        while True:
+            with self._lock:
+                active = dict(self._active)
+            if not active:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            frames = sys._current_frames()
+            for tid, stacks in active.items():
+                frame = frames.get(tid)
+                if frame is not None and tid != me:
+                    stacks[_collapse(frame)] += 1
+            time.sleep(self.interval)
+
+    def begin(self):
+        """Bắt đầu lấy mẫu thread hiện tại; trả về token để truyền cho end()"""
+        if not self.enabled:
+            return None
+        tid = threading.get_ident()
+        with self._lock:
+            self._ensure_thread()
+            self._active[tid] = Counter()
+        self._wake.set()
+        return tid, time.perf_counter()
+
+    def end(self, token, label: str = ""):
+        """Dừng lấy mẫu; trả về đường dẫn file profile nếu request chậm, ngược lại None"""
+        if token is None:
+            return None
+        tid, start = token
+        with self._lock:
+            stacks = self._active.pop(tid, None)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if not stacks or elapsed_ms < self.slow_ms:
+            return None
+        return self._save(stacks, label, elapsed_ms)
+
+    def _save(self, stacks, label, elapsed_ms):
+        os.makedirs(self.out_dir, exist_ok=True)
+        safe = "".join(ch if ch.isalnum() else "_" for ch in label)[:60]
+        path = os.path.join(self.out_dir, f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{safe}-{int(elapsed_ms)}ms.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"# {label} {elapsed_ms:.1f}ms, {sum(stacks.values())} mẫu / {self.interval * 1000:g}ms\n")
+            for stack, n in stacks.most_common():
+                f.write(f"{stack} {n}\n")
+        self.saved += 1
+        self._prune()
+        return path
+
+    def _prune(self):
+        files = sorted(os.listdir(self.out_dir))
+        for name in files[:max(0, len(files) - PROFILE_MAX_FILES)]:
+            try:
+                os.remove(os.path.join(self.out_dir, name))
+            except OSError:
+                pass
+
+
+def get_profiler() -> SlowRequestProfiler:
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = SlowRequestProfiler()
+        return _shared
@@ -0,0 +1,128 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+# Mốc bắt đầu: app.py import module này đầu tiên
+STARTED_AT = time.perf_counter()
+
+load_dotenv()
+
+# 1: dựng chatbot / index trong thread nền ngay khi khởi động; 0: dựng ở request đầu tiên
+WARMUP_ENABLED = os.getenv("WARMUP", "1") == "1"
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+class StartupReport:
+    """Thời gian (ms) của từng bước khởi động và trạng thái sẵn sàng (starting -> warming -> ready | failed)"""
+
+    def __init__(self):
+        self.phases = OrderedDict()
+        self.errors = {}
+        self.state = "starting"
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            with self._lock:
+                self.errors[name] = str(e)
+            raise
+        finally:
+            with self._lock:
+                self.phases[name] = round((time.perf_counter() - start) * 1000, 2)
+
+    def mark(self, name: str):
+        """Ghi thời gian từ lúc tiến trình bắt đầu import tới bây giờ (vd: "import" khi app.py nạp xong)"""
+        with self._lock:
+            self.phases[name] = round((time.perf_counter() - STARTED_AT) * 1000, 2)
+
+    def set_state(self, state: str):
+        with self._lock:
+            self.state = state
+        if state in ("ready", "failed"):
+            self._ready.set()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "uptime_ms": round((time.perf_counter() - STARTED_AT) * 1000, 2),
+                "phases_ms": dict(self.phases),
+                "errors": dict(self.errors)
+            }
+
+
+def get_startup_report() -> StartupReport:
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = StartupReport()
+        return _shared
+
+
+class Lazy:
+    """
+    Đối tượng nặng (client, index) chỉ được tạo ở lần get() đầu tiên, an toàn đa luồng.
+    Thời gian tạo được ghi vào báo cáo khởi động dưới tên name.
+    """
+
+    def __init__(self, name: str, factory):
+        self.name = name
+        self.factory = factory
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    with get_startup_report().phase(self.name):
+                        self._value = self.factory()
+        return self._value
+
+    def peek(self):
+        """Giá trị nếu đã tạo, ngược lại None (không kích hoạt việc tạo)"""
+        return self._value
+
+
+def start_warmup(steps):
+    """
+    Chạy lần lượt các bước (name, callable) trong thread nền; xong thì trạng thái "ready"
+    và in một dòng báo cáo thời gian khởi động. Bước lỗi không chặn các bước sau.
+    """
+    report = get_startup_report()
+    report.set_state("warming")
+
+    def run():
+        failed = False
+        for name, step in steps:
+            try:
+                with report.phase(name):
+                    step()
+            except Exception as e:
+                failed = True
+                print(f"[⚠️] Lỗi khi khởi động ({name}): {e}")
+        report.mark("ready")
+        report.set_state("failed" if failed else "ready")
+        summary = ", ".join(f"{k} {v:.0f}ms" for k, v in report.as_dict()["phases_ms"].items())
+        print(f"[🚀] Khởi động {'xong' if not failed else 'có lỗi'} (pid {os.getpid()}): {summary}")
+
+    threading.Thread(target=run, name="warmup", daemon=True).start()
+    return report
@@ -0,0 +1,580 @@
+import os
+import json
+import mmap
+import time
+import uuid
+import shutil
+import sqlite3
+import asyncio
+import argparse
+import threading
+from contextlib import contextmanager
+from typing import List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from kb_version import get_kb_version
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ khóa trong tiến trình
+    fcntl = None
+
+load_dotenv()
+
+# "chroma": truy xuất qua Chroma (mặc định); "compact": vector_index trong tiến trình (Chroma vẫn là nơi ghi chính)
+RETRIEVER_BACKEND = os.getenv("RETRIEVER_BACKEND", "chroma")
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "./vector_index")
+VECTOR_INDEX_QUANTIZE = os.getenv("VECTOR_INDEX_QUANTIZE", "int8")  # "int8" | "none"
+VECTOR_INDEX_RESCORE = int(os.getenv("VECTOR_INDEX_RESCORE", "8"))  # int8: lấy k*RESCORE ứng viên rồi chấm lại bằng float32
+SCAN_BLOCK = 8192           # số dòng mỗi lần quét (giới hạn bộ nhớ tạm khi đổi int8 -> float32)
+COMPACT_DEAD_RATIO = 0.25   # tỉ lệ dòng đã xóa vượt ngưỡng này thì ghi lại generation mới
+EXPORT_PAGE = 5000          # số đoạn đọc từ Chroma mỗi lần khi export
+# Generation cũ còn được giữ bao lâu sau khi bị thay (giây): worker chậm refresh vẫn đọc được
+GENERATION_GRACE_SEC = float(os.getenv("VECTOR_INDEX_GENERATION_GRACE", "300"))
+FORMAT_VERSION = 1
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def _normalize(vectors) -> np.ndarray:
+    m = np.asarray(vectors, dtype=np.float32)
+    if m.ndim == 1:
+        m = m[None, :]
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return m / norms
+
+
+def quantize_int8(m: np.ndarray):
+    """Lượng tử hóa đối xứng theo từng dòng: v ≈ q * scale, q trong [-127, 127]"""
+    scales = np.abs(m).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    q = np.clip(np.rint(m / scales[:, None]), -127, 127).astype(np.int8)
+    return q, scales.astype(np.float32)
+
+
+def _memmap(path: str, dtype, shape, random_access: bool = False):
+    """Mảng chỉ đọc trên file (memory-map). random_access: tắt đọc trước của kernel cho file chỉ đọc vài dòng rời rạc"""
+    if not shape[0]:
+        return np.zeros(shape, dtype=dtype)
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if random_access and hasattr(mmap, "MADV_RANDOM"):
+        mm.madvise(mmap.MADV_RANDOM)
+    return np.frombuffer(mm, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+def _file_filter(filter) -> Optional[List[str]]:
+    """Bộ lọc kiểu Chroma trên file_name: {"file_name": x} hoặc {"file_name": {"$in": [...]}}"""
+    if not filter:
+        return None
+    if set(filter) != {"file_name"}:
+        raise ValueError(f"vector_index chỉ hỗ trợ lọc theo file_name, nhận được {filter}")
+    value = filter["file_name"]
+    if isinstance(value, dict):
+        if "$eq" in value:
+            return [value["$eq"]]
+        return list(value.get("$in", []))
+    return [value]
+
+
+class _Generation:
+    """
+    Một bản index trên đĩa (thư mục gen-*) ở trạng thái chỉ đọc, theo manifest lúc mở:
+    vectors.f32 (n x dim, đã chuẩn hóa), vectors.i8 + scales.f32 (nếu lượng tử hóa),
+    files.i32 (mã file của từng dòng, -1 = đã xóa) và chunks.sqlite3 (chunk_id, nội dung, metadata).
+    Tìm kiếm chỉ đọc đối tượng này nên không cần khóa.
+    """
+
+    def __init__(self, root: str, manifest: Optional[dict]):
+        self.manifest = manifest or {}
+        self.seq = self.manifest.get("seq", 0)
+        self.n = self.manifest.get("count", 0)
+        self.dim = self.manifest.get("dim") or 0
+        self.quantized = self.manifest.get("quantize") == "int8"
+        self.file_codes = {name: code for code, name in enumerate(self.manifest.get("files", []))}
+        self.path = os.path.join(root, self.manifest["generation"]) if self.manifest.get("generation") else None
+        if self.path is None:
+            self.n = 0
+        shape = (self.n, self.dim)
+        # Có int8 thì float32 chỉ được đọc vài dòng để chấm lại: không để đọc trước đẩy ma trận int8 khỏi RAM
+        self.f32 = _memmap(self._file("vectors.f32"), np.float32, shape, random_access=self.quantized)
+        self.i8 = _memmap(self._file("vectors.i8"), np.int8, shape) if self.quantized else None
+        self.scales = _memmap(self._file("scales.f32"), np.float32, (self.n,)) if self.quantized else None
+        self.fid = _memmap(self._file("files.i32"), np.int32, (self.n,))
+        self._db = None
+        self._db_lock = threading.Lock()
+        if self.path is not None:
+            # Mở ngay (cùng lúc với memmap): generation bị xóa khỏi đĩa sau đó thì fd đang mở vẫn đọc được
+            self._db = sqlite3.connect(self._file("chunks.sqlite3"), check_same_thread=False)
+            self._db.execute("SELECT 1 FROM chunks LIMIT 1").fetchall()
+
+    def _file(self, name: str) -> Optional[str]:
+        return os.path.join(self.path, name) if self.path else None
+
+    def query(self, sql: str, params=()):
+        if self.path is None:
+            return []
+        with self._db_lock:
+            if self._db is None:  # đã close() khi bị thay nhưng còn lượt tìm kiếm cầm bản cũ
+                self._db = sqlite3.connect(self._file("chunks.sqlite3"), check_same_thread=False)
+            return self._db.execute(sql, params).fetchall()
+
+    def scan(self, q: np.ndarray, top: int, codes: Optional[np.ndarray]):
+        """Top-`top` dòng theo tích vô hướng (xấp xỉ int8 nếu có), quét theo khối SCAN_BLOCK dòng"""
+        rows, scores = [], []
+        buf = np.empty((min(SCAN_BLOCK, self.n), self.dim), dtype=np.float32) if self.quantized else None
+        for start in range(0, self.n, SCAN_BLOCK):
+            end = min(start + SCAN_BLOCK, self.n)
+            if self.quantized:
+                block = buf[:end - start]
+                np.copyto(block, self.i8[start:end], casting="unsafe")
+                s = (block @ q) * self.scales[start:end]
+            else:
+                s = self.f32[start:end] @ q
+            fid = self.fid[start:end]
+            valid = fid >= 0 if codes is None else np.isin(fid, codes)
+            s = np.where(valid, s, -np.inf)
+            take = min(top, end - start)
+            idx = np.argpartition(-s, take - 1)[:take]
+            idx = idx[np.isfinite(s[idx])]
+            rows.append(idx + start)
+            scores.append(s[idx])
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows, scores = np.concatenate(rows), np.concatenate(scores)
+        if len(rows) > top:
+            # Mỗi khối giữ `top` ứng viên: chỉ trả về `top` tốt nhất toàn cục (số dòng float32 phải chấm lại)
+            best = np.argpartition(-scores, top - 1)[:top]
+            rows, scores = rows[best], scores[best]
+        return rows, scores
+
+    def rows_for(self, ids=None, file_name=None) -> List[int]:
+        if ids is not None:
+            found = []
+            ids = list(ids)
+            for i in range(0, len(ids), 500):
+                part = ids[i:i + 500]
+                found += [r for (r,) in self.query(
+                    f"SELECT row FROM chunks WHERE chunk_id IN ({', '.join('?' * len(part))})", part)]
+            return found
+        return [r for (r,) in self.query("SELECT row FROM chunks WHERE file_name = ?", (file_name,))]
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class CompactVectorIndex:
+    """
+    Chỉ mục vector trong tiến trình thay cho truy vấn Chroma (RETRIEVER_BACKEND=compact):
+    ma trận embedding memory-map (tùy chọn int8 + chấm lại top ứng viên bằng float32),
+    tìm kiếm chính xác bằng phép nhân ma trận + argpartition, lọc theo file_name qua bảng metadata.
+
+    Chroma vẫn là nơi ghi chính; rag_system / bulk_ingest ghi song song vào index (add / delete / reset).
+    Thêm đoạn = ghi nối vào generation hiện tại, xóa = đánh dấu -1 trong files.i32; nhiều dòng đã xóa
+    thì ghi lại generation mới. Manifest (ghi bằng os.replace) quyết định generation và số dòng hợp lệ,
+    nên các worker khác chỉ cần refresh() khi phiên bản tri thức đổi. Index lệch phiên bản tri thức
+    (vd: ghi Chroma khi chưa bật backend) thì tự export lại từ Chroma.
+    Giao diện tìm kiếm giống langchain Chroma (similarity_search_by_vector, ...) để QueryPipeline dùng trực tiếp.
+    """
+
+    def __init__(self, directory: str = VECTOR_INDEX_DIR, quantize: str = VECTOR_INDEX_QUANTIZE,
+                 rescore: int = VECTOR_INDEX_RESCORE, embeddings=None):
+        self.directory = directory
+        self.quantize = quantize
+        self.rescore = max(1, rescore)
+        self.embeddings = embeddings
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._gen = _Generation(directory, None)
+        self.refresh()
+
+    # ------------------------------
+    # Manifest & generation
+    # ------------------------------
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, "manifest.json")
+
+    def _read_manifest(self) -> Optional[dict]:
+        try:
+            with open(self._manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @contextmanager
+    def _exclusive(self):
+        """Khóa ghi giữa các thread và các tiến trình (writer, CLI bulk_ingest, export); gọi lồng được"""
+        with self._lock:
+            if self._lock_depth or fcntl is None:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            fd = os.open(os.path.join(self.directory, ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                self._lock_depth = 1
+                yield
+            finally:
+                self._lock_depth = 0
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+    def _new_generation(self, dim: int, quantize: str, seq: int) -> dict:
+        name = f"gen-{uuid.uuid4().hex[:12]}"
+        path = os.path.join(self.directory, name)
+        os.makedirs(path)
+        for file_name in ("vectors.f32", "files.i32") + (("vectors.i8", "scales.f32") if quantize == "int8" else ()):
+            open(os.path.join(path, file_name), "wb").close()
+        db = sqlite3.connect(os.path.join(path, "chunks.sqlite3"))
+        db.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE chunks (
+                row INTEGER PRIMARY KEY,
+                chunk_id TEXT UNIQUE NOT NULL,
+                file_name TEXT,
+                text TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            );
+            CREATE INDEX idx_chunks_file ON chunks(file_name);
+        """)
+        db.close()
+        return {"format": FORMAT_VERSION, "seq": seq, "generation": name, "dim": dim, "quantize": quantize,
+                "count": 0, "dead": 0, "files": [], "kb_version": None}
+
+    def _commit(self, manifest: dict):
+        """Ghi manifest (nguyên tử) rồi chuyển tiến trình này sang generation mới"""
+        manifest["seq"] = manifest.get("seq", 0) + 1
+        tmp = f"{self._manifest_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp, self._manifest_path)
+        previous = self._gen.path
+        self._swap(manifest)
+        if previous and previous != self._gen.path and os.path.isdir(previous):
+            os.utime(previous)  # mtime = lúc bị thay, tính thời gian giữ lại từ đây
+        self._drop_old_generations(manifest["generation"])
+
+    def _swap(self, manifest: Optional[dict]):
+        with self._lock:
+            old, self._gen = self._gen, _Generation(self.directory, manifest)
+        if old.path != self._gen.path:
+            old.close()
+
+    def _drop_old_generations(self, current: str):
+        """
+        Giữ generation hiện tại, generation ngay trước và mọi generation bị thay chưa quá
+        GENERATION_GRACE_SEC giây (worker khác có thể chưa refresh, kể cả khi đã bị thay nhiều lần liên tiếp)
+        """
+        gens = sorted((e for e in os.scandir(self.directory) if e.is_dir() and e.name.startswith("gen-")),
+                      key=lambda e: e.stat().st_mtime, reverse=True)
+        old = [g for g in gens if g.name != current]
+        cutoff = time.time() - GENERATION_GRACE_SEC
+        keep = {current} | {e.name for e in old[:1]} | {e.name for e in old if e.stat().st_mtime >= cutoff}
+        for e in gens:
+            if e.name not in keep:
+                shutil.rmtree(e.path, ignore_errors=True)
+
+    def refresh(self) -> bool:
+        """Mở lại nếu manifest trên đĩa mới hơn bản đang dùng. True nếu có thay đổi"""
+        manifest = self._read_manifest()
+        if manifest is None or manifest.get("seq") == self._gen.seq:
+            return False
+        self._swap(manifest)
+        return True
+
+    def is_stale(self) -> bool:
+        manifest = self._read_manifest()
+        return manifest is None or manifest.get("kb_version") != get_kb_version()
+
+    def ensure_fresh(self):
+        """Index chưa có hoặc lệch phiên bản tri thức -> export lại từ Chroma"""
+        self.refresh()
+        if not self.is_stale():
+            return
+        with self._exclusive():
+            if self.is_stale():
+                print("[🔄] vector_index lệch phiên bản tri thức, export lại từ Chroma...")
+                self.rebuild_from_chroma()
+
+    def mark_synced(self, kb_version: int):
+        """Gọi sau khi đã ghi song song với Chroma: phiên bản mới không cần export lại"""
+        with self._exclusive():
+            manifest = self._read_manifest()
+            if manifest is not None:
+                manifest["kb_version"] = kb_version
+                self._commit(manifest)
+
+    # ------------------------------
+    # Ghi
+    # ------------------------------
+    def _append(self, manifest: dict, ids, vectors, texts, metadatas):
+        path = os.path.join(self.directory, manifest["generation"])
+        m = _normalize(vectors)
+        codes = {name: code for code, name in enumerate(manifest["files"])}
+        fids = []
+        for meta in metadatas:
+            name = (meta or {}).get("file_name")
+            if name not in codes:
+                codes[name] = len(manifest["files"])
+                manifest["files"].append(name)
+            fids.append(codes[name])
+        with open(os.path.join(path, "vectors.f32"), "ab") as f:
+            f.write(m.tobytes())
+        if manifest["quantize"] == "int8":
+            q, scales = quantize_int8(m)
+            with open(os.path.join(path, "vectors.i8"), "ab") as f:
+                f.write(q.tobytes())
+            with open(os.path.join(path, "scales.f32"), "ab") as f:
+                f.write(scales.tobytes())
+        with open(os.path.join(path, "files.i32"), "ab") as f:
+            f.write(np.asarray(fids, dtype=np.int32).tobytes())
+        start = manifest["count"]
+        db = sqlite3.connect(os.path.join(path, "chunks.sqlite3"))
+        with db:
+            db.executemany(
+                "INSERT INTO chunks (row, chunk_id, file_name, text, metadata) VALUES (?, ?, ?, ?, ?)",
+                [(start + i, chunk_id, (meta or {}).get("file_name"), text or "",
+                  json.dumps(meta or {}, ensure_ascii=False))
+                 for i, (chunk_id, text, meta) in enumerate(zip(ids, texts, metadatas))]
+            )
+        db.close()
+        manifest["count"] += len(ids)
+
+    def _tombstone(self, manifest: dict, ids=None, file_name=None):
+        gen = _Generation(self.directory, manifest)
+        rows = gen.rows_for(ids=ids, file_name=file_name)
+        gen.close()
+        if not rows:
+            return
+        path = os.path.join(self.directory, manifest["generation"])
+        fd = os.open(os.path.join(path, "files.i32"), os.O_WRONLY)
+        try:
+            dead = np.int32(-1).tobytes()
+            for row in rows:
+                os.pwrite(fd, dead, row * 4)
+        finally:
+            os.close(fd)
+        db = sqlite3.connect(os.path.join(path, "chunks.sqlite3"))
+        with db:
+            db.executemany("DELETE FROM chunks WHERE row = ?", [(r,) for r in rows])
+        db.close()
+        manifest["dead"] += len(rows)
+
+    def _writable_manifest(self, dim: int) -> dict:
+        manifest = self._read_manifest()
+        if manifest is None or not manifest.get("generation"):
+            return self._new_generation(dim, self.quantize, (manifest or {}).get("seq", 0))
+        if manifest["dim"] != dim:
+            if manifest["count"] - manifest["dead"] > 0:
+                raise ValueError(f"Vector {dim} chiều không khớp index {manifest['dim']} chiều")
+            return self._new_generation(dim, manifest["quantize"], manifest["seq"])
+        return manifest
+
+    def add(self, ids, vectors, texts, metadatas):
+        """Thêm các đoạn (chunk_id đã có thì thay thế)"""
+        if not len(ids):
+            return
+        with self._exclusive():
+            manifest = self._writable_manifest(len(vectors[0]))
+            self._tombstone(manifest, ids=list(ids))
+            self._append(manifest, list(ids), vectors, list(texts), list(metadatas))
+            self._maybe_compact(manifest)
+            self._commit(manifest)
+
+    def add_documents(self, docs, vectors):
+        self.add([d.metadata["chunk_id"] for d in docs], vectors,
+                 [d.page_content for d in docs], [d.metadata for d in docs])
+
+    def delete(self, ids=None, file_name: Optional[str] = None):
+        """Xóa theo danh sách chunk_id hoặc toàn bộ đoạn của một file"""
+        if not ids and file_name is None:
+            return
+        with self._exclusive():
+            manifest = self._read_manifest()
+            if manifest is None or not manifest.get("generation"):
+                return
+            self._tombstone(manifest, ids=list(ids) if ids else None, file_name=file_name)
+            self._maybe_compact(manifest)
+            self._commit(manifest)
+
+    def reset(self):
+        with self._exclusive():
+            manifest = self._read_manifest() or {}
+            self._commit(self._new_generation(manifest.get("dim") or 0, self.quantize, manifest.get("seq", 0)))
+
+    def _maybe_compact(self, manifest: dict):
+        if manifest["count"] and manifest["dead"] / manifest["count"] > COMPACT_DEAD_RATIO:
+            manifest.update(self._compacted(manifest))
+
+    def _compacted(self, manifest: dict) -> dict:
+        """Generation mới chỉ chứa các dòng còn hiệu lực"""
+        old = _Generation(self.directory, manifest)
+        new = self._new_generation(manifest["dim"], manifest["quantize"], manifest["seq"])
+        new["kb_version"] = manifest.get("kb_version")
+        alive = np.flatnonzero(old.fid >= 0)
+        for i in range(0, len(alive), EXPORT_PAGE):
+            rows = alive[i:i + EXPORT_PAGE]
+            meta = {r: (cid, text, json.loads(m)) for r, cid, text, m in old.query(
+                f"SELECT row, chunk_id, text, metadata FROM chunks WHERE row IN ({', '.join('?' * len(rows))})",
+                [int(r) for r in rows])}
+            rows = [r for r in rows if int(r) in meta]
+            if rows:
+                self._append(new, [meta[int(r)][0] for r in rows], np.asarray(old.f32[rows]),
+                             [meta[int(r)][1] for r in rows], [meta[int(r)][2] for r in rows])
+        old.close()
+        return new
+
+    def compact(self):
+        with self._exclusive():
+            manifest = self._read_manifest()
+            if manifest is not None and manifest.get("generation"):
+                self._commit(self._compacted(manifest))
+
+    def rebuild_from_chroma(self, store=None, quantize: Optional[str] = None) -> dict:
+        """Export toàn bộ collection Chroma (id, embedding, nội dung, metadata) sang generation mới"""
+        from rag_system import get_vector_store
+
+        collection = (store or get_vector_store())._collection
+        with self._exclusive():
+            version = get_kb_version()
+            previous = self._read_manifest() or {}
+            manifest = None
+            offset = 0
+            while True:
+                page = collection.get(include=["embeddings", "documents", "metadatas"],
+                                      limit=EXPORT_PAGE, offset=offset)
+                if not len(page["ids"]):
+                    break
+                if manifest is None:
+                    manifest = self._new_generation(len(page["embeddings"][0]), quantize or self.quantize,
+                                                    previous.get("seq", 0))
+                metas = []
+                for chunk_id, meta in zip(page["ids"], page["metadatas"]):
+                    meta = dict(meta or {})
+                    meta.setdefault("chunk_id", chunk_id)
+                    metas.append(meta)
+                self._append(manifest, page["ids"], page["embeddings"], page["documents"], metas)
+                offset += len(page["ids"])
+            if manifest is None:
+                manifest = self._new_generation(previous.get("dim") or 0, quantize or self.quantize,
+                                                previous.get("seq", 0))
+            manifest["kb_version"] = version
+            self._commit(manifest)
+        return self.stats()
+
+    # ------------------------------
+    # Tìm kiếm (giao diện giống langchain Chroma)
+    # ------------------------------
+    def search(self, query_vector, k: int = 4, file_names: Optional[List[str]] = None):
+        """[(row, score)] theo cosine giảm dần; int8 thì chấm lại k*rescore ứng viên bằng float32"""
+        gen = self._gen
+        if not gen.n or k <= 0:
+            return []
+        q = _normalize(query_vector)[0]
+        codes = None
+        if file_names is not None:
+            codes = np.asarray([gen.file_codes[f] for f in file_names if f in gen.file_codes], dtype=np.int32)
+            if not len(codes):
+                return []
+        rows, scores = gen.scan(q, k * self.rescore if gen.quantized else k, codes)
+        if gen.quantized and len(rows):
+            order = np.argsort(rows)  # đọc memmap theo thứ tự dòng
+            rows = rows[order]
+            scores = np.asarray(gen.f32[rows]) @ q
+        top = np.argsort(-scores)[:k]
+        return [(int(rows[i]), float(scores[i])) for i in top]
+
+    def _documents(self, hits):
+        from langchain_core.documents import Document
+
+        if not hits:
+            return []
+        gen = self._gen
+        rows = [row for row, _ in hits]
+        found = {r: (cid, text, meta) for r, cid, text, meta in gen.query(
+            f"SELECT row, chunk_id, text, metadata FROM chunks WHERE row IN ({', '.join('?' * len(rows))})", rows)}
+        return [(Document(page_content=found[row][1], metadata=json.loads(found[row][2]), id=found[row][0]), score)
+                for row, score in hits if row in found]
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 4, filter=None, **kwargs):
+        return self._documents(self.search(embedding, k, _file_filter(filter)))
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter)]
+
+    async def asimilarity_search_by_vector(self, embedding, k: int = 4, filter=None, **kwargs):
+        return await asyncio.to_thread(self.similarity_search_by_vector, embedding, k, filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter=None, **kwargs):
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k, filter)
+
+    def get_vectors(self, ids) -> dict:
+        """chunk_id -> vector float32 đã chuẩn hóa (cho ContextBuilder, không gọi API)"""
+        gen = self._gen
+        ids = list(ids)
+        if not gen.n or not ids:
+            return {}
+        rows = gen.query(f"SELECT chunk_id, row FROM chunks WHERE chunk_id IN ({', '.join('?' * len(ids))})", ids)
+        return {cid: np.asarray(gen.f32[row]) for cid, row in rows if row < gen.n}
+
+    def warm(self):
+        """Đọc trước ma trận vào page cache bằng một lượt tìm kiếm"""
+        gen = self._gen
+        if gen.n:
+            self.search(np.asarray(gen.f32[0]), k=1)
+
+    def stats(self) -> dict:
+        gen = self._gen
+        m = gen.manifest
+        disk = 0
+        if gen.path and os.path.isdir(gen.path):
+            disk = sum(e.stat().st_size for e in os.scandir(gen.path) if e.is_file())
+        return {
+            "generation": m.get("generation"),
+            "chunks": gen.n - m.get("dead", 0),
+            "rows": gen.n,
+            "dead": m.get("dead", 0),
+            "dim": gen.dim,
+            "quantize": m.get("quantize"),
+            "files": len([f for f in m.get("files", []) if f is not None]),
+            "kb_version": m.get("kb_version"),
+            "disk_mb": round(disk / 1024 / 1024, 2)
+        }
+
+
+def get_vector_index() -> CompactVectorIndex:
+    """vector_index dùng chung cho cả tiến trình"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            from embedding_cache import get_embeddings
+
+            _shared = CompactVectorIndex(embeddings=get_embeddings())
+        return _shared
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export collection Chroma sang vector_index (RETRIEVER_BACKEND=compact)")
+    parser.add_argument("--dir", default=VECTOR_INDEX_DIR, help="Thư mục index (mặc định: VECTOR_INDEX_DIR)")
+    parser.add_argument("--quantize", choices=["int8", "none"], default=VECTOR_INDEX_QUANTIZE)
+    parser.add_argument("--compact", action="store_true", help="Chỉ ghi lại generation, bỏ các dòng đã xóa")
+    args = parser.parse_args()
+
+    index = CompactVectorIndex(args.dir, quantize=args.quantize)
+    if args.compact:
+        index.compact()
+        print(f"[✅] Đã compact vector_index: {index.stats()}")
+    else:
+        print(f"[✅] Đã export từ Chroma: {index.rebuild_from_chroma(quantize=args.quantize)}")